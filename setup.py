@@ -4,6 +4,7 @@ setup(
     name='daspos-umbrella',
     version='0.4.0',
     packages=['umbrella'],
+    package_data={'umbrella': ['umbrella_schema.json']},
     url='https://github.com/crcresearch/daspos-umbrella',
     license='MIT License',
     author='Center for Research Computing, University of Notre Dame',
@@ -16,6 +16,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+__version__ = "0.4.0"  # Keep in sync with setup.py
 
-from .umbrella_specification import UmbrellaSpecification
-from .umbrella_components import *
\ No newline at end of file
+from .umbrella_specification import UmbrellaSpecification, validate_specifications
+from .umbrella_components import *
+from .umbrella_context import ValidationContext
\ No newline at end of file
@@ -0,0 +1,490 @@
+# This file is part of the daspos-umbrella package.
+#
+# For copyright and licensing information about this package, see the
+# NOTICE.txt and LICENSE.txt files in its top-level directory; they are
+# available at https://github.com/crcresearch/daspos-umbrella
+#
+# Licensed under the MIT License (MIT);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://opensource.org/licenses/MIT
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import argparse
+import cPickle
+import gc
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+
+from umbrella.misc import get_md5_and_file_size, DOWNLOAD_CHUNK_SIZE
+from umbrella.umbrella_components import Component, MissingComponentError, SPECIFICATION_ROOT_COMPONENT_NAMES
+from umbrella.umbrella_context import ValidationContext
+from umbrella.umbrella_errors import UmbrellaError, REQUIRED_ATTRIBUTE_MISSING_ERROR_CODE
+from umbrella.umbrella_generator import generate_specification
+from umbrella.umbrella_specification import UmbrellaSpecification
+from umbrella.umbrella_specification_cache import SpecificationCache
+
+DEFAULT_ENTRY_COUNTS = [1000, 10000, 100000]
+DEFAULT_DOWNLOAD_SIZES = [1024 ** 2, 16 * 1024 ** 2, 256 * 1024 ** 2]
+
+# Bounds of the growth of the peak resident memory, in bytes (see get_peak_memory). A download only ever holds a few
+# chunks, whatever its size. Validating a specification holds the FileInfo objects of one section at a time plus the
+# error log, so it grows with the entries and the errors but not with anything else. Measured on python 2.7 and
+# linux: about 300KB of base, 128KB for downloads of 1MB to 256MB, 370 bytes per entry and 1.3KB per error
+MEMORY_BASE_BOUND = 1024 * 1024
+DOWNLOAD_CHUNK_BOUND = 8 * DOWNLOAD_CHUNK_SIZE
+ENTRY_MEMORY_BOUND = 512
+ERROR_MEMORY_BOUND = 1536
+
+# Modules of the network, database, process pool and hashing layers. Importing umbrella and checking the structure of
+# a specification must load none of them
+COLD_START_LAZY_MODULES = ["urllib2", "httplib", "ssl", "sqlite3", "multiprocessing", "hashlib", "hmac", "xml.etree"]
+
+# Run by a new interpreter for each cold start, with the specification's json on stdin
+COLD_START_SCRIPT = """
+import json
+import sys
+import time
+
+start_time = time.time()
+import umbrella
+import_seconds = time.time() - start_time
+
+specification_text = sys.stdin.read()
+start_time = time.time()
+specification = umbrella.UmbrellaSpecification(specification_text, umbrella.ValidationContext(verify_downloads=False))
+specification.validate()
+first_validation_seconds = time.time() - start_time
+
+json.dump({
+    "import_seconds": import_seconds,
+    "first_validation_seconds": first_validation_seconds,
+    "error_count": len(specification.error_log),
+    "modules": [module_name for module_name, module in sys.modules.items() if module is not None],
+}, sys.stdout)
+"""
+
+
+def benchmark_structural_validation(entry_count, error_density=0.0, mirror_count=2, seed=0, profile_directory=None):
+    """
+    Times the structural validation (no downloads) of a generated specification. 80% of the entries are "data",
+    10% "software" and 10% package manager repositories. With a profile_directory, validate() is also profiled there,
+    which makes its timing meaningless.
+
+    :return: dictionary with the timings in seconds, the error count and the process' peak memory in kilobytes
+    """
+    specification_json, expected_error_count = generate_specification(
+        data_count=entry_count * 8 // 10, software_count=entry_count // 10, repository_count=entry_count // 10,
+        mirror_count=mirror_count, error_density=error_density, seed=seed
+    )
+    specification_text = json.dumps(specification_json)
+    context = ValidationContext(verify_downloads=False)
+
+    start_time = time.time()
+    umbrella_specification = UmbrellaSpecification(specification_text, context)
+    parse_seconds = time.time() - start_time
+
+    start_time = time.time()
+    umbrella_specification.validate(profile_directory=profile_directory)
+    validate_seconds = time.time() - start_time
+
+    if len(umbrella_specification.error_log) != expected_error_count:
+        raise AssertionError(
+            "Expected " + str(expected_error_count) + " errors, validate() found " +
+            str(len(umbrella_specification.error_log))
+        )
+
+    return {
+        "entry_count": entry_count,
+        "error_density": error_density,
+        "parse_seconds": parse_seconds,
+        "validate_seconds": validate_seconds,
+        "entries_per_second": entry_count / validate_seconds if validate_seconds else None,
+        "error_count": expected_error_count,
+        "component_seconds": get_component_seconds(umbrella_specification.specification_json, context),
+        "max_rss_kilobytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def get_component_seconds(specification_json, context):
+    # Time spent validating each root component, keyed by component class
+    component_seconds = {}
+
+    for component_name in SPECIFICATION_ROOT_COMPONENT_NAMES:
+        component = Component.get_specific_component(component_name, specification_json.get(component_name), context)
+        start_time = time.time()
+
+        try:
+            component.validate([])
+        except MissingComponentError:
+            pass
+
+        class_name = type(component).__name__
+        component_seconds[class_name] = component_seconds.get(class_name, 0.0) + time.time() - start_time
+
+    return component_seconds
+
+
+def benchmark_schema_validation(entry_count, error_density=0.0, seed=0):
+    """
+    Times the structural checks of every component and file entry of a generated specification, done by the
+    validators compiled from umbrella_schema.json and by the recursive validate_subcomponent() walk of the same rules.
+    Downloads and everything else validate() does are left out.
+
+    :return: dictionary with the seconds of each and the speedup of the compiled validators
+    """
+    specification_json, expected_error_count = generate_specification(
+        data_count=entry_count * 8 // 10, software_count=entry_count // 10, repository_count=entry_count // 10,
+        error_density=error_density, seed=seed
+    )
+    components = _get_dict_components(specification_json, ValidationContext(verify_downloads=False))
+    validators = dict((id(component), component.get_schema_validator()) for component in components)
+    required_keys = {}
+
+    for component in components:  # Built once per class, like the hand written rules were
+        key = (type(component), component.name)
+
+        if key not in required_keys:
+            required_keys[key] = component.required_keys
+
+    walk_errors = []
+    start_time = time.time()
+
+    for component in components:
+        _walk_required_keys(component, required_keys[(type(component), component.name)], walk_errors)
+
+    walk_seconds = time.time() - start_time
+
+    compiled_errors = []
+    start_time = time.time()
+
+    for component in components:
+        validator = validators[id(component)]
+
+        if validator is not None:
+            validator(component.component_json, compiled_errors, component.name, component.name)
+
+    compiled_seconds = time.time() - start_time
+
+    if sorted(error.error_code for error in compiled_errors) != sorted(error.error_code for error in walk_errors):
+        raise AssertionError("The compiled validators and the walk found different errors")
+
+    return {
+        "entry_count": entry_count,
+        "error_density": error_density,
+        "error_count": len(compiled_errors),
+        "walk_seconds": walk_seconds,
+        "compiled_seconds": compiled_seconds,
+        "speedup": walk_seconds / compiled_seconds if compiled_seconds else None,
+    }
+
+
+def _get_dict_components(specification_json, context):
+    # Root components that are dictionaries and the FileInfo objects of their artifacts
+    components = []
+
+    for component_name in SPECIFICATION_ROOT_COMPONENT_NAMES:
+        component = Component.get_specific_component(component_name, specification_json.get(component_name), context)
+
+        if isinstance(component.component_json, dict):
+            components.append(component)
+            components.extend(
+                file_info for file_info in component.get_file_infos() if isinstance(file_info.component_json, dict)
+            )
+
+    return components
+
+
+def _walk_required_keys(component, required_keys, error_log):
+    # How Component.validate() checked the keys before umbrella_schema.json was compiled
+    for key, info in required_keys.iteritems():
+        if key not in component.component_json:
+            umbrella_error = UmbrellaError(
+                error_code=REQUIRED_ATTRIBUTE_MISSING_ERROR_CODE,
+                description="Attribute \"" + str(key) + "\" is required",
+                may_be_temporary=False, component_name=component.name
+            )
+            error_log.append(umbrella_error)
+        else:
+            component.validate_subcomponent(error_log, component.component_json[key], info, key)
+
+
+def benchmark_specification_cache(entry_count, seed=0):
+    """
+    Times parsing and structurally validating a generated specification, which saves it in a SpecificationCache, and
+    then loading and validating it again from the cache. Downloads are left out.
+
+    :return: dictionary with the seconds of each, the sizes of the json and of the cache file, and the speedup
+    """
+    specification_json = generate_specification(
+        data_count=entry_count * 8 // 10, software_count=entry_count // 10, repository_count=entry_count // 10,
+        seed=seed
+    )[0]
+    specification_text = json.dumps(specification_json)
+    cache_directory = tempfile.mkdtemp()
+
+    try:
+        specification_cache = SpecificationCache(cache_directory)
+        context = ValidationContext(verify_downloads=False, specification_cache=specification_cache)
+
+        start_time = time.time()
+        umbrella_specification = UmbrellaSpecification(specification_text, context)
+        is_valid = umbrella_specification.validate()
+        json_seconds = time.time() - start_time
+
+        start_time = time.time()
+        cached_specification = UmbrellaSpecification(specification_text, context)
+        is_cached_valid = cached_specification.validate()
+        cached_seconds = time.time() - start_time
+
+        if not is_valid or not is_cached_valid or cached_specification.specification_json != specification_json:
+            raise AssertionError("The cached specification differs from the parsed one")
+
+        cache_file_size = os.path.getsize(specification_cache.get_path(specification_cache.get_key(specification_text)))
+    finally:
+        shutil.rmtree(cache_directory)
+
+    return {
+        "entry_count": entry_count,
+        "json_seconds": json_seconds,
+        "cached_seconds": cached_seconds,
+        "speedup": json_seconds / cached_seconds if cached_seconds else None,
+        "json_size": len(specification_text),
+        "cache_file_size": cache_file_size,
+    }
+
+
+def benchmark_cold_start(entry_count, error_density=0.0, seed=0, runs=5):
+    """
+    Times "import umbrella" and the first structural validation of a generated specification in new interpreters,
+    like a short lived command line or serverless invocation pays for them. Fails when one of
+    COLD_START_LAZY_MODULES was loaded.
+
+    :return: dictionary with the median seconds of each over the runs
+    """
+    specification_json, expected_error_count = generate_specification(
+        data_count=entry_count * 8 // 10, software_count=entry_count // 10, repository_count=entry_count // 10,
+        error_density=error_density, seed=seed
+    )
+    specification_text = json.dumps(specification_json)
+    environment = dict(os.environ)
+    package_directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    environment["PYTHONPATH"] = os.pathsep.join(filter(None, [package_directory, environment.get("PYTHONPATH")]))
+    results = []
+
+    for _ in xrange(runs):
+        process = subprocess.Popen(
+            [sys.executable, "-c", COLD_START_SCRIPT], stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=environment
+        )
+        output = process.communicate(specification_text)[0]
+
+        if process.returncode != 0:
+            raise RuntimeError("Cold start exited with " + str(process.returncode))
+
+        results.append(json.loads(output))
+
+    if results[0]["error_count"] != expected_error_count:
+        raise AssertionError(
+            "Expected " + str(expected_error_count) + " errors, validate() found " + str(results[0]["error_count"])
+        )
+
+    loaded_modules = sorted(
+        module_name for module_name in results[0]["modules"]
+        if any(module_name == lazy_name or module_name.startswith(lazy_name + ".") for lazy_name in COLD_START_LAZY_MODULES)
+    )
+
+    if loaded_modules:
+        raise AssertionError("Cold start loaded " + ", ".join(loaded_modules))
+
+    return {
+        "entry_count": entry_count,
+        "runs": runs,
+        "import_seconds": _get_median([result["import_seconds"] for result in results]),
+        "first_validation_seconds": _get_median([result["first_validation_seconds"] for result in results]),
+        "module_count": len(results[0]["modules"]),
+    }
+
+
+def _get_median(values):
+    values = sorted(values)
+
+    return values[len(values) // 2]
+
+
+def get_peak_memory(function, *args, **kwargs):
+    """
+    Runs function in a forked child process, whose peak resident memory starts from what it currently uses, so the
+    growth of ru_maxrss is what function needed at its peak. What it returns must be picklable.
+
+    :return: (what function returned, growth of the peak resident memory in bytes)
+    """
+    read_descriptor, write_descriptor = os.pipe()
+    process_id = os.fork()
+
+    if process_id == 0:
+        os.close(read_descriptor)
+        exit_code = 0
+
+        try:
+            gc.collect()
+            start_peak = _get_max_rss()
+            result = function(*args, **kwargs)
+            output = cPickle.dumps((result, _get_max_rss() - start_peak), cPickle.HIGHEST_PROTOCOL)
+        except BaseException:
+            output = cPickle.dumps(traceback.format_exc(), cPickle.HIGHEST_PROTOCOL)
+            exit_code = 1
+
+        with os.fdopen(write_descriptor, "wb") as output_file:
+            output_file.write(output)
+
+        os._exit(exit_code)
+
+    os.close(write_descriptor)
+
+    with os.fdopen(read_descriptor, "rb") as input_file:
+        output = cPickle.loads(input_file.read())
+
+    if os.waitpid(process_id, 0)[1] != 0:
+        raise RuntimeError("Memory benchmark failed in its child process:\n" + str(output))
+
+    return output
+
+
+def _get_max_rss():
+    # In bytes. Linux gives kilobytes, macOS bytes
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+def benchmark_download_memory(file_size):
+    # get_md5_and_file_size reading file_size bytes from a source that doesn't keep them must stay O(chunk)
+    (md5, bytes_processed), peak_memory = get_peak_memory(get_md5_and_file_size, _ZeroSource(file_size), file_size)
+    bound = MEMORY_BASE_BOUND + DOWNLOAD_CHUNK_BOUND
+
+    return _check_memory_bound(
+        {"file_size": bytes_processed, "peak_memory": peak_memory, "bound": bound}, peak_memory, bound
+    )
+
+
+def benchmark_validation_memory(entry_count, error_density=0.0, seed=0):
+    # validate() of an already parsed specification must stay O(entries + errors)
+    specification_json, error_count = generate_specification(
+        data_count=entry_count, software_count=0, repository_count=0, error_density=error_density, seed=seed
+    )
+    umbrella_specification = UmbrellaSpecification(specification_json, ValidationContext(verify_downloads=False))
+
+    # The schema validators are compiled once per process, so that isn't counted
+    UmbrellaSpecification(generate_specification(1, 0, 0)[0], ValidationContext(verify_downloads=False)).validate()
+
+    is_valid, peak_memory = get_peak_memory(umbrella_specification.validate)
+    bound = MEMORY_BASE_BOUND + entry_count * ENTRY_MEMORY_BOUND + error_count * ERROR_MEMORY_BOUND
+
+    return _check_memory_bound(
+        {
+            "entry_count": entry_count, "error_count": error_count, "peak_memory": peak_memory, "bound": bound,
+            "peak_memory_per_entry": float(peak_memory) / entry_count if entry_count else None,
+        },
+        peak_memory, bound
+    )
+
+
+def _check_memory_bound(result, peak_memory, bound):
+    if peak_memory > bound:
+        raise AssertionError("Peak memory of " + str(peak_memory) + " bytes broke its bound: " + json.dumps(result))
+
+    return result
+
+
+class _ZeroSource(object):
+    # File-like object of file_size zero bytes that never holds more than the chunk asked for
+    def __init__(self, file_size):
+        self.remaining_size = file_size
+
+    def read(self, size):
+        size = min(size, self.remaining_size)
+        self.remaining_size -= size
+
+        return "\0" * size
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark umbrella specification validation")
+    parser.add_argument("--entries", type=int, nargs="+", default=DEFAULT_ENTRY_COUNTS, help="Entries per specification")
+    parser.add_argument("--error-density", type=float, default=0.0, help="Share of the entries that are broken")
+    parser.add_argument("--mirrors", type=int, default=2, help="Sources of each entry")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--memory", action="store_true", help="Check the peak memory bounds instead of timing"
+    )
+    parser.add_argument(
+        "--download-sizes", type=int, nargs="+", default=DEFAULT_DOWNLOAD_SIZES, help="Download sizes for --memory"
+    )
+    parser.add_argument("--profile", help="Write the pstats and collapsed stacks of each validation under this directory")
+    parser.add_argument(
+        "--schema", action="store_true", help="Time the compiled schema validators against the recursive walk"
+    )
+    parser.add_argument(
+        "--cold-start", action="store_true",
+        help="Time importing umbrella and the first validation in new interpreters"
+    )
+    parser.add_argument("--runs", type=int, default=5, help="Interpreters started for each size by --cold-start")
+    parser.add_argument(
+        "--specification-cache", action="store_true",
+        help="Time loading specifications from a SpecificationCache against parsing and checking them"
+    )
+    arguments = parser.parse_args()
+
+    if arguments.specification_cache:
+        for entry_count in arguments.entries:
+            print json.dumps(benchmark_specification_cache(entry_count, arguments.seed), sort_keys=True)
+
+        return
+
+    if arguments.cold_start:
+        for entry_count in arguments.entries:
+            result = benchmark_cold_start(entry_count, arguments.error_density, arguments.seed, arguments.runs)
+            print json.dumps(result, sort_keys=True)
+
+        return
+
+    if arguments.schema:
+        for entry_count in arguments.entries:
+            result = benchmark_schema_validation(entry_count, arguments.error_density, arguments.seed)
+            print json.dumps(result, sort_keys=True)
+
+        return
+
+    if arguments.memory:
+        # A broken bound raises AssertionError, so the benchmark exits with an error
+        for file_size in arguments.download_sizes:
+            print json.dumps(benchmark_download_memory(file_size), sort_keys=True)
+
+        for entry_count in arguments.entries:
+            result = benchmark_validation_memory(entry_count, arguments.error_density, arguments.seed)
+            print json.dumps(result, sort_keys=True)
+
+        return
+
+    for entry_count in arguments.entries:
+        profile_directory = os.path.join(arguments.profile, str(entry_count)) if arguments.profile else None
+        result = benchmark_structural_validation(
+            entry_count, arguments.error_density, arguments.mirrors, arguments.seed, profile_directory
+        )
+        print json.dumps(result, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
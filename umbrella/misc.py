@@ -15,15 +15,55 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-import hashlib
+import importlib
+import re
+
+from umbrella.umbrella_errors import ValidationCancelledError
 
 
 DOWNLOAD_CHUNK_SIZE = 10240
+DEFAULT_RANGE_SIZE = 8 * 1024 * 1024  # Bytes of each range of a parallel download
+
+# Units are powers of 1024 whether or not they are written with an "i" (2GB == 2GiB), like Umbrella reads them
+BYTE_UNITS = {
+    "": 1, "B": 1,
+    "K": 1024, "KB": 1024, "KIB": 1024,
+    "M": 1024 ** 2, "MB": 1024 ** 2, "MIB": 1024 ** 2,
+    "G": 1024 ** 3, "GB": 1024 ** 3, "GIB": 1024 ** 3,
+    "T": 1024 ** 4, "TB": 1024 ** 4, "TIB": 1024 ** 4,
+    "P": 1024 ** 5, "PB": 1024 ** 5, "PIB": 1024 ** 5,
+}
+BYTE_SIZE_PATTERN = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*([a-zA-Z]*)\s*$")
+
+
+class LazyModule(object):
+    """
+    Stands for a module that is only imported when one of its attributes is first used. Importing umbrella and
+    running structural validations then never loads the network, database, process pool and hashing layers.
+    Attributes are looked up on the module every time, so they can still be replaced on it (in tests for example).
+    """
+    def __init__(self, module_name):
+        self.module_name = module_name
+        self._module = None
 
+    def __getattr__(self, name):
+        # Only called for the attributes the LazyModule doesn't have itself
+        if self._module is None:
+            self._module = importlib.import_module(self.module_name)
 
-def get_md5_and_file_size(data_source, supposed_file_size=None, callback_function=None, *args):
+        return getattr(self._module, name)
+
+
+_hashlib = LazyModule("hashlib")
+
+
+def get_md5_and_file_size(data_source, supposed_file_size=None, callback_function=None, *args, **kwargs):
+    # Every object in the "observers" keyword argument gets each chunk through update(data), like the md5 does, and
+    # finish() once the whole stream was read. This lets other checks share the single pass over the data.
+    observers = kwargs.get("observers", ())
+    cancel_event = kwargs.get("cancel_event")  # threading.Event that stops the download when set
     bytes_processed = 0
-    md5 = hashlib.md5()
+    md5 = _hashlib.md5()
 
     if supposed_file_size is None:
         percent_processed = -1
@@ -32,6 +72,9 @@ def get_md5_and_file_size(data_source, supposed_file_size=None, callback_functio
             callback_function(percent_processed, *args)
 
     while True:
+        if cancel_event is not None and cancel_event.is_set():
+            raise ValidationCancelledError("Download was cancelled")
+
         data = data_source.read(DOWNLOAD_CHUNK_SIZE)
 
         # There was no more data to read
@@ -41,7 +84,7 @@ def get_md5_and_file_size(data_source, supposed_file_size=None, callback_functio
         bytes_processed += len(data)
 
         if supposed_file_size:
-            percent_processed = float(bytes_processed / supposed_file_size * 100)
+            percent_processed = 100.0 * bytes_processed / supposed_file_size
 
             if percent_processed > 10:
                 if callback_function:
@@ -49,12 +92,37 @@ def get_md5_and_file_size(data_source, supposed_file_size=None, callback_functio
 
         md5.update(data)
 
+        for observer in observers:
+            observer.update(data)
+
+    for observer in observers:
+        if hasattr(observer, "finish"):
+            observer.finish()
+
     if callback_function:
         callback_function(100.0, *args)
 
     return md5.hexdigest(), bytes_processed
 
 
+def parse_byte_size(size):
+    """
+    Converts sizes such as "2GB", "512 MB", "1.5T" or "957" to a number of bytes
+
+    :param size: string or number
+    :return: int number of bytes
+    """
+    if isinstance(size, (int, long)):
+        return size
+
+    match = BYTE_SIZE_PATTERN.match(str(size))
+
+    if match is None or match.group(2).upper() not in BYTE_UNITS:
+        raise ValueError("Invalid size \"" + str(size) + '"')
+
+    return int(float(match.group(1)) * BYTE_UNITS[match.group(2).upper()])
+
+
 def get_callback_function(callback_function, *args, **kwargs):
     """
     Note that callback function must interpret first parameter as filename, and second as percentage
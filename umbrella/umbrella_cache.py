@@ -0,0 +1,73 @@
+# This file is part of the daspos-umbrella package.
+#
+# For copyright and licensing information about this package, see the
+# NOTICE.txt and LICENSE.txt files in its top-level directory; they are
+# available at https://github.com/crcresearch/daspos-umbrella
+#
+# Licensed under the MIT License (MIT);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://opensource.org/licenses/MIT
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import threading
+import time
+
+DEFAULT_CHECKSUM_CACHE_MAX_AGE = 24 * 60 * 60  # One day, in seconds
+
+MD5_KEY = "md5"
+FILE_SIZE_KEY = "file_size"
+TIME_KEY = "time"
+
+
+class ChecksumCache(object):
+    """
+    Remembers the md5 and file size calculated for a url so that later validations can skip the download.
+    This class is thread safe.
+    """
+    def __init__(self, max_age=DEFAULT_CHECKSUM_CACHE_MAX_AGE):
+        self.max_age = max_age
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, url):
+        with self._lock:
+            entry = self._entries.get(url)
+
+            if entry is None:
+                return None
+
+            if self.max_age is not None and time.time() - entry[TIME_KEY] > self.max_age:
+                del self._entries[url]
+                return None
+
+            return dict(entry)
+
+    def set(self, url, md5, file_size, **extra):
+        entry = dict(extra)
+        entry[MD5_KEY] = md5
+        entry[FILE_SIZE_KEY] = file_size
+        entry[TIME_KEY] = time.time()
+
+        with self._lock:
+            self._entries[url] = entry
+
+    def discard(self, url):
+        with self._lock:
+            self._entries.pop(url, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def __contains__(self, url):
+        return self.get(url) is not None
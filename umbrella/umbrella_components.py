@@ -15,17 +15,28 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-import urllib2
+import time
 
 from umbrella.umbrella_errors import MissingComponentError, ComponentTypeError, ProgrammingError, UmbrellaError, \
-    REQUIRED_ATTRIBUTE_MISSING_ERROR_CODE, WRONG_ATTRIBUTE_TYPE_ERROR_CODE, WRONG_FILE_SIZE_ERROR_CODE, \
-    WRONG_MD5_ERROR_CODE, BAD_URL_ERROR_CODE
-from umbrella.misc import get_md5_and_file_size
+    WRONG_ATTRIBUTE_TYPE_ERROR_CODE, WRONG_FILE_SIZE_ERROR_CODE, \
+    WRONG_MD5_ERROR_CODE, BAD_URL_ERROR_CODE, WRONG_UNCOMPRESSED_FILE_SIZE_ERROR_CODE, CORRUPT_ARCHIVE_ERROR_CODE, \
+    MIRROR_MISMATCH_ERROR_CODE, BAD_PACKAGE_LIST_ERROR_CODE, CONFLICTING_PACKAGES_ERROR_CODE, \
+    MISSING_PACKAGE_ERROR_CODE, TransportError
+from umbrella.misc import LazyModule, get_md5_and_file_size, parse_byte_size
+from umbrella.umbrella_cache import MD5_KEY, FILE_SIZE_KEY
+from umbrella.umbrella_context import get_context
+from umbrella.umbrella_packages import parse_package_list, get_conflicts
+from umbrella.umbrella_schema import TYPE, NEST, END_NEST, get_compiled_schema
+
+# Only needed once something is downloaded, so structural validations don't load them
+_hashlib = LazyModule("hashlib")
+_compression = LazyModule("umbrella.umbrella_compression")
+_manifest = LazyModule("umbrella.umbrella_manifest")
+_mirrors = LazyModule("umbrella.umbrella_mirrors")
+_repositories = LazyModule("umbrella.umbrella_repositories")
+_transports = LazyModule("umbrella.umbrella_transports")
 
 COMPONENT_NAME = "component_name"
-TYPE = "type"
-NEST = "nest"
-END_NEST = "end_nest"
 
 # Components
 SPECIFICATION_NAME = "comment"
@@ -73,16 +84,32 @@ SPECIFICATION_ROOT_COMPONENT_NAMES = [
 
 class Component(object):
     _type = (str, unicode)
-    _required_keys = {}
+    _schema_definition = None  # Definition of umbrella_schema.json that describes the component, instead of its section
     is_required = False
 
-    def __init__(self, component_name, component_json=None):
+    def __init__(self, component_name, component_json=None, context=None):
         self.name = component_name
         self.component_json = component_json
+        self.context = get_context(context)
 
     @property
     def required_keys(self):
-        return self._required_keys
+        # The schema's rules for this component in the format validate_subcomponent() walks
+        schema = get_compiled_schema()
+
+        if self._schema_definition is not None:
+            return schema.get_required_keys(definition_name=self._schema_definition)
+
+        return schema.get_required_keys(self.name)
+
+    def get_schema_validator(self):
+        # Validator compiled from umbrella_schema.json, or None when the schema doesn't describe the component
+        schema = get_compiled_schema()
+
+        if self._schema_definition is not None:
+            return schema.get_definition_validator(self._schema_definition)
+
+        return schema.get_section_validator(self.name)
 
     def validate(self, error_log, callback_function=None, *args):
         is_valid = True
@@ -101,22 +128,10 @@ class Component(object):
             )
 
         if isinstance(self.component_json, dict):  # Keys only apply to components that are dictionaries
-            for key, info in self._required_keys.iteritems():
-                if key not in self.component_json:  # Required key is missing
-                    is_valid = False
-                    umbrella_error = UmbrellaError(
-                        error_code=REQUIRED_ATTRIBUTE_MISSING_ERROR_CODE,
-                        description="Attribute \"" + str(key) + "\" is required",
-                        may_be_temporary=False,
-                        component_name=self.name
-                    )
-                    error_log.append(umbrella_error)
-                    # error_log.append("\"%s\" key is required in %s component" % (key, self.name))
-                else:  # Required key is there, now check if it is set up right
-                    if not self.validate_subcomponent(error_log, self.component_json[key], info, key):  # Call this recursive function and check all pieces
-                        is_valid = False
-        elif len(self._required_keys) > 0:
-            raise ProgrammingError("Check component \"" + str(self.name) + "\" and its _required_keys")
+            validator = self.get_schema_validator()
+
+            if validator is not None and not validator(self.component_json, error_log, self.name, self.name):
+                is_valid = False
 
         return is_valid
 
@@ -173,6 +188,10 @@ class Component(object):
 
         return is_valid
 
+    def get_file_infos(self):
+        # FileInfo objects for the artifacts this component lists. Only components with artifacts override this
+        return []
+
     def set_type(self, new_type):
         if isinstance(new_type, type):
             self._type = new_type
@@ -180,34 +199,8 @@ class Component(object):
             raise TypeError("New type must be of type \"type\". Confusing huh? :)")
 
     @staticmethod
-    def get_specific_component(component_name, component_json):
-        if not isinstance(component_name, (str, unicode)):
-            raise TypeError("component_name must be a string.")
-
-        if component_name == SPECIFICATION_NAME:
-            return NameComponent(component_name, component_json)
-        elif component_name == SPECIFICATION_DESCRIPTION:
-            return DescriptionComponent(component_name, component_json)
-        elif component_name == HARDWARE:
-            return HardwareComponent(component_name, component_json)
-        elif component_name == KERNEL:
-            return KernelComponent(component_name, component_json)
-        elif component_name == OS:
-            return OsComponent(component_name, component_json)
-        elif component_name == PACKAGE_MANAGER:
-            return PackageManagerComponent(component_name, component_json)
-        elif component_name == SOFTWARE:
-            return SoftwareComponent(component_name, component_json)
-        elif component_name == DATA_FILES:
-            return DataFileComponent(component_name, component_json)
-        elif component_name == ENVIRONMENT_VARIABLES:
-            return EnvironmentVariableComponent(component_name, component_json)
-        elif component_name == COMMANDS:
-            return CommandComponent(component_name, component_json)
-        elif component_name == OUTPUT:
-            return OutputComponent(component_name, component_json)
-        else:
-            raise ValueError("There is no component called " + str(component_name))
+    def get_specific_component(component_name, component_json, context=None):
+        return get_component_class(component_name)(component_name, component_json, context)
 
 
 class MissingComponent(Component):
@@ -217,88 +210,282 @@ class MissingComponent(Component):
 
 class FileInfo(Component):
     _type = dict
-    _required_keys = {
-        ID: {
-            TYPE: (str, unicode),
-        },
-        URL_SOURCES: {
-            TYPE: list,
-            NEST: {
-                TYPE: (str, unicode),
-            },
-        },
-        FILE_FORMAT: {
-            TYPE: (str, unicode),
-        },
-        MD5: {
-            TYPE: (str, unicode),
-        },
-        # FILE_SIZE should later be changed to int
-        FILE_SIZE: {
-            TYPE: (str, unicode),
-        },
-        MOUNT_POINT: {
-            TYPE: (str, unicode),
-        },
-    }
-
-    def __init__(self, file_name, component_name, component_json=None):
-        super(FileInfo, self).__init__(component_name, component_json)
+    _schema_definition = "file_entry"
+
+    def __init__(self, file_name, component_name, component_json=None, context=None):
+        super(FileInfo, self).__init__(component_name, component_json, context)
 
         self.file_name = file_name
 
     def validate(self, error_log, callback_function=None, *args):
+        with self.context.profile(self.file_name):
+            return self._validate(error_log, callback_function, *args)
+
+    def _validate(self, error_log, callback_function=None, *args):
         is_valid = super(FileInfo, self).validate(error_log)
 
-        if is_valid:
-            if not isinstance(self.component_json[URL_SOURCES], list):
-                raise TypeError('"' + URL_SOURCES + '"' + " must be a list")
+        if is_valid and self.context.verify_downloads and not self.check_sources(error_log, callback_function, *args):
+            is_valid = False
 
-            file_info = self._get_file_info()
+        return is_valid
 
-            for url in file_info[URL_SOURCES]:
-                md5, file_size = self._get_md5_and_file_size(error_log, url, file_info, callback_function, *args)
+    def check_sources(self, error_log, callback_function=None, *args):
+        # The download part of validate(), for an entry that is known to be structurally valid
+        if not isinstance(self.component_json[URL_SOURCES], list):
+            raise TypeError('"' + URL_SOURCES + '"' + " must be a list")
 
-                if file_size and file_size != int(file_info[FILE_SIZE]):
-                    is_valid = False
-                    umbrella_error = UmbrellaError(
-                        error_code=WRONG_FILE_SIZE_ERROR_CODE,
-                        description="File size was " + str(file_size) +
-                                    " bytes but the specification says it should be " + str(file_info[FILE_SIZE]) +
-                                    " bytes",
-                        may_be_temporary=False,
-                        component_name=self.name,
-                        file_name=file_info[FILE_NAME],
-                        url=url
-                    )
-                    error_log.append(umbrella_error)
-                    # error_log.append(
-                    #     "The file named " + str(file_info[FILE_NAME]) + " on component " + str(file_info[COMPONENT_NAME]) +
-                    #     " had a file size of " + str(file_size) + " but the specification says it should be " +
-                    #     str(file_info[FILE_SIZE])
-                    # )
-
-                if md5 and md5 != file_info[MD5]:
-                    is_valid = False
-                    umbrella_error = UmbrellaError(
-                        error_code=WRONG_MD5_ERROR_CODE,
-                        description="Checksum was \"" + str(md5) + "\" but the specification says it should be " +
-                                    str(file_info[MD5]),
-                        may_be_temporary=False,
-                        component_name=self.name,
-                        file_name=file_info[FILE_NAME],
-                        url=url
-                    )
-                    error_log.append(umbrella_error)
-                    # error_log.append(
-                    #     "The file named " + str(file_info[FILE_NAME]) + " on component " +
-                    #     str(file_info[COMPONENT_NAME]) + " from the url source of " + str(url) +
-                    #     " had a calculated md5 of " + str(md5) + " but the specification says it should be " +
-                    #     str(file_info[MD5])
-                    # )
+        if self.context.planner is not None:  # The planner downloads each unique source once, later
+            self.context.planner.add(self, error_log, callback_function, *args)
+
+            return True
+
+        return self.verify_sources(error_log, self.component_json[URL_SOURCES], callback_function, *args)
+
+    def verify_sources(self, error_log, urls, callback_function=None, *args):
+        scoreboard = self.context.mirror_scoreboard
+
+        if scoreboard is not None and len(urls) > 1:
+            return self._verify_mirrors(error_log, urls, scoreboard, callback_function, *args)
+
+        is_valid = True
+
+        for url in urls:
+            if not self.verify_source(error_log, url, callback_function, *args):
+                is_valid = False
+
+        return is_valid
+
+    def _verify_mirrors(self, error_log, urls, scoreboard, callback_function=None, *args):
+        # Only the fastest mirror is downloaded in full. The others must agree with it on their first bytes and size
+        probes = _mirrors.probe_mirrors(scoreboard.order(urls), scoreboard, transports=self.context.transports)
+        fastest_probe = _mirrors.get_fastest_probe(probes)
+
+        if fastest_probe is None:
+            return self._check_probes(error_log, probes, None)
+
+        is_valid = self.verify_source(error_log, fastest_probe.url, callback_function, *args)
+
+        if not self._check_probes(error_log, probes, fastest_probe):
+            is_valid = False
 
         return is_valid
 
+    def _check_probes(self, error_log, probes, fastest_probe):
+        is_valid = True
+
+        for probe in probes:
+            if probe is fastest_probe:
+                continue
+
+            if probe.error is not None:
+                umbrella_error = UmbrellaError(
+                    error_code=BAD_URL_ERROR_CODE, description="Url error \"" + str(probe.error) + '"',
+                    may_be_temporary=True, component_name=self.name, file_name=self.file_name, url=probe.url
+                )
+                error_log.append(umbrella_error)
+                continue
+
+            # A prefix that holds the whole file can be checked completely
+            md5 = _hashlib.md5(probe.prefix).hexdigest() if probe.is_complete else None
+
+            if not self.check_source(error_log, probe.url, md5, probe.total_size):
+                is_valid = False
+
+            length = min(len(probe.prefix), len(fastest_probe.prefix))
+
+            if probe.prefix[:length] != fastest_probe.prefix[:length]:
+                is_valid = False
+                umbrella_error = UmbrellaError(
+                    error_code=MIRROR_MISMATCH_ERROR_CODE,
+                    description="The first " + str(length) + " bytes differ from the ones of " + str(fastest_probe.url),
+                    may_be_temporary=False,
+                    component_name=self.name,
+                    file_name=self.file_name,
+                    url=probe.url
+                )
+                error_log.append(umbrella_error)
+
+        return is_valid
+
+    def verify_source(self, error_log, url, callback_function=None, *args):
+        md5, file_size, observers = self.download_source(error_log, url, callback_function, *args)
+
+        return self.check_source(error_log, url, md5, file_size, observers)
+
+    def download_source(self, error_log, url, callback_function=None, *args):
+        file_info = self._get_file_info()
+        observers = self._get_observers()
+        error_budget = self.context.error_budget
+        cancel_event = error_budget.cancel_event if error_budget is not None else None
+        md5, file_size = self._get_md5_and_file_size(
+            error_log, url, file_info, callback_function, *args, observers=observers, cancel_event=cancel_event
+        )
+
+        return md5, file_size, observers
+
+    def check_source(self, error_log, url, md5, file_size, observers=()):
+        is_valid = True
+        file_info = self._get_file_info()
+
+        if file_size and file_size != int(file_info[FILE_SIZE]):
+            is_valid = False
+            umbrella_error = UmbrellaError(
+                error_code=WRONG_FILE_SIZE_ERROR_CODE,
+                description="File size was " + str(file_size) +
+                            " bytes but the specification says it should be " + str(file_info[FILE_SIZE]) +
+                            " bytes",
+                may_be_temporary=False,
+                component_name=self.name,
+                file_name=file_info[FILE_NAME],
+                url=url
+            )
+            error_log.append(umbrella_error)
+            # error_log.append(
+            #     "The file named " + str(file_info[FILE_NAME]) + " on component " + str(file_info[COMPONENT_NAME]) +
+            #     " had a file size of " + str(file_size) + " but the specification says it should be " +
+            #     str(file_info[FILE_SIZE])
+            # )
+
+        if md5 and md5 != file_info[MD5]:
+            is_valid = False
+            umbrella_error = UmbrellaError(
+                error_code=WRONG_MD5_ERROR_CODE,
+                description="Checksum was \"" + str(md5) + "\" but the specification says it should be " +
+                            str(file_info[MD5]),
+                may_be_temporary=False,
+                component_name=self.name,
+                file_name=file_info[FILE_NAME],
+                url=url
+            )
+            error_log.append(umbrella_error)
+            # error_log.append(
+            #     "The file named " + str(file_info[FILE_NAME]) + " on component " +
+            #     str(file_info[COMPONENT_NAME]) + " from the url source of " + str(url) +
+            #     " had a calculated md5 of " + str(md5) + " but the specification says it should be " +
+            #     str(file_info[MD5])
+            # )
+
+        if md5 is not None and self.context.check_decompression and \
+                not self._validate_decompression(error_log, url, file_info, observers):
+            is_valid = False
+
+        if is_valid and md5 is not None:
+            self._save_manifest(md5, observers)
+            self._save_repository_config(md5, observers)
+
+        return is_valid
+
+    def _save_manifest(self, md5, observers):
+        # Only the manifests of archives that matched their checksum are kept
+        for manifest_reader in self._get_manifest_readers(observers):
+            if manifest_reader.error is None:
+                self.context.manifest_store.save(md5, manifest_reader.members)
+
+    def _get_manifest_readers(self, observers):
+        # Those of compressed tars are behind the decompression checker, and have nothing to say when it failed
+        for observer in observers:
+            if isinstance(observer, _compression.DecompressionChecker):
+                if observer.error is not None:
+                    return []
+
+                observers = observer.output_observers
+
+        return [observer for observer in observers if isinstance(observer, _manifest.TarManifestReader)]
+
+    def _save_repository_config(self, md5, observers):
+        # Package repositories are indexed from the verified config, when a specification resolves its packages
+        for observer in observers:
+            if isinstance(observer, _repositories.RepositoryConfigReader) and observer.error is None:
+                self.context.repository_index.save_config(md5, observer.content)
+
+    def _validate_decompression(self, error_log, url, file_info, observers):
+        is_valid = True
+
+        for checker in observers:
+            if not isinstance(checker, _compression.DecompressionChecker):
+                continue
+
+            if checker.error is not None:
+                is_valid = False
+                umbrella_error = UmbrellaError(
+                    error_code=CORRUPT_ARCHIVE_ERROR_CODE,
+                    description="Archive of format \"" + str(file_info[FILE_FORMAT]) + "\" could not be decompressed: " +
+                                str(checker.error),
+                    may_be_temporary=False,
+                    component_name=self.name,
+                    file_name=file_info[FILE_NAME],
+                    url=url
+                )
+                error_log.append(umbrella_error)
+            elif file_info[UNCOMPRESSED_FILE_SIZE] is not None and \
+                    checker.uncompressed_size != int(file_info[UNCOMPRESSED_FILE_SIZE]):
+                is_valid = False
+                umbrella_error = UmbrellaError(
+                    error_code=WRONG_UNCOMPRESSED_FILE_SIZE_ERROR_CODE,
+                    description="Uncompressed file size was " + str(checker.uncompressed_size) +
+                                " bytes but the specification says it should be " +
+                                str(file_info[UNCOMPRESSED_FILE_SIZE]) + " bytes",
+                    may_be_temporary=False,
+                    component_name=self.name,
+                    file_name=file_info[FILE_NAME],
+                    url=url
+                )
+                error_log.append(umbrella_error)
+
+        # The tar inside was read too when the manifest is kept
+        for manifest_reader in self._get_manifest_readers(observers):
+            if manifest_reader.error is not None:
+                is_valid = False
+                umbrella_error = UmbrellaError(
+                    error_code=CORRUPT_ARCHIVE_ERROR_CODE,
+                    description="Archive of format \"" + str(file_info[FILE_FORMAT]) + "\" is not a valid tar: " +
+                                str(manifest_reader.error),
+                    may_be_temporary=False,
+                    component_name=self.name,
+                    file_name=file_info[FILE_NAME],
+                    url=url
+                )
+                error_log.append(umbrella_error)
+
+        return is_valid
+
+    def _get_observers(self):
+        observers = []
+        file_format = self.component_json[FILE_FORMAT]
+        manifest_store = self.context.manifest_store
+        checker = None
+
+        if self.context.check_decompression:
+            checker = _compression.get_decompression_checker(file_format)
+
+            if checker is not None:
+                observers.append(checker)
+
+        # The tar headers are read from the same pass over the data
+        if manifest_store is not None and _manifest.is_tar_format(file_format) and \
+                not manifest_store.contains(self.component_json[MD5]):
+            manifest_reader = _manifest.TarManifestReader()
+
+            if file_format.lower() in _manifest.TAR_FORMATS:
+                observers.append(manifest_reader)
+            else:
+                if checker is None:
+                    checker = _compression.get_decompression_checker(file_format)
+
+                    if checker is not None:
+                        observers.append(checker)
+
+                if checker is not None:  # Without it (xz without lzma) the manifest can't be read
+                    checker.output_observers.append(manifest_reader)
+
+        repository_index = self.context.repository_index
+
+        if repository_index is not None and self.name == PACKAGE_MANAGER and \
+                not repository_index.contains_config(self.component_json[MD5]):
+            observers.append(_repositories.RepositoryConfigReader())
+
+        return observers
+
     def _get_file_info(self):
         file_info = {}
 
@@ -307,84 +494,149 @@ class FileInfo(Component):
         file_info[URL_SOURCES] = self.component_json[URL_SOURCES]
         file_info[MD5] = self.component_json[MD5]
         file_info[FILE_SIZE] = self.component_json[FILE_SIZE]
+        file_info[FILE_FORMAT] = self.component_json[FILE_FORMAT]
+        file_info[UNCOMPRESSED_FILE_SIZE] = self.component_json.get(UNCOMPRESSED_FILE_SIZE)
 
         return file_info
 
-    def _get_md5_and_file_size(self, error_log, the_file_or_url, file_info, callback_function=None, *args):
+    def _get_md5_and_file_size(self, error_log, the_file_or_url, file_info, callback_function=None, *args, **kwargs):
         if hasattr(the_file_or_url, "read"):
-            return self._get_md5_and_file_size_via_file(the_file_or_url, file_info[FILE_SIZE], callback_function, *args)
+            return self._get_md5_and_file_size_via_file(
+                the_file_or_url, file_info[FILE_SIZE], callback_function, *args, **kwargs
+            )
         elif isinstance(the_file_or_url, (str, unicode)):
-            return self._get_md5_and_file_size_via_url(error_log, the_file_or_url, file_info, callback_function, *args)
+            return self._get_md5_and_file_size_via_url(
+                error_log, the_file_or_url, file_info, callback_function, *args, **kwargs
+            )
         else:
             raise ValueError("the_file_or_url must be a file or a string form of a url")
 
-    def _get_md5_and_file_size_via_file(self, the_file, actual_file_size, callback_function=None, *args):
+    def _get_md5_and_file_size_via_file(self, the_file, actual_file_size, callback_function=None, *args, **kwargs):
         if not hasattr(the_file, "read"):
             raise ValueError("the_file must be an open file ")
 
-        return get_md5_and_file_size(the_file, actual_file_size, callback_function, *args)
+        return get_md5_and_file_size(the_file, actual_file_size, callback_function, *args, **kwargs)
 
-    def _get_md5_and_file_size_via_url(self, error_log, url, file_info, callback_function=None, *args):
+    def _get_md5_and_file_size_via_url(self, error_log, url, file_info, callback_function=None, *args, **kwargs):
         if not isinstance(url, (str, unicode)):
             raise ValueError("Url must be in string form ")
 
+        observers = kwargs.get("observers", ())
+        cancel_event = kwargs.get("cancel_event")
+        checksum_cache = self.context.checksum_cache
+
+        if checksum_cache is not None:
+            cached = checksum_cache.get(url)
+
+            # Observers that can't be restored from the cached entry need the data, so the download happens anyway
+            if cached is not None and all(observer.load_cache_fields(cached) for observer in observers):
+                self.context.notify("download_cached", component_name=self.name, file_name=self.file_name, url=url)
+
+                return cached[MD5_KEY], cached[FILE_SIZE_KEY]
+
+        artifact_store = self.context.artifact_store
+
+        if artifact_store is not None:
+            stored_file = artifact_store.open(file_info[MD5])
+
+            # The store only holds verified bytes, so the network isn't needed to know what this checksum contains
+            if stored_file is not None:
+                self.context.notify("download_stored", component_name=self.name, file_name=self.file_name, url=url)
+
+                with stored_file:
+                    return get_md5_and_file_size(
+                        stored_file, None, callback_function, *args, observers=observers, cancel_event=cancel_event
+                    )
+
+        self.context.notify("download_started", component_name=self.name, file_name=self.file_name, url=url)
+
+        scoreboard = self.context.mirror_scoreboard
+        timeout = scoreboard.get_timeout(url) if scoreboard is not None else None
+        start = time.time()
+
         try:
-            remote = urllib2.urlopen(url)
-        except urllib2.HTTPError as error:
-            umbrella_error = UmbrellaError(
-                error_code=BAD_URL_ERROR_CODE, description="Http error \"" + str(error) + '"',
-                may_be_temporary=True, component_name=str(file_info[COMPONENT_NAME]), file_name=str(file_info[FILE_NAME]),
-                url=str(url)
+            remote = _transports.open_source(
+                self.context.get_transport(url), url, timeout, self.context.range_connections, self.context.range_size
             )
-            error_log.append(umbrella_error)
+        except TransportError as error:
+            self._report_transport_error(error_log, url, file_info, error)
 
             return None, None
-        except urllib2.URLError as error:
-            umbrella_error = UmbrellaError(
-                error_code=BAD_URL_ERROR_CODE, description="Url error \"" + str(error) + '"',
-                may_be_temporary=True, component_name=str(file_info[COMPONENT_NAME]), file_name=str(file_info[FILE_NAME]),
-                url=str(url)
+
+        # Get the file_size from the source. Some websites (old ones) may not give this information
+        file_size_from_url = remote.size
+
+        def progress(percentage, *callback_args):
+            self.context.notify(
+                "download_progress", component_name=self.name, file_name=self.file_name, url=url, percentage=percentage
             )
-            error_log.append(umbrella_error)
 
-            return None, None
+            if callback_function:
+                callback_function(percentage, *callback_args)
+
+        if artifact_store is not None:
+            store_writer = artifact_store.get_writer(file_info[MD5], file_info[FILE_SIZE])
+            observers = list(observers) + [store_writer]
+        else:
+            store_writer = None
 
-        # Get the file_size from the website. Some websites (old ones) may not give this information
         try:
-            file_size_from_url = int(remote.headers["content-length"])
-        except KeyError:
-            file_size_from_url = None
+            md5, file_size = get_md5_and_file_size(
+                remote, file_size_from_url, progress, *args, observers=observers, cancel_event=cancel_event
+            )
+        except TransportError as error:  # A range of a parallel download kept failing
+            if store_writer is not None:
+                store_writer.abort()
+
+            self._report_transport_error(error_log, url, file_info, error)
+
+            return None, None
+        except:
+            if store_writer is not None:
+                store_writer.abort()
+            raise
+        finally:
+            remote.close()
+
+        if store_writer is not None:
+            store_writer.commit(md5, file_size)
+
+        if scoreboard is not None:
+            scoreboard.record_success(url, None, file_size, time.time() - start)
+
+        if checksum_cache is not None:
+            cache_fields = {}
+
+            for observer in observers:
+                cache_fields.update(observer.get_cache_fields())
+
+            checksum_cache.set(url, md5, file_size, **cache_fields)
+
+        self.context.notify(
+            "download_finished", component_name=self.name, file_name=self.file_name, url=url, md5=md5,
+            file_size=file_size, validators=remote.validators
+        )
 
-        return get_md5_and_file_size(remote, file_size_from_url, callback_function, *args)
+        return md5, file_size
+
+    def _report_transport_error(self, error_log, url, file_info, error):
+        if self.context.mirror_scoreboard is not None:
+            self.context.mirror_scoreboard.record_failure(url)
+
+        umbrella_error = UmbrellaError(
+            error_code=BAD_URL_ERROR_CODE, description=str(error),
+            may_be_temporary=True, component_name=str(file_info[COMPONENT_NAME]), file_name=str(file_info[FILE_NAME]),
+            url=str(url)
+        )
+        error_log.append(umbrella_error)
 
 
 class OsFileInfo(FileInfo):
-    _required_keys = {
-        ID: {
-            TYPE: (str, unicode),
-        },
-        URL_SOURCES: {
-            TYPE: list,
-            NEST: {
-                TYPE: (str, unicode),
-            },
-        },
-        FILE_FORMAT: {
-            TYPE: (str, unicode),
-        },
-        MD5: {
-            TYPE: (str, unicode),
-        },
-        # FILE_SIZE should later be changed to int
-        FILE_SIZE: {
-            TYPE: (str, unicode),
-        },
-    }
+    _schema_definition = "os_file_entry"
 
 
 class NameComponent(Component):
     _type = (str, unicode)
-    _required_keys = {}
     is_required = False
 
     def validate(self, error_log, callback_function=None, *args):
@@ -395,7 +647,6 @@ class NameComponent(Component):
 
 class DescriptionComponent(Component):
     _type = (str, unicode)
-    _required_keys = {}
     is_required = False
 
     def validate(self, error_log, callback_function=None, *args):
@@ -406,20 +657,6 @@ class DescriptionComponent(Component):
 
 class HardwareComponent(Component):
     _type = dict
-    _required_keys = {
-        ARCHITECTURE: {
-            TYPE: (str, unicode),
-        },
-        CORES: {  # CORES should be converted to int later.
-            TYPE: (str, unicode),
-        },
-        MEMORY: {  # MEMORY should be converted to int later. In addition, this will require it to be converted from 2gb to 2097152 (kb) or whatever seems to be a sensible measurement
-            TYPE: (str, unicode),
-        },
-        DISK_SPACE: {  # DISK_SPACE should be converted to int later. In addition, this will require it to be converted from 2gb to 2097152 (kb) or whatever seems to be a sensible measurement
-            TYPE: (str, unicode),
-        },
-    }
     is_required = True
 
     def validate(self, error_log, callback_function=None, *args):
@@ -427,17 +664,28 @@ class HardwareComponent(Component):
 
         return is_valid
 
+    def get_cores(self):
+        return self._get_number(CORES, int)
+
+    def get_memory(self):
+        return self._get_number(MEMORY, parse_byte_size)
+
+    def get_disk_space(self):
+        return self._get_number(DISK_SPACE, parse_byte_size)
+
+    def _get_number(self, key, parse_function):
+        # None when the key is missing or can't be read
+        if not isinstance(self.component_json, dict) or key not in self.component_json:
+            return None
+
+        try:
+            return parse_function(self.component_json[key])
+        except (TypeError, ValueError):
+            return None
+
 
 class KernelComponent(Component):
     _type = dict
-    _required_keys = {
-        NAME: {
-            TYPE: (str, unicode),
-        },
-        VERSION: {
-            TYPE: (str, unicode),
-        },
-    }
     is_required = True
 
     def validate(self, error_log, callback_function=None, *args):
@@ -448,122 +696,183 @@ class KernelComponent(Component):
 
 class OsComponent(Component):
     _type = dict
-    _required_keys = {
-        NAME: {
-            TYPE: (str, unicode),
-        },
-        VERSION: {
-            TYPE: (str, unicode),
-        },
-    }
     is_required = True
 
     def validate(self, error_log, callback_function=None, *args):
         is_valid = super(OsComponent, self).validate(error_log)
 
-        file_info = OsFileInfo(self.component_json[FILE_NAME], OS, self.component_json)
-
-        if not file_info.validate(error_log, callback_function, *args):
-            is_valid = False
+        for file_info in self.get_file_infos():
+            if not file_info.validate(error_log, callback_function, *args):
+                is_valid = False
 
         return is_valid
 
+    def get_file_infos(self):
+        # A missing name is already reported by validate(), so it shouldn't stop the file checks
+        return [OsFileInfo(self.component_json.get(FILE_NAME, OS), OS, self.component_json, self.context)]
+
 
 class PackageManagerComponent(Component):
     _type = dict
-    _required_keys = {
-        NAME: {
-            TYPE: (str, unicode),
-        },
-        PACKAGES: {  # PACKAGES should be converted to list later
-            TYPE: (str, unicode),
-        },
-        REPOSITORIES: {
-            TYPE: dict,
-            NEST: {
-                TYPE: dict,
-                NEST: END_NEST,  # END_NEST is used to stop nest checking at this point
-            },
-        },
-    }
     is_required = False
 
     def validate(self, error_log, callback_function=None, *args):
         is_valid = super(PackageManagerComponent, self).validate(error_log, callback_function, *args)
 
-        if REPOSITORIES in self.component_json and isinstance(self.component_json[REPOSITORIES], dict):
-            for repository_name, repository_file_info in self.component_json[REPOSITORIES].iteritems():
-                file_info = FileInfo(repository_name, self.name, repository_file_info)
+        if isinstance(self.component_json.get(PACKAGES), (str, unicode)) and not self._validate_packages(error_log):
+            is_valid = False
 
-                if not file_info.validate(error_log, callback_function, *args):
-                    is_valid = False
+        for file_info in self.get_file_infos():
+            if not file_info.validate(error_log, callback_function, *args):
+                is_valid = False
 
         return is_valid
 
+    def get_packages(self):
+        # List of PackageRequirement. Empty when the list is missing or can't be read
+        try:
+            return parse_package_list(self.component_json[PACKAGES])
+        except (KeyError, TypeError, AttributeError, ValueError):
+            return []
+
+    def resolve_packages(self, warning_log, variables=None):
+        """
+        Looks for the packages in the repositories of the configs, with the context's repository index. A package
+        that isn't found is only a warning since it may come from the repositories of the os itself. Nothing is
+        resolved unless every config was verified, and so saved in the index.
+
+        :param variables: yum variables of the specification. See get_repository_variables()
+        :return: list of the PackageRequirement that no repository satisfies
+        """
+        repository_index = self.context.repository_index
+        index_ids = []
+
+        for file_info in self.get_file_infos():
+            try:
+                index_id = repository_index.get_index_id(str(file_info.component_json[MD5]), variables)
+            except (TransportError, ValueError) as error:
+                self.context.notify(
+                    "repository_index_failed", component_name=self.name, file_name=file_info.file_name, error=str(error)
+                )
+                return []
+            except (KeyError, TypeError, AttributeError):
+                return []
+
+            if index_id is None:
+                return []
+
+            index_ids.append(index_id)
+
+        if not index_ids:
+            return []
+
+        unresolved = repository_index.find_unresolved(index_ids, self.get_packages())
+
+        for requirement in unresolved:
+            newest_version = _repositories.get_newest_version(repository_index.get_versions(index_ids, requirement.name))
+
+            if newest_version is None:
+                description = "Package \"" + str(requirement.name) + "\" is not in the configured repositories"
+            else:
+                description = "Package \"" + str(requirement) + "\" is not in the configured repositories, which have " + \
+                              "version " + str(newest_version[0]) + "-" + str(newest_version[1])
+
+            umbrella_error = UmbrellaError(
+                error_code=MISSING_PACKAGE_ERROR_CODE, description=description, may_be_temporary=False,
+                component_name=self.name
+            )
+            warning_log.append(umbrella_error)
+
+        return unresolved
+
+    def _validate_packages(self, error_log):
+        try:
+            requirements = parse_package_list(self.component_json[PACKAGES])
+        except ValueError as error:
+            umbrella_error = UmbrellaError(
+                error_code=BAD_PACKAGE_LIST_ERROR_CODE, description=str(error), may_be_temporary=False,
+                component_name=self.name
+            )
+            error_log.append(umbrella_error)
+
+            return False
+
+        conflicts = get_conflicts(requirements)
+
+        for name in conflicts:
+            umbrella_error = UmbrellaError(
+                error_code=CONFLICTING_PACKAGES_ERROR_CODE,
+                description="Versions required of package \"" + str(name) + "\" can't all be installed: " +
+                            ", ".join(str(requirement) for requirement in requirements if requirement.name == name),
+                may_be_temporary=False, component_name=self.name
+            )
+            error_log.append(umbrella_error)
+
+        return not conflicts
+
+    def get_file_infos(self):
+        if REPOSITORIES not in self.component_json or not isinstance(self.component_json[REPOSITORIES], dict):
+            return []
+
+        return [
+            FileInfo(repository_name, self.name, repository_file_info, self.context)
+            for repository_name, repository_file_info in self.component_json[REPOSITORIES].iteritems()
+        ]
+
 
 class SoftwareComponent(Component):
     _type = dict
-    _required_keys = {}
     is_required = False
 
     def validate(self, error_log, callback_function=None, *args):
         is_valid = super(SoftwareComponent, self).validate(error_log, callback_function, *args)
 
-        for software_name, software_file_info in self.component_json.iteritems():
-            file_info = FileInfo(software_name, self.name, software_file_info)
-
+        for file_info in self.get_file_infos():
             if not file_info.validate(error_log):
                 is_valid = False
 
         return is_valid
 
+    def get_file_infos(self):
+        return [
+            FileInfo(software_name, self.name, software_file_info, self.context)
+            for software_name, software_file_info in self.component_json.iteritems()
+        ]
+
 
 class DataFileComponent(Component):
     _type = dict
-    _required_keys = {}
     is_required = False
 
     def validate(self, error_log, callback_function=None, *args):
         is_valid = super(DataFileComponent, self).validate(error_log, callback_function, *args)
 
-        for data_file_name, data_file_info in self.component_json.iteritems():
-            file_info = FileInfo(data_file_name, self.name, data_file_info)
-
+        for file_info in self.get_file_infos():
             if not file_info.validate(error_log):
                 is_valid = False
 
         return is_valid
 
+    def get_file_infos(self):
+        return [
+            FileInfo(data_file_name, self.name, data_file_info, self.context)
+            for data_file_name, data_file_info in self.component_json.iteritems()
+        ]
+
 
 class EnvironmentVariableComponent(Component):
     _type = dict
-    _required_keys = {}
     is_required = False
 
     def validate(self, error_log, callback_function=None, *args):
+        # Every value must be a string, which the schema checks
         is_valid = super(EnvironmentVariableComponent, self).validate(error_log, callback_function, *args)
 
-        for environment_variable, value in self.component_json.iteritems():
-            if not isinstance(value, (str, unicode)):
-                is_valid = False
-                umbrella_error = UmbrellaError(
-                    error_code=WRONG_ATTRIBUTE_TYPE_ERROR_CODE,
-                    description="Attribute is of type \"" + str(value.__class__.__name__) + "\" but should be of type \"" +
-                                str((str.__name__, unicode.__name__)) + "\"",
-                    may_be_temporary=False,
-                    component_name=self.name,
-                )
-                # error_log.append(
-                #     "Environment variable \"" + str(environment_variable) + "\" on component \"" + str(self.name) +
-                #     "\" is of type \"" + str(type(value)) + "\" but should be of type \"str\""
-                # )
-
         return is_valid
 
 
 class CommandComponent(Component):
     _type = (str, unicode)
-    _required_keys = {}
     is_required = False
 
     def validate(self, error_log, callback_function=None, *args):
@@ -574,23 +883,55 @@ class CommandComponent(Component):
 
 class OutputComponent(Component):
     _type = dict
-    _required_keys = {
-        FILES: {
-            TYPE: list,
-            NEST: {
-                TYPE: (str, unicode),
-            },
-        },
-        DIRECTORIES: {
-            TYPE: list,
-            NEST: {
-                TYPE: (str, unicode),
-            },
-        },
-    }
     is_required = True
 
     def validate(self, error_log, callback_function=None, *args):
         is_valid = super(OutputComponent, self).validate(error_log, callback_function, *args)
 
-        return is_valid
\ No newline at end of file
+        return is_valid
+
+
+# Class of each root section of a specification. See register_component()
+COMPONENT_CLASSES = {
+    SPECIFICATION_NAME: NameComponent,
+    SPECIFICATION_DESCRIPTION: DescriptionComponent,
+    HARDWARE: HardwareComponent,
+    KERNEL: KernelComponent,
+    OS: OsComponent,
+    PACKAGE_MANAGER: PackageManagerComponent,
+    SOFTWARE: SoftwareComponent,
+    DATA_FILES: DataFileComponent,
+    ENVIRONMENT_VARIABLES: EnvironmentVariableComponent,
+    COMMANDS: CommandComponent,
+    OUTPUT: OutputComponent,
+}
+
+
+def get_component_class(component_name):
+    if not isinstance(component_name, (str, unicode)):
+        raise TypeError("component_name must be a string.")
+
+    try:
+        return COMPONENT_CLASSES[component_name]
+    except KeyError:
+        raise ValueError("There is no component called " + str(component_name))
+
+
+def register_component(component_name, component_class):
+    """
+    Makes specifications validate the section component_name with component_class, which replaces the class of a
+    known section or adds a new one. A new section is validated after the known ones. Sections that aren't in
+    umbrella_schema.json only get the checks of their class.
+
+    :param component_class: subclass of Component, built as component_class(component_name, component_json, context)
+    """
+    if not isinstance(component_name, (str, unicode)):
+        raise TypeError("component_name must be a string.")
+
+    if not isinstance(component_class, type) or not issubclass(component_class, Component):
+        raise TypeError("component_class must be a subclass of Component")
+
+    COMPONENT_CLASSES[component_name] = component_class
+
+    if component_name not in SPECIFICATION_ROOT_COMPONENT_NAMES:
+        SPECIFICATION_ROOT_COMPONENT_NAMES.append(component_name)
@@ -0,0 +1,162 @@
+# This file is part of the daspos-umbrella package.
+#
+# For copyright and licensing information about this package, see the
+# NOTICE.txt and LICENSE.txt files in its top-level directory; they are
+# available at https://github.com/crcresearch/daspos-umbrella
+#
+# Licensed under the MIT License (MIT);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://opensource.org/licenses/MIT
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import bz2
+import zlib
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:  # xz archives can't be checked without lzma (pip install backports.lzma on python 2)
+        lzma = None
+
+GZIP_FORMATS = ["tgz", "gz", "gzip", "tar.gz"]
+BZIP2_FORMATS = ["tbz", "tbz2", "bz2", "bzip2", "tar.bz2"]
+XZ_FORMATS = ["txz", "xz", "tar.xz"]
+
+UNCOMPRESSED_SIZE_KEY = "uncompressed_size"
+ARCHIVE_ERROR_KEY = "archive_error"
+
+DECOMPRESSION_ERRORS = (zlib.error, IOError, EOFError, ValueError)
+
+if lzma is not None:
+    DECOMPRESSION_ERRORS += (lzma.LZMAError,)
+
+
+class DecompressionChecker(object):
+    """
+    Decompresses a stream chunk by chunk while it is being hashed, counting the uncompressed bytes and recording the
+    first integrity problem found. Nothing is written to disk and nothing is kept in memory besides the decompressor.
+
+    Decompressed data is passed to every object in output_observers (anything with an update(data) method).
+    """
+    def __init__(self):
+        self.uncompressed_size = 0
+        self.error = None
+        self.output_observers = []
+        self._decompressor = self._get_decompressor()
+
+    def update(self, data):
+        if self.error is not None:
+            return
+
+        try:
+            while data:
+                self._output(self._decompressor.decompress(data))
+                data = self._get_next_stream_data()
+        except DECOMPRESSION_ERRORS as error:
+            self.error = str(error)
+
+    def finish(self):
+        if self.error is None and not self._is_at_end_of_stream():
+            self.error = "Archive is truncated"
+
+        for observer in self.output_observers:
+            if hasattr(observer, "finish"):
+                observer.finish()
+
+    def get_cache_fields(self):
+        return {UNCOMPRESSED_SIZE_KEY: self.uncompressed_size, ARCHIVE_ERROR_KEY: self.error}
+
+    def load_cache_fields(self, cached):
+        if UNCOMPRESSED_SIZE_KEY not in cached or self.output_observers:
+            return False
+
+        self.uncompressed_size = cached[UNCOMPRESSED_SIZE_KEY]
+        self.error = cached[ARCHIVE_ERROR_KEY]
+
+        return True
+
+    def _output(self, data):
+        if data:
+            self.uncompressed_size += len(data)
+
+            for observer in self.output_observers:
+                observer.update(data)
+
+    def _get_next_stream_data(self):
+        # Archives may hold several concatenated streams (pigz, pbzip2). Whatever follows a finished stream is the start
+        # of the next one. Zero padding after the last stream is ignored, like gzip does.
+        unused_data = self._decompressor.unused_data
+
+        if not unused_data or not unused_data.strip("\0"):
+            return None
+
+        self._decompressor = self._get_decompressor()
+
+        return unused_data
+
+    def _get_decompressor(self):
+        raise NotImplementedError()
+
+    def _is_at_end_of_stream(self):
+        raise NotImplementedError()
+
+
+class GzipChecker(DecompressionChecker):
+    def _get_decompressor(self):
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)  # 16 makes zlib expect and verify the gzip header and trailer
+
+    def _is_at_end_of_stream(self):
+        # Python 2 decompress objects don't know if they reached the end, but only a finished stream leaves input unused
+        probe = self._decompressor.copy()
+
+        try:
+            probe.decompress("\0")
+        except zlib.error:
+            return False
+
+        return bool(probe.unused_data)
+
+
+class Bzip2Checker(DecompressionChecker):
+    def _get_decompressor(self):
+        return bz2.BZ2Decompressor()
+
+    def _is_at_end_of_stream(self):
+        try:
+            self._decompressor.decompress("")
+        except EOFError:  # Raised only once the end of stream marker was seen
+            return True
+
+        return False
+
+
+class XzChecker(DecompressionChecker):
+    def _get_decompressor(self):
+        return lzma.LZMADecompressor()
+
+    def _is_at_end_of_stream(self):
+        return self._decompressor.eof
+
+
+def get_decompression_checker(file_format):
+    if not isinstance(file_format, (str, unicode)):
+        return None
+
+    file_format = file_format.lower()
+
+    if file_format in GZIP_FORMATS:
+        return GzipChecker()
+    elif file_format in BZIP2_FORMATS:
+        return Bzip2Checker()
+    elif file_format in XZ_FORMATS and lzma is not None:
+        return XzChecker()
+    else:
+        return None
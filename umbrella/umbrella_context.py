@@ -0,0 +1,88 @@
+# This file is part of the daspos-umbrella package.
+#
+# For copyright and licensing information about this package, see the
+# NOTICE.txt and LICENSE.txt files in its top-level directory; they are
+# available at https://github.com/crcresearch/daspos-umbrella
+#
+# Licensed under the MIT License (MIT);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://opensource.org/licenses/MIT
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from umbrella.misc import LazyModule, DEFAULT_RANGE_SIZE
+from umbrella.umbrella_profiling import NO_SECTION
+
+_transports = LazyModule("umbrella.umbrella_transports")
+
+
+class ValidationContext(object):
+    """
+    Settings and state shared by every component of one or more validations.
+
+    A context can be reused between UmbrellaSpecification objects (for example by the validation daemon) so that
+    caches stay warm. Listeners are called as listener(event, **fields) and must not raise.
+    """
+    def __init__(self, verify_downloads=True, checksum_cache=None, listeners=None, check_decompression=False,
+                 artifact_store=None, planner=None, mirror_scoreboard=None, error_budget=None, schedule=None,
+                 download_workers=1, sampler=None, profiler=None, transports=None, range_connections=1,
+                 range_size=DEFAULT_RANGE_SIZE, manifest_store=None, repository_index=None,
+                 specification_cache=None):
+        self.verify_downloads = verify_downloads
+        self.check_decompression = check_decompression
+        self.checksum_cache = checksum_cache
+        self.artifact_store = artifact_store
+        self.planner = planner
+        self.mirror_scoreboard = mirror_scoreboard
+        self.error_budget = error_budget
+        self.schedule = schedule
+        self.download_workers = download_workers
+        self.sampler = sampler
+        self.profiler = profiler
+        self.transports = transports  # TransportRegistry. DEFAULT_TRANSPORTS when None
+        self.range_connections = range_connections  # More than 1 fetches big sources by ranges in parallel
+        self.range_size = range_size
+        self.manifest_store = manifest_store  # ManifestStore that keeps the member listings of verified tar archives
+        self.repository_index = repository_index  # RepositoryIndex that resolves the packages of the package manager
+        self.specification_cache = specification_cache  # SpecificationCache of parsed, structurally valid specifications
+        self.listeners = list(listeners) if listeners else []
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def notify(self, event, **fields):
+        for listener in self.listeners:
+            listener(event, **fields)
+
+    def get_transport(self, url):
+        return _transports.get_transport(url, self.transports)
+
+    def profile(self, label):
+        # Section of the validation, used as "with context.profile(label):", that the profiler reports on its own
+        if self.profiler is None:
+            return NO_SECTION
+
+        return self.profiler.section(label)
+
+    def copy(self, **changes):
+        the_copy = ValidationContext.__new__(ValidationContext)
+        the_copy.__dict__.update(self.__dict__)
+        the_copy.listeners = list(self.listeners)
+        the_copy.__dict__.update(changes)
+
+        return the_copy
+
+
+def get_context(context):
+    if context is None:
+        return ValidationContext()
+
+    if not isinstance(context, ValidationContext):
+        raise TypeError("context must be a ValidationContext")
+
+    return context
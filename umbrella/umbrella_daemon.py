@@ -0,0 +1,280 @@
+# This file is part of the daspos-umbrella package.
+#
+# For copyright and licensing information about this package, see the
+# NOTICE.txt and LICENSE.txt files in its top-level directory; they are
+# available at https://github.com/crcresearch/daspos-umbrella
+#
+# Licensed under the MIT License (MIT);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://opensource.org/licenses/MIT
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import argparse
+import BaseHTTPServer
+import json
+import os
+import socket
+import SocketServer
+import threading
+
+from umbrella.umbrella_cache import ChecksumCache
+from umbrella.umbrella_context import ValidationContext
+from umbrella.umbrella_errors import JsonError
+from umbrella.umbrella_mirrors import MirrorScoreboard
+from umbrella.umbrella_specification import UmbrellaSpecification
+from umbrella.umbrella_specification_cache import SpecificationCache
+from umbrella.umbrella_store import ArtifactStore
+
+DEFAULT_HTTP_HOST = "127.0.0.1"
+DEFAULT_HTTP_PORT = 8585
+VALIDATE_HTTP_PATH = "/validate"
+
+# Request keys
+SPECIFICATION_KEY = "specification"
+PATH_KEY = "path"
+VERIFY_DOWNLOADS_KEY = "verify_downloads"
+CHECK_DECOMPRESSION_KEY = "check_decompression"
+
+# Message keys and events
+EVENT_KEY = "event"
+ACCEPTED_EVENT = "accepted"
+FAILED_EVENT = "failed"
+ERROR_EVENT = "error"
+RESULT_EVENT = "result"
+
+STREAMED_EVENTS = [
+    "download_started", "download_cached", "download_stored", "download_progress", "download_finished",
+]
+
+
+class ValidationDaemon(object):
+    """
+    Validates specifications for many callers while keeping the checksum cache warm between requests.
+
+    A request is a dictionary holding either "specification" (json text or an already parsed dictionary) or "path"
+    (a specification file on the daemon's machine), and optionally "verify_downloads" and "check_decompression".
+    Every message sent back is a dictionary with an "event" key. The last message of a request is always a "result"
+    or a "failed" event.
+    """
+    def __init__(self, checksum_cache=None, artifact_store=None, mirror_scoreboard=None, specification_cache=None):
+        if checksum_cache is None:
+            checksum_cache = ChecksumCache()
+
+        self.checksum_cache = checksum_cache
+        self.context = ValidationContext(
+            checksum_cache=checksum_cache, artifact_store=artifact_store, mirror_scoreboard=mirror_scoreboard,
+            specification_cache=specification_cache
+        )
+
+    def handle_request(self, request, send_message):
+        # False when the validation itself broke, the caller then closes the connection
+        try:
+            specification = self._get_specification(request)
+            umbrella_specification = UmbrellaSpecification(specification, self._get_context(request, send_message))
+        except (JsonError, IOError, TypeError, ValueError) as error:
+            send_message({EVENT_KEY: FAILED_EVENT, "description": str(error)})
+            return True
+
+        send_message({EVENT_KEY: ACCEPTED_EVENT})
+
+        try:
+            is_valid = umbrella_specification.validate()
+        except Exception as error:
+            send_message({EVENT_KEY: FAILED_EVENT, "description": "Validation failed: " + repr(error)})
+            return False
+
+        for error in umbrella_specification.error_log:
+            send_message({EVENT_KEY: ERROR_EVENT, "error": error.json})
+
+        send_message({EVENT_KEY: RESULT_EVENT, "is_valid": is_valid, "error_count": len(umbrella_specification.error_log)})
+
+        return True
+
+    def _get_specification(self, request):
+        if not isinstance(request, dict):
+            raise TypeError("Request must be a json object")
+
+        if SPECIFICATION_KEY in request:
+            return request[SPECIFICATION_KEY]
+        elif PATH_KEY in request:
+            with open(request[PATH_KEY]) as specification_file:
+                return specification_file.read()
+        else:
+            raise ValueError("Request must contain \"" + SPECIFICATION_KEY + "\" or \"" + PATH_KEY + '"')
+
+    def _get_context(self, request, send_message):
+        context = self.context.copy(
+            verify_downloads=bool(request.get(VERIFY_DOWNLOADS_KEY, True)),
+            check_decompression=bool(request.get(CHECK_DECOMPRESSION_KEY, False))
+        )
+        context.add_listener(_MessageStreamer(send_message))
+
+        return context
+
+
+class _MessageStreamer(object):
+    # Forwards download events to the caller. Progress is only sent when the whole percentage changes.
+    def __init__(self, send_message):
+        self.send_message = send_message
+        self.last_percentages = {}
+        self._lock = threading.Lock()  # Downloads may run in several threads
+
+    def __call__(self, event, **fields):
+        if event not in STREAMED_EVENTS:
+            return
+
+        if event == "download_progress":
+            percentage = int(fields["percentage"])
+
+            if self.last_percentages.get(fields["url"]) == percentage:
+                return
+
+            self.last_percentages[fields["url"]] = percentage
+
+        message = dict(fields)
+        message[EVENT_KEY] = event
+
+        with self._lock:
+            self.send_message(message)
+
+
+class UnixSocketRequestHandler(SocketServer.StreamRequestHandler):
+    # One json request per line. Several requests may be sent over the same connection.
+    def handle(self):
+        for line in iter(self.rfile.readline, ""):
+            line = line.strip()
+
+            if not line:
+                continue
+
+            try:
+                request = json.loads(line)
+            except ValueError:
+                self.send_message({EVENT_KEY: FAILED_EVENT, "description": "Request was invalid json"})
+                continue
+
+            if not self.server.validation_daemon.handle_request(request, self.send_message):
+                return
+
+    def send_message(self, message):
+        self.wfile.write(json.dumps(message) + "\n")
+        self.wfile.flush()
+
+
+class HttpRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # POST a json request to /validate. Messages are streamed back as newline delimited json.
+    def do_POST(self):
+        if self.path != VALIDATE_HTTP_PATH:
+            self.send_error(404)
+            return
+
+        try:
+            content_length = int(self.headers.getheader("content-length", 0))
+            request = json.loads(self.rfile.read(content_length))
+        except ValueError:
+            self.send_error(400, "Request was invalid json")
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+
+        if not self.server.validation_daemon.handle_request(request, self.send_message):
+            self.close_connection = 1
+
+    def send_message(self, message):
+        self.wfile.write(json.dumps(message) + "\n")
+        self.wfile.flush()
+
+
+class ThreadingUnixStreamServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+
+class ThreadingHttpServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+def get_unix_socket_server(socket_path, validation_daemon=None):
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+
+    server = ThreadingUnixStreamServer(socket_path, UnixSocketRequestHandler)
+    server.validation_daemon = validation_daemon or ValidationDaemon()
+
+    return server
+
+
+def get_http_server(host=DEFAULT_HTTP_HOST, port=DEFAULT_HTTP_PORT, validation_daemon=None):
+    server = ThreadingHttpServer((host, port), HttpRequestHandler)
+    server.validation_daemon = validation_daemon or ValidationDaemon()
+
+    return server
+
+
+def request_validation(socket_path, request):
+    """
+    Sends one request to a daemon listening on a unix socket and yields its messages as they arrive
+
+    :param socket_path: path of the daemon's unix socket
+    :param request: dictionary as described in ValidationDaemon
+    :return: generator of message dictionaries, ending with a "result" or "failed" event
+    """
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(socket_path)
+
+    try:
+        client.sendall(json.dumps(request) + "\n")
+        server_file = client.makefile("r")
+
+        for line in iter(server_file.readline, ""):
+            message = json.loads(line)
+            yield message
+
+            if message[EVENT_KEY] in (RESULT_EVENT, FAILED_EVENT):
+                break
+    finally:
+        client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve umbrella specification validation requests")
+    parser.add_argument("--socket", help="Listen on this unix socket path")
+    parser.add_argument("--host", default=DEFAULT_HTTP_HOST, help="Http host to listen on")
+    parser.add_argument("--port", type=int, default=DEFAULT_HTTP_PORT, help="Http port to listen on")
+    parser.add_argument("--store", help="Keep verified artifacts in this directory and serve later requests from it")
+    parser.add_argument("--store-max-size", type=int, help="Maximum size of the artifact store in bytes")
+    parser.add_argument("--mirror-scoreboard", help="Pick the fastest mirrors using the scoreboard kept in this file")
+    parser.add_argument(
+        "--specification-cache", help="Keep parsed specifications in this directory so they aren't parsed and checked again"
+    )
+    arguments = parser.parse_args()
+
+    artifact_store = ArtifactStore(arguments.store, arguments.store_max_size) if arguments.store else None
+    mirror_scoreboard = MirrorScoreboard(arguments.mirror_scoreboard) if arguments.mirror_scoreboard else None
+    specification_cache = SpecificationCache(arguments.specification_cache) if arguments.specification_cache else None
+    validation_daemon = ValidationDaemon(
+        artifact_store=artifact_store, mirror_scoreboard=mirror_scoreboard, specification_cache=specification_cache
+    )
+
+    if arguments.socket:
+        server = get_unix_socket_server(arguments.socket, validation_daemon)
+    else:
+        server = get_http_server(arguments.host, arguments.port, validation_daemon)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,455 @@
+# This file is part of the daspos-umbrella package.
+#
+# For copyright and licensing information about this package, see the
+# NOTICE.txt and LICENSE.txt files in its top-level directory; they are
+# available at https://github.com/crcresearch/daspos-umbrella
+#
+# Licensed under the MIT License (MIT);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://opensource.org/licenses/MIT
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import argparse
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+from umbrella.umbrella_components import FileInfo
+from umbrella.umbrella_context import get_context
+from umbrella.umbrella_errors import UmbrellaError, WORK_ITEM_FAILED_ERROR_CODE
+from umbrella.umbrella_planner import VerificationPlanner
+from umbrella.umbrella_specification import UmbrellaSpecification
+
+DEFAULT_LEASE_SECONDS = 600.0
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_POLL_INTERVAL = 5.0
+
+# Work item states
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"  # Every attempt failed or its lease expired
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS work_items (
+    id INTEGER PRIMARY KEY,
+    batch TEXT NOT NULL,
+    key TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    lease_owner TEXT,
+    lease_expires REAL,
+    last_error TEXT,
+    result TEXT,
+    UNIQUE (batch, key)
+);
+CREATE TABLE IF NOT EXISTS work_item_references (
+    work_item_id INTEGER NOT NULL REFERENCES work_items (id) ON DELETE CASCADE,
+    specification_id TEXT NOT NULL,
+    component_name TEXT,
+    file_name TEXT
+);
+CREATE TABLE IF NOT EXISTS specifications (
+    batch TEXT NOT NULL,
+    specification_id TEXT NOT NULL,
+    is_structurally_valid INTEGER NOT NULL,
+    structural_errors TEXT NOT NULL,
+    PRIMARY KEY (batch, specification_id)
+);
+CREATE INDEX IF NOT EXISTS work_items_state ON work_items (state, id);
+CREATE INDEX IF NOT EXISTS work_item_references_item ON work_item_references (work_item_id);
+"""
+
+
+class WorkQueue(object):
+    """
+    Durable queue of work items in an SQLite file. Workers lease items for lease_seconds. An item whose lease expires
+    before it is completed, or whose worker reports a failure, is handed out again until it was attempted
+    max_attempts times, then it is failed.
+
+    Every process opens its own WorkQueue. Workers on other nodes can share the file over a network file system that
+    supports SQLite's locking.
+    """
+    def __init__(self, path, lease_seconds=DEFAULT_LEASE_SECONDS, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.connection = sqlite3.connect(path, timeout=60.0, isolation_level=None)  # Transactions are explicit
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def put(self, batch, key, payload, references):
+        """
+        :param references: (specification id, component name, file name) tuples. They are added to the ones of an
+            item that was already put in the batch with the same key, unless it already has them
+        """
+        with _Transaction(self.connection):
+            self.connection.execute(
+                "INSERT OR IGNORE INTO work_items (batch, key, payload, state) VALUES (?, ?, ?, ?)",
+                (batch, key, json.dumps(payload), PENDING)
+            )
+            work_item_id = self.connection.execute(
+                "SELECT id FROM work_items WHERE batch = ? AND key = ?", (batch, key)
+            ).fetchone()[0]
+            self.connection.executemany(
+                "INSERT INTO work_item_references (work_item_id, specification_id, component_name, file_name) "
+                "SELECT ?, ?, ?, ? WHERE NOT EXISTS (SELECT 1 FROM work_item_references WHERE work_item_id = ? "
+                "AND specification_id = ? AND component_name IS ? AND file_name IS ?)",
+                [(work_item_id,) + tuple(reference) + (work_item_id,) + tuple(reference) for reference in references]
+            )
+
+        return work_item_id
+
+    def lease(self, worker_id, batch=None, count=1):
+        """
+        :return: list of (work item id, payload) now leased to worker_id
+        """
+        now = time.time()
+
+        with _Transaction(self.connection):
+            self._fail_expired(now)
+
+            query = "SELECT id, payload FROM work_items WHERE (state = ? OR (state = ? AND lease_expires < ?))"
+            parameters = [PENDING, LEASED, now]
+
+            if batch is not None:
+                query += " AND batch = ?"
+                parameters.append(batch)
+
+            rows = self.connection.execute(query + " ORDER BY id LIMIT ?", parameters + [count]).fetchall()
+
+            for work_item_id, payload in rows:
+                self.connection.execute(
+                    "UPDATE work_items SET state = ?, attempts = attempts + 1, lease_owner = ?, lease_expires = ? "
+                    "WHERE id = ?",
+                    (LEASED, worker_id, now + self.lease_seconds, work_item_id)
+                )
+
+        return [(work_item_id, json.loads(payload)) for work_item_id, payload in rows]
+
+    def renew(self, work_item_id, worker_id):
+        return self._update_lease(
+            work_item_id, worker_id, "lease_expires = ?", (time.time() + self.lease_seconds,)
+        )
+
+    def complete(self, work_item_id, worker_id, result):
+        # False when the lease was lost (it expired and the item went to another worker), the result is then dropped
+        return self._update_lease(
+            work_item_id, worker_id, "state = ?, result = ?, lease_owner = NULL", (DONE, json.dumps(result))
+        )
+
+    def fail(self, work_item_id, worker_id, reason):
+        return self._update_lease(
+            work_item_id, worker_id,
+            "state = CASE WHEN attempts < ? THEN ? ELSE ? END, last_error = ?, lease_owner = NULL",
+            (self.max_attempts, PENDING, FAILED, str(reason))
+        )
+
+    def get_counts(self, batch):
+        self._expire()
+
+        return dict(self.connection.execute(
+            "SELECT state, COUNT(*) FROM work_items WHERE batch = ? GROUP BY state", (batch,)
+        ).fetchall())
+
+    def is_finished(self, batch):
+        counts = self.get_counts(batch)
+
+        return not counts.get(PENDING) and not counts.get(LEASED)
+
+    def get_work_items(self, batch):
+        # (work item id, state, result or None, last error or None, [(specification id, component name, file name)])
+        references = {}
+
+        for row in self.connection.execute(
+            "SELECT work_item_id, specification_id, component_name, file_name FROM work_item_references "
+            "JOIN work_items ON work_items.id = work_item_id WHERE batch = ?", (batch,)
+        ):
+            references.setdefault(row[0], []).append(row[1:])
+
+        return [
+            (work_item_id, state, json.loads(result) if result else None, last_error, references.get(work_item_id, []))
+            for work_item_id, state, result, last_error in self.connection.execute(
+                "SELECT id, state, result, last_error FROM work_items WHERE batch = ? ORDER BY id", (batch,)
+            )
+        ]
+
+    def _update_lease(self, work_item_id, worker_id, assignments, parameters):
+        with _Transaction(self.connection):
+            cursor = self.connection.execute(
+                "UPDATE work_items SET " + assignments + " WHERE id = ? AND state = ? AND lease_owner = ?",
+                tuple(parameters) + (work_item_id, LEASED, worker_id)
+            )
+
+        return cursor.rowcount == 1
+
+    def _expire(self):
+        with _Transaction(self.connection):
+            self._fail_expired(time.time())
+
+    def _fail_expired(self, now):
+        # Expired leases of items that can't be retried any more. The others are leased again by lease()
+        self.connection.execute(
+            "UPDATE work_items SET state = ?, last_error = ?, lease_owner = NULL "
+            "WHERE state = ? AND lease_expires < ? AND attempts >= ?",
+            (FAILED, "Lease expired", LEASED, now, self.max_attempts)
+        )
+
+
+class Coordinator(object):
+    """
+    Splits a batch of specifications into one work item per unique source (the VerificationPlanner's grouping), puts
+    them in the queue and, once workers have verified them, puts each specification's error log back together.
+    """
+    def __init__(self, work_queue, context=None):
+        self.work_queue = work_queue
+        self.context = get_context(context)
+
+    def submit(self, batch, specifications):
+        """
+        Checks the structure of the specifications here and queues their downloads
+
+        :param batch: name of the batch
+        :param specifications: dictionary of UmbrellaSpecification objects by specification id (such as their path)
+        :return: number of work items queued
+        """
+        planner = VerificationPlanner()
+        context = self.context.copy(planner=planner, verify_downloads=True, error_budget=None, sampler=None)
+        references = {}
+
+        for specification_id, specification in sorted(specifications.items()):
+            specification.context = context
+            is_valid = specification.validate()
+
+            with _Transaction(self.work_queue.connection):
+                self.work_queue.connection.execute(
+                    "INSERT OR REPLACE INTO specifications "
+                    "(batch, specification_id, is_structurally_valid, structural_errors) VALUES (?, ?, ?, ?)",
+                    (batch, specification_id, int(is_valid),
+                     json.dumps([error.json for error in specification.error_log]))
+                )
+
+            references[id(specification.error_log)] = specification_id
+
+        for work_item in planner.work_items:
+            file_info = work_item.references[0][0]
+            payload = {
+                "urls": work_item.urls,
+                "component_name": file_info.name,
+                "file_name": file_info.file_name,
+                "component_json": file_info.component_json,
+                "check_decompression": context.check_decompression,
+            }
+            self.work_queue.put(
+                batch, json.dumps(planner.get_key(file_info, work_item.urls)), payload,
+                [
+                    (references[id(error_log)], reference.name, reference.file_name)
+                    for reference, error_log in work_item.references
+                ]
+            )
+
+        return len(planner.work_items)
+
+    def collect(self, batch):
+        """
+        :return: dictionary of (is_valid, list of UmbrellaError) by specification id. Work items that aren't finished
+            yet are left out, see is_finished()
+        """
+        results = {}
+
+        for specification_id, is_valid, structural_errors in self.work_queue.connection.execute(
+            "SELECT specification_id, is_structurally_valid, structural_errors FROM specifications WHERE batch = ?",
+            (batch,)
+        ):
+            results[specification_id] = [
+                bool(is_valid), [UmbrellaError(**error_json) for error_json in json.loads(structural_errors)]
+            ]
+
+        for work_item_id, state, result, last_error, references in self.work_queue.get_work_items(batch):
+            if state == DONE:
+                is_valid = result["is_valid"]
+                errors = [UmbrellaError(**error_json) for error_json in result["errors"]]
+            elif state == FAILED:
+                is_valid = False
+                errors = [UmbrellaError(
+                    error_code=WORK_ITEM_FAILED_ERROR_CODE,
+                    description="Verification failed after " + str(self.work_queue.max_attempts) + " attempts: " +
+                                str(last_error),
+                    may_be_temporary=True
+                )]
+            else:
+                continue
+
+            for specification_id, component_name, file_name in references:
+                result = results[specification_id]
+                result[1].extend(error.copy(component_name=component_name, file_name=file_name) for error in errors)
+
+                if not is_valid:
+                    result[0] = False
+
+        return dict((specification_id, tuple(result)) for specification_id, result in results.iteritems())
+
+    def is_finished(self, batch):
+        return self.work_queue.is_finished(batch)
+
+    def wait(self, batch, poll_interval=DEFAULT_POLL_INTERVAL, timeout=None):
+        start = time.time()
+
+        while not self.is_finished(batch):
+            if timeout is not None and time.time() - start > timeout:
+                raise RuntimeError("Batch \"" + batch + "\" did not finish within " + str(timeout) + " seconds")
+
+            time.sleep(poll_interval)
+
+        return self.collect(batch)
+
+
+class Worker(object):
+    # Leases work items and verifies them with FileInfo, using its own context (checksum cache, artifact store, ...)
+    def __init__(self, work_queue, context=None, worker_id=None):
+        self.work_queue = work_queue
+        self.context = get_context(context)
+        self.worker_id = worker_id or socket.gethostname() + ":" + str(os.getpid())
+
+    def run_once(self, batch=None):
+        # Verifies one work item. False when there was nothing to lease
+        leased = self.work_queue.lease(self.worker_id, batch)
+
+        if not leased:
+            return False
+
+        work_item_id, payload = leased[0]
+        heartbeat = _LeaseHeartbeat(self.work_queue, work_item_id, self.worker_id)
+        heartbeat.start()
+
+        try:
+            result = self.verify(payload)
+        except Exception as error:
+            heartbeat.stop()
+            self.work_queue.fail(work_item_id, self.worker_id, repr(error))
+        else:
+            heartbeat.stop()
+            self.work_queue.complete(work_item_id, self.worker_id, result)
+
+        return True
+
+    def run(self, batch=None, poll_interval=DEFAULT_POLL_INTERVAL, idle_timeout=None):
+        """
+        Verifies work items until there are none left for idle_timeout seconds (forever when None)
+
+        :return: number of work items verified
+        """
+        count = 0
+        idle_since = time.time()
+
+        while True:
+            if self.run_once(batch):
+                count += 1
+                idle_since = time.time()
+                continue
+
+            if idle_timeout is not None and time.time() - idle_since >= idle_timeout:
+                return count
+
+            time.sleep(poll_interval)
+
+    def verify(self, payload):
+        context = self.context.copy(
+            planner=None, verify_downloads=True, check_decompression=payload["check_decompression"]
+        )
+        file_info = FileInfo(payload["file_name"], payload["component_name"], payload["component_json"], context)
+        error_log = []
+        is_valid = file_info.verify_sources(error_log, payload["urls"])
+
+        return {"is_valid": is_valid, "errors": [error.json for error in error_log]}
+
+
+class _LeaseHeartbeat(threading.Thread):
+    # Renews a lease every third of the lease time while the item is verified, so slow downloads keep it
+    def __init__(self, work_queue, work_item_id, worker_id):
+        super(_LeaseHeartbeat, self).__init__(name="lease-heartbeat-" + str(work_item_id))
+        self.daemon = True
+        self.work_queue = work_queue
+        self.work_item_id = work_item_id
+        self.worker_id = worker_id
+        self._stop_event = threading.Event()
+
+    def run(self):
+        # SQLite connections can't be shared between threads, the heartbeat opens its own
+        work_queue = WorkQueue(self.work_queue.path, self.work_queue.lease_seconds, self.work_queue.max_attempts)
+
+        try:
+            while not self._stop_event.wait(max(self.work_queue.lease_seconds / 3.0, 0.01)):
+                if not work_queue.renew(self.work_item_id, self.worker_id):
+                    return  # The lease was lost already
+        finally:
+            work_queue.close()
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+class _Transaction(object):
+    # BEGIN IMMEDIATE takes the write lock up front, so two workers can't lease the same item
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        self.connection.execute("BEGIN IMMEDIATE")
+
+    def __exit__(self, exception_type, *exception_info):
+        self.connection.execute("ROLLBACK" if exception_type is not None else "COMMIT")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Validate umbrella specifications on several worker nodes")
+    parser.add_argument("--queue", required=True, help="SQLite work queue file shared by the coordinator and workers")
+    parser.add_argument("--lease-seconds", type=float, default=DEFAULT_LEASE_SECONDS)
+    parser.add_argument("--max-attempts", type=int, default=DEFAULT_MAX_ATTEMPTS)
+    subparsers = parser.add_subparsers(dest="command")
+
+    coordinator_parser = subparsers.add_parser("coordinator", help="Queue a batch of specifications and wait for it")
+    coordinator_parser.add_argument("--batch", required=True)
+    coordinator_parser.add_argument("specifications", nargs="+", help="Specification files")
+
+    worker_parser = subparsers.add_parser("worker", help="Verify queued work items")
+    worker_parser.add_argument("--batch")
+    worker_parser.add_argument("--idle-timeout", type=float, help="Stop after this many seconds without work")
+
+    arguments = parser.parse_args()
+    work_queue = WorkQueue(arguments.queue, arguments.lease_seconds, arguments.max_attempts)
+
+    if arguments.command == "worker":
+        Worker(work_queue).run(arguments.batch, idle_timeout=arguments.idle_timeout)
+        return
+
+    specifications = {}
+
+    for path in arguments.specifications:
+        with open(path) as specification_file:
+            specifications[os.path.abspath(path)] = UmbrellaSpecification(specification_file)
+
+    coordinator = Coordinator(work_queue)
+    coordinator.submit(arguments.batch, specifications)
+
+    for specification_id, (is_valid, error_log) in sorted(coordinator.wait(arguments.batch).items()):
+        print json.dumps({"specification": specification_id, "is_valid": is_valid,
+                          "errors": [error.json for error in error_log]})
+
+
+if __name__ == "__main__":
+    main()
@@ -17,6 +17,7 @@
 # limitations under the License.
 
 import json
+import threading
 
 REQUIRED_SECTION_MISSING_ERROR_CODE = "REQ_SECT_MISS"
 WRONG_SECTION_TYPE_ERROR_CODE = "WRONG_SECT_TYPE"
@@ -25,6 +26,17 @@ WRONG_ATTRIBUTE_TYPE_ERROR_CODE = "WRONG_ATTR_TYPE"
 WRONG_FILE_SIZE_ERROR_CODE = "WRONG_FILE_SIZE"
 WRONG_MD5_ERROR_CODE = "WRONG_MD5"
 BAD_URL_ERROR_CODE = "BAD_URL"
+WRONG_UNCOMPRESSED_FILE_SIZE_ERROR_CODE = "WRONG_UNCOMP_SIZE"
+CORRUPT_ARCHIVE_ERROR_CODE = "CORRUPT_ARCHIVE"
+MIRROR_MISMATCH_ERROR_CODE = "MIRROR_MISMATCH"
+SANDBOX_FILE_MISSING_ERROR_CODE = "SANDBOX_MISSING"
+SANDBOX_ESCAPE_ERROR_CODE = "SANDBOX_ESCAPE"
+WORK_ITEM_FAILED_ERROR_CODE = "WORK_FAILED"
+BAD_PACKAGE_LIST_ERROR_CODE = "BAD_PKG_LIST"
+CONFLICTING_PACKAGES_ERROR_CODE = "PKG_CONFLICT"
+MISSING_PACKAGE_ERROR_CODE = "MISSING_PKG"
+BAD_RECEIPT_ERROR_CODE = "BAD_RECEIPT"
+STALE_RECEIPT_ERROR_CODE = "STALE_RECEIPT"
 
 
 class UmbrellaError(object):
@@ -50,10 +62,58 @@ class UmbrellaError(object):
 
         return the_json
 
+    def copy(self, **changes):
+        fields = self.json
+        fields.update(changes)
+
+        return UmbrellaError(**fields)
+
     def __str__(self):
         return json.dumps(self.json)
 
 
+class ErrorBudget(object):
+    """
+    Number of errors a validation may find before it is cancelled. max_errors=0 stops on the first error.
+    cancel_event is set once the budget is exceeded so that downloads running in other threads stop too.
+    """
+    def __init__(self, max_errors=0):
+        self.max_errors = max_errors
+        self.error_count = 0
+        self.cancel_event = threading.Event()
+        self._lock = threading.Lock()
+
+    def record_error(self):
+        with self._lock:
+            self.error_count += 1
+
+            if self.error_count > self.max_errors:
+                self.cancel_event.set()
+
+    @property
+    def is_exceeded(self):
+        return self.cancel_event.is_set()
+
+    def check(self):
+        if self.is_exceeded:
+            raise ValidationCancelledError(
+                "Validation was cancelled after " + str(self.error_count) + " errors (at most " + str(self.max_errors) +
+                " allowed)"
+            )
+
+
+class ErrorLog(list):
+    # Error log that counts against an ErrorBudget and cancels the validation once the budget is exceeded
+    def __init__(self, error_budget, *args):
+        super(ErrorLog, self).__init__(*args)
+        self.error_budget = error_budget
+
+    def append(self, umbrella_error):
+        super(ErrorLog, self).append(umbrella_error)
+        self.error_budget.record_error()
+        self.error_budget.check()
+
+
 class MissingComponentError(Exception):
     pass
 
@@ -79,4 +139,20 @@ class ProgrammingError(Exception):
 
 
 class JsonError(Exception):
-    pass
\ No newline at end of file
+    pass
+
+
+class ValidationCancelledError(Exception):
+    pass
+
+
+class TransportError(Exception):
+    # A source could not be fetched. reason is what went wrong, str() gives the description used in BAD_URL errors
+    def __init__(self, reason, url=None, is_http_error=False):
+        super(TransportError, self).__init__(reason)
+        self.reason = reason
+        self.url = url
+        self.is_http_error = is_http_error
+
+    def __str__(self):
+        return ("Http error \"" if self.is_http_error else "Url error \"") + str(self.reason) + '"'
\ No newline at end of file
@@ -0,0 +1,120 @@
+# This file is part of the daspos-umbrella package.
+#
+# For copyright and licensing information about this package, see the
+# NOTICE.txt and LICENSE.txt files in its top-level directory; they are
+# available at https://github.com/crcresearch/daspos-umbrella
+#
+# Licensed under the MIT License (MIT);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://opensource.org/licenses/MIT
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import hashlib
+import random
+
+from umbrella.umbrella_components import SPECIFICATION_NAME, SPECIFICATION_DESCRIPTION, HARDWARE, KERNEL, OS, \
+    PACKAGE_MANAGER, SOFTWARE, DATA_FILES, ENVIRONMENT_VARIABLES, COMMANDS, OUTPUT, ARCHITECTURE, CORES, MEMORY, \
+    DISK_SPACE, NAME, VERSION, PACKAGES, REPOSITORIES, FILES, DIRECTORIES, ID, URL_SOURCES, MOUNT_POINT, MD5, \
+    FILE_SIZE, FILE_FORMAT, UNCOMPRESSED_FILE_SIZE
+
+# Ways a file entry is broken. Each one makes the structural validation report exactly one error for the entry
+MISSING_ATTRIBUTE = "missing_attribute"
+WRONG_ATTRIBUTE_TYPE = "wrong_attribute_type"
+WRONG_SOURCE_TYPE = "wrong_source_type"
+
+BREAKAGES = [MISSING_ATTRIBUTE, WRONG_ATTRIBUTE_TYPE, WRONG_SOURCE_TYPE]
+
+
+def generate_specification(data_count=10, software_count=1, repository_count=1, mirror_count=2, error_density=0.0,
+                           seed=0):
+    """
+    Builds a synthetic specification shaped like openmalaria.umbrella. The same arguments always give the same
+    specification. Nothing it points to exists, so it is meant for structural validation (verify_downloads=False).
+
+    :param data_count: number of "data" entries
+    :param software_count: number of "software" entries
+    :param repository_count: number of "package_manager" "config" entries
+    :param mirror_count: number of sources of each entry
+    :param error_density: share of the file entries, between 0 and 1, broken in one of the BREAKAGES ways
+    :param seed: seed of the random choices
+    :return: (specification json dictionary, number of errors validate() is expected to report)
+    """
+    randomizer = random.Random(seed)
+    error_count = 0
+
+    specification_json = {
+        SPECIFICATION_NAME: "Synthetic specification " + str(seed),
+        SPECIFICATION_DESCRIPTION: "generated for performance testing",
+        HARDWARE: {
+            ARCHITECTURE: "x86_64", CORES: str(randomizer.choice([1, 2, 4, 8, 16])), MEMORY: "2GB", DISK_SPACE: "3GB"
+        },
+        KERNEL: {NAME: "linux", VERSION: ">=2.6.18"},
+        OS: _get_file_json(randomizer, "os", 0, mirror_count, "tgz"),
+        ENVIRONMENT_VARIABLES: {"PWD": "/tmp"},
+        COMMANDS: "/software/synthetic/bin/run",
+        OUTPUT: {FILES: ["/tmp/output.txt"], DIRECTORIES: []},
+    }
+    specification_json[OS][NAME] = "CentOS"
+    specification_json[OS][VERSION] = "6.6"
+    del specification_json[OS][MOUNT_POINT]
+
+    sections = [
+        (DATA_FILES, data_count, "plain"), (SOFTWARE, software_count, "tgz"), (REPOSITORIES, repository_count, "plain")
+    ]
+
+    for section_name, count, file_format in sections:
+        section = {}
+
+        for number in xrange(count):
+            file_json = _get_file_json(randomizer, section_name, number, mirror_count, file_format)
+
+            if randomizer.random() < error_density:
+                _break_file_json(randomizer, file_json)
+                error_count += 1
+
+            section[section_name + "-" + str(number)] = file_json
+
+        if section_name == REPOSITORIES:
+            specification_json[PACKAGE_MANAGER] = {NAME: "yum", PACKAGES: "python cmake zlib", REPOSITORIES: section}
+        else:
+            specification_json[section_name] = section
+
+    return specification_json, error_count
+
+
+def _get_file_json(randomizer, section_name, number, mirror_count, file_format):
+    md5 = hashlib.md5(section_name + str(number) + str(randomizer.random())).hexdigest()
+    file_size = randomizer.randint(1, 1024 ** 3)
+    file_json = {
+        ID: md5,
+        URL_SOURCES: [
+            "http://mirror" + str(mirror) + ".example.org/" + md5 + "/" + section_name + "-" + str(number)
+            for mirror in xrange(mirror_count)
+        ],
+        FILE_FORMAT: file_format,
+        MD5: md5,
+        FILE_SIZE: str(file_size),
+        MOUNT_POINT: "/" + section_name + "/" + str(number),
+    }
+
+    if file_format != "plain":
+        file_json[UNCOMPRESSED_FILE_SIZE] = str(file_size * 4)
+
+    return file_json
+
+
+def _break_file_json(randomizer, file_json):
+    breakage = randomizer.choice(BREAKAGES)
+
+    if breakage == MISSING_ATTRIBUTE:
+        del file_json[randomizer.choice([ID, FILE_FORMAT, MD5, FILE_SIZE, MOUNT_POINT])]
+    elif breakage == WRONG_ATTRIBUTE_TYPE:
+        file_json[FILE_SIZE] = int(file_json[FILE_SIZE])
+    else:
+        file_json[URL_SOURCES] = file_json[URL_SOURCES][0] if file_json[URL_SOURCES] else ""
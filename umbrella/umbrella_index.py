@@ -0,0 +1,277 @@
+# This file is part of the daspos-umbrella package.
+#
+# For copyright and licensing information about this package, see the
+# NOTICE.txt and LICENSE.txt files in its top-level directory; they are
+# available at https://github.com/crcresearch/daspos-umbrella
+#
+# Licensed under the MIT License (MIT);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://opensource.org/licenses/MIT
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import fnmatch
+import os
+import sqlite3
+import time
+
+from umbrella.umbrella_context import ValidationContext
+from umbrella.umbrella_errors import JsonError
+from umbrella.umbrella_mirrors import get_host_name
+from umbrella.umbrella_specification import UmbrellaSpecification
+
+DEFAULT_SPECIFICATION_PATTERN = "*.umbrella"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS specifications (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    modification_time REAL NOT NULL,
+    file_size INTEGER NOT NULL,
+    parse_error TEXT,
+    name TEXT,
+    architecture TEXT,
+    cores INTEGER,
+    memory INTEGER,
+    disk_space INTEGER,
+    kernel_name TEXT,
+    kernel_version TEXT,
+    os_name TEXT,
+    os_version TEXT,
+    os_checksum TEXT,
+    structural_error_count INTEGER,
+    is_valid INTEGER,
+    error_count INTEGER,
+    validated_at REAL
+);
+CREATE TABLE IF NOT EXISTS artifacts (
+    specification_id INTEGER NOT NULL REFERENCES specifications (id) ON DELETE CASCADE,
+    component_name TEXT,
+    file_name TEXT,
+    checksum TEXT,
+    file_size INTEGER,
+    uncompressed_size INTEGER,
+    file_format TEXT,
+    mount_point TEXT
+);
+CREATE TABLE IF NOT EXISTS sources (
+    specification_id INTEGER NOT NULL REFERENCES specifications (id) ON DELETE CASCADE,
+    checksum TEXT,
+    url TEXT,
+    host TEXT
+);
+CREATE INDEX IF NOT EXISTS artifacts_checksum ON artifacts (checksum);
+CREATE INDEX IF NOT EXISTS artifacts_specification ON artifacts (specification_id);
+CREATE INDEX IF NOT EXISTS sources_url ON sources (url);
+CREATE INDEX IF NOT EXISTS sources_host ON sources (host);
+CREATE INDEX IF NOT EXISTS sources_specification ON sources (specification_id);
+CREATE INDEX IF NOT EXISTS specifications_cores ON specifications (cores);
+CREATE INDEX IF NOT EXISTS specifications_os ON specifications (os_name, os_version);
+CREATE INDEX IF NOT EXISTS specifications_os_checksum ON specifications (os_checksum);
+"""
+
+# Columns find() can filter on by equality
+EQUALITY_FILTERS = [
+    "name", "architecture", "kernel_name", "kernel_version", "os_name", "os_version", "os_checksum", "is_valid",
+]
+
+
+class SpecificationIndex(object):
+    """
+    Persistent SQLite index over a directory of specifications: hardware, kernel, os, artifacts, urls and hosts, and
+    the last known validation status. update() only parses the files that changed since the last update, and queries
+    never touch the specification files.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def update(self, directory, pattern=DEFAULT_SPECIFICATION_PATTERN):
+        """
+        Adds new specifications, parses changed ones again and drops the ones that were deleted
+
+        :param directory: directory searched recursively
+        :param pattern: file name pattern of specifications
+        :return: tuple with the number of specifications (added or changed, removed)
+        """
+        known_files = dict(
+            (path, (modification_time, file_size)) for path, modification_time, file_size in
+            self.connection.execute("SELECT path, modification_time, file_size FROM specifications")
+        )
+        found_paths = set()
+        changed_count = 0
+
+        with self.connection:
+            for path in find_specifications(directory, pattern):
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue  # Deleted since it was listed, or a broken link. Its entry is dropped below
+
+                found_paths.add(path)
+
+                if known_files.get(path) == (stat.st_mtime, stat.st_size):
+                    continue
+
+                self._index_specification(path, stat)
+                changed_count += 1
+
+            removed_paths = [
+                path for path in known_files if path not in found_paths and _is_inside(path, directory)
+            ]
+
+            for path in removed_paths:
+                self.connection.execute("DELETE FROM specifications WHERE path = ?", (path,))
+
+        return changed_count, len(removed_paths)
+
+    def record_validation(self, path, is_valid, error_count, validated_at=None):
+        with self.connection:
+            self.connection.execute(
+                "UPDATE specifications SET is_valid = ?, error_count = ?, validated_at = ? WHERE path = ?",
+                (int(is_valid), error_count, validated_at or time.time(), os.path.abspath(path))
+            )
+
+    def find_by_checksum(self, checksum):
+        return self._get_paths(
+            "SELECT DISTINCT s.path FROM specifications s JOIN artifacts a ON a.specification_id = s.id "
+            "WHERE a.checksum = ? ORDER BY s.path", (checksum.lower(),)
+        )
+
+    def find_by_url(self, url):
+        return self._get_paths(
+            "SELECT DISTINCT s.path FROM specifications s JOIN sources u ON u.specification_id = s.id "
+            "WHERE u.url = ? ORDER BY s.path", (url,)
+        )
+
+    def find_by_host(self, host):
+        return self._get_paths(
+            "SELECT DISTINCT s.path FROM specifications s JOIN sources u ON u.specification_id = s.id "
+            "WHERE u.host = ? ORDER BY s.path", (host,)
+        )
+
+    def find(self, min_cores=None, min_memory=None, min_disk_space=None, **filters):
+        """
+        Finds specifications by their hardware, kernel, os and validation status
+
+        :param min_cores: only specifications that need at least this many cores
+        :param min_memory: only specifications that need at least this many bytes of memory
+        :param min_disk_space: only specifications that need at least this many bytes of disk
+        :param filters: equality filters, for example architecture="x86_64", kernel_name="linux", os_name="CentOS"
+        :return: sorted list of specification paths
+        """
+        conditions = []
+        parameters = []
+
+        for column, minimum in [("cores", min_cores), ("memory", min_memory), ("disk_space", min_disk_space)]:
+            if minimum is not None:
+                conditions.append(column + " >= ?")
+                parameters.append(minimum)
+
+        for column, value in sorted(filters.items()):
+            if column not in EQUALITY_FILTERS:
+                raise ValueError("Can't filter on \"" + str(column) + '"')
+
+            conditions.append(column + " = ?")
+            parameters.append(value)
+
+        query = "SELECT path FROM specifications"
+
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+
+        return self._get_paths(query + " ORDER BY path", parameters)
+
+    def get_unparsable(self):
+        return self._get_paths("SELECT path FROM specifications WHERE parse_error IS NOT NULL ORDER BY path")
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM specifications").fetchone()[0]
+
+    def _get_paths(self, query, parameters=()):
+        return [row[0] for row in self.connection.execute(query, parameters)]
+
+    def _index_specification(self, path, stat):
+        self.connection.execute("DELETE FROM specifications WHERE path = ?", (path,))
+
+        try:
+            with open(path) as specification_file:
+                specification = UmbrellaSpecification(specification_file, ValidationContext(verify_downloads=False))
+        except (JsonError, IOError) as error:
+            self._index_parse_error(path, stat, str(error))
+            return
+
+        if not isinstance(specification.specification_json, dict):
+            self._index_parse_error(path, stat, "Specification must be a json object")
+            return
+
+        specification.validate()
+        model = specification.get_model()
+        hardware = model.hardware
+        kernel = model.kernel
+        operating_system = model.os
+        os_entry = operating_system and operating_system.file_entry
+
+        cursor = self.connection.execute(
+            "INSERT INTO specifications (path, modification_time, file_size, name, architecture, cores, memory, "
+            "disk_space, kernel_name, kernel_version, os_name, os_version, os_checksum, structural_error_count) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                path, stat.st_mtime, stat.st_size, model.name,
+                hardware and hardware.architecture, hardware and hardware.cores, hardware and hardware.memory,
+                hardware and hardware.disk_space, kernel and kernel.name, kernel and kernel.version,
+                operating_system and operating_system.name, operating_system and operating_system.version,
+                os_entry and _lower(os_entry.checksum), len(specification.error_log),
+            )
+        )
+        specification_id = cursor.lastrowid
+
+        self.connection.executemany(
+            "INSERT INTO artifacts VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    specification_id, entry.component_name, entry.file_name, _lower(entry.checksum), entry.size,
+                    entry.uncompressed_size, entry.file_format, entry.mount_point,
+                )
+                for entry in model.file_entries
+            ]
+        )
+        self.connection.executemany(
+            "INSERT INTO sources VALUES (?, ?, ?, ?)",
+            [
+                (specification_id, _lower(entry.checksum), url, get_host_name(url))
+                for entry in model.file_entries for url in (entry.sources or ()) if url is not None
+            ]
+        )
+
+    def _index_parse_error(self, path, stat, description):
+        self.connection.execute(
+            "INSERT INTO specifications (path, modification_time, file_size, parse_error) VALUES (?, ?, ?, ?)",
+            (path, stat.st_mtime, stat.st_size, description)
+        )
+
+
+def find_specifications(directory, pattern=DEFAULT_SPECIFICATION_PATTERN):
+    for root, directory_names, file_names in os.walk(os.path.abspath(directory)):
+        directory_names.sort()
+
+        for file_name in sorted(fnmatch.filter(file_names, pattern)):
+            yield os.path.join(root, file_name)
+
+
+def _is_inside(path, directory):
+    return path.startswith(os.path.join(os.path.abspath(directory), ""))
+
+
+def _lower(text):
+    return text.lower() if text is not None else None
@@ -0,0 +1,387 @@
+# This file is part of the daspos-umbrella package.
+#
+# For copyright and licensing information about this package, see the
+# NOTICE.txt and LICENSE.txt files in its top-level directory; they are
+# available at https://github.com/crcresearch/daspos-umbrella
+#
+# Licensed under the MIT License (MIT);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://opensource.org/licenses/MIT
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import mmap
+import os
+import tempfile
+
+from umbrella.umbrella_store import _make_directories, _normalize_checksum
+
+TAR_FORMATS = ["tar"]
+COMPRESSED_TAR_FORMATS = ["tgz", "tar.gz", "tbz", "tbz2", "tar.bz2", "txz", "tar.xz"]
+
+BLOCK_SIZE = 512
+MAX_EXTENDED_HEADER_SIZE = 4 * 1024 * 1024  # Longest GNU long name or pax header that is buffered
+MANIFEST_EXTENSION = ".manifest"
+
+# Tar member types
+REGULAR_FILE = "0"
+HARD_LINK = "1"
+SYMBOLIC_LINK = "2"
+DIRECTORY = "5"
+GNU_LONG_NAME = "L"
+GNU_LONG_LINK = "K"
+PAX_HEADER = "x"
+PAX_GLOBAL_HEADER = "g"
+
+EXTENDED_HEADER_TYPES = [GNU_LONG_NAME, GNU_LONG_LINK, PAX_HEADER, PAX_GLOBAL_HEADER]
+TYPES_WITHOUT_DATA = [HARD_LINK, SYMBOLIC_LINK, "3", "4", DIRECTORY, "6"]
+
+
+class TarMember(object):
+    __slots__ = ["path", "size", "mode", "type", "link_name"]
+
+    def __init__(self, path, size, mode, type, link_name=""):
+        self.path = path
+        self.size = size
+        self.mode = mode
+        self.type = type
+        self.link_name = link_name
+
+    def __eq__(self, other):
+        return isinstance(other, TarMember) and all(getattr(self, slot) == getattr(other, slot) for slot in self.__slots__)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "TarMember(" + ", ".join(repr(getattr(self, slot)) for slot in self.__slots__) + ")"
+
+
+class TarManifestReader(object):
+    """
+    Lists the members of a tar stream from the headers as the data goes by. Member contents are skipped, so only a
+    header (or a GNU long name or pax header of MAX_EXTENDED_HEADER_SIZE at most) is ever buffered. GNU and pax long
+    paths and sizes are supported.
+
+    Feed it the uncompressed tar: directly for plain tar, through DecompressionChecker.output_observers otherwise.
+    error is set, and reading stops, when a header is corrupt.
+    """
+    def __init__(self):
+        self.members = []
+        self.error = None
+        self.is_finished = False
+        self._buffer = ""
+        self._needed_size = BLOCK_SIZE
+        self._skip_size = 0
+        self._extended_header = None  # Type of the GNU long name or pax header whose data is being buffered
+        self._extended_size = 0
+        self._overrides = {}  # Values of the last GNU long name or pax header, for the next member
+
+    def update(self, data):
+        offset = 0
+
+        while offset < len(data) and not self.is_finished and self.error is None:
+            if self._skip_size:
+                skipped_size = min(self._skip_size, len(data) - offset)
+                self._skip_size -= skipped_size
+                offset += skipped_size
+                continue
+
+            taken_size = self._needed_size - len(self._buffer)
+            self._buffer += data[offset:offset + taken_size]
+            offset += taken_size
+
+            if len(self._buffer) < self._needed_size:
+                break
+
+            block, self._buffer = self._buffer, ""
+
+            try:
+                if self._extended_header is not None:
+                    self._read_extended_header(block)
+                else:
+                    self._read_header(block)
+            except ValueError:  # Numbers that aren't octal, so the data isn't tar
+                self.error = "Invalid tar header after " + str(len(self.members)) + " members"
+
+    def finish(self):
+        if self.error is None and not self.is_finished:
+            self.error = "Tar archive is truncated"
+
+    def get_cache_fields(self):
+        return {}
+
+    def load_cache_fields(self, cached):
+        return False  # The members aren't cached, so the data is needed
+
+    def _read_header(self, block):
+        if not block.strip("\0"):  # End of archive marker
+            self.is_finished = True
+            return
+
+        if _parse_number(block[148:156]) != sum(bytearray(block[:148] + " " * 8 + block[156:])):
+            self.error = "Invalid tar header checksum after " + str(len(self.members)) + " members"
+            return
+
+        member_type = block[156] if block[156] != "\0" else REGULAR_FILE
+        size = _parse_number(block[124:136])
+
+        if member_type in EXTENDED_HEADER_TYPES:
+            if size > MAX_EXTENDED_HEADER_SIZE:
+                self.error = "Extended header of " + str(size) + " bytes after " + str(len(self.members)) + \
+                             " members is over the limit of " + str(MAX_EXTENDED_HEADER_SIZE)
+                return
+
+            self._extended_header = member_type
+            self._needed_size = _get_padded_size(size)
+            self._extended_size = size
+            return
+
+        path = _get_string(block[0:100])
+
+        if block[257:262] == "ustar" and block[345:500].strip("\0"):
+            path = _get_string(block[345:500]) + "/" + path
+
+        path = self._overrides.get("path", path)
+        size = int(self._overrides.get("size", size))
+        link_name = self._overrides.get("linkpath", _get_string(block[157:257]))
+        self._overrides = {}
+
+        self.members.append(TarMember(normalize_member_path(path), size, _parse_number(block[100:108]), member_type,
+                                      link_name))
+
+        if member_type not in TYPES_WITHOUT_DATA:
+            self._skip_size = _get_padded_size(size)
+
+    def _read_extended_header(self, block):
+        data = block[:self._extended_size]
+        member_type = self._extended_header
+        self._extended_header = None
+        self._needed_size = BLOCK_SIZE
+
+        if member_type == GNU_LONG_NAME:
+            self._overrides["path"] = _get_string(data)
+        elif member_type == GNU_LONG_LINK:
+            self._overrides["linkpath"] = _get_string(data)
+        elif member_type == PAX_HEADER:
+            self._overrides.update(_parse_pax_records(data))
+
+
+class TarManifest(object):
+    """
+    Member listing of one archive, as written by ManifestStore: one "path<tab>size<tab>mode<tab>type<tab>link" line per
+    member, sorted by path, with the paths escaped. Lookups are binary searches over the memory-mapped file, so
+    opening even a manifest of millions of members costs nothing.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        file_size = os.fstat(self._file.fileno()).st_size
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if file_size else ""
+        self._line_starts = None
+
+    def close(self):
+        if self._data:
+            self._data.close()
+
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception_info):
+        self.close()
+
+    def __iter__(self):
+        for line in iter(self._get_line_reader(0), ""):
+            yield _parse_manifest_line(line)
+
+    def contains(self, path):
+        return self.get_member(path) is not None
+
+    def get_member(self, path):
+        escaped_path = _escape_path(normalize_member_path(path))
+        offset = self._find(escaped_path)
+        line = self._read_line(offset)
+
+        if line is not None and line.split("\t", 1)[0] == escaped_path:
+            return _parse_manifest_line(line)
+
+        return None
+
+    def list_directory(self, path):
+        # Every member under directory path, at any depth
+        prefix = _escape_path(normalize_member_path(path) + "/") if normalize_member_path(path) else ""
+        offset = self._find(prefix)
+
+        for line in iter(self._get_line_reader(offset), ""):
+            if not line.startswith(prefix):
+                break
+
+            yield _parse_manifest_line(line)
+
+    def _find(self, escaped_path):
+        # Offset of the first line whose path is not smaller than escaped_path
+        low, high = 0, len(self._data)
+
+        while low < high:
+            middle = (low + high) // 2
+            line_start = self._data.rfind("\n", 0, middle) + 1 if middle else 0
+            line = self._read_line(line_start)
+
+            if line.split("\t", 1)[0] < escaped_path:
+                low = line_start + len(line) + 1
+            else:
+                high = line_start
+
+        return low
+
+    def _read_line(self, offset):
+        if offset >= len(self._data):
+            return None
+
+        end = self._data.find("\n", offset)
+
+        return self._data[offset:end if end != -1 else len(self._data)]
+
+    def _get_line_reader(self, offset):
+        position = [offset]
+
+        def read_line():
+            line = self._read_line(position[0])
+
+            if line is None:
+                return ""
+
+            position[0] += len(line) + 1
+
+            return line
+
+        return read_line
+
+
+class ManifestStore(object):
+    # Manifests of verified archives by md5 checksum, laid out like the ArtifactStore: directory/ab/checksum.manifest
+    def __init__(self, directory):
+        self.directory = os.path.abspath(directory)
+
+        _make_directories(self.directory)
+
+    def get_path(self, checksum):
+        checksum = _normalize_checksum(checksum)
+
+        return os.path.join(self.directory, checksum[:2], checksum + MANIFEST_EXTENSION)
+
+    def contains(self, checksum):
+        return os.path.isfile(self.get_path(checksum))
+
+    def save(self, checksum, members):
+        path = self.get_path(checksum)
+        _make_directories(os.path.dirname(path))
+        lines = sorted(_get_manifest_line(member) for member in members)
+        file_descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path))
+
+        with os.fdopen(file_descriptor, "wb") as temporary_file:
+            temporary_file.write("\n".join(lines))
+
+        os.rename(temporary_path, path)
+
+    def open(self, checksum):
+        # TarManifest, or None when the archive's manifest isn't known
+        if not self.contains(checksum):
+            return None
+
+        return TarManifest(self.get_path(checksum))
+
+    def contains_member(self, checksum, path):
+        # True or False, or None when the archive's manifest isn't known
+        manifest = self.open(checksum)
+
+        if manifest is None:
+            return None
+
+        with manifest:
+            return manifest.contains(path)
+
+
+def is_tar_format(file_format):
+    return isinstance(file_format, (str, unicode)) and file_format.lower() in TAR_FORMATS + COMPRESSED_TAR_FORMATS
+
+
+def normalize_member_path(path):
+    # "./usr/bin/", "/usr/bin" and "usr/bin" are the same member
+    path = path.strip("/")
+
+    while path.startswith("./"):
+        path = path[2:].lstrip("/")
+
+    return "" if path == "." else path
+
+
+def _get_manifest_line(member):
+    return "\t".join([
+        _escape_path(member.path), str(member.size), oct(member.mode), member.type, _escape_path(member.link_name)
+    ])
+
+
+def _parse_manifest_line(line):
+    path, size, mode, member_type, link_name = line.split("\t")
+
+    return TarMember(_unescape_path(path), int(size), int(mode, 8), member_type, _unescape_path(link_name))
+
+
+def _escape_path(path):
+    # Keeps tabs and newlines of odd paths out of the line format. Sorting is done on the escaped form
+    if isinstance(path, unicode):
+        path = path.encode("utf-8")
+
+    return path.encode("string_escape")
+
+
+def _unescape_path(path):
+    return path.decode("string_escape")
+
+
+def _get_string(field):
+    return field.split("\0", 1)[0]
+
+
+def _parse_number(field):
+    if ord(field[0]) & 0x80:  # GNU base-256 encoding of big numbers
+        number = ord(field[0]) & 0x7f
+
+        for character in field[1:]:
+            number = number * 256 + ord(character)
+
+        return number
+
+    field = _get_string(field).strip()
+
+    return int(field, 8) if field else 0
+
+
+def _get_padded_size(size):
+    return (size + BLOCK_SIZE - 1) // BLOCK_SIZE * BLOCK_SIZE
+
+
+def _parse_pax_records(data):
+    # "length key=value\n" records
+    records = {}
+
+    while data:
+        length, _, rest = data.partition(" ")
+
+        if not length.isdigit() or int(length) <= 0:
+            break
+
+        record = data[len(length) + 1:int(length)]
+        key, _, value = record.rstrip("\n").partition("=")
+        records[key] = value
+        data = data[int(length):]
+
+    return records
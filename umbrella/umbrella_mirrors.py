@@ -0,0 +1,220 @@
+# This file is part of the daspos-umbrella package.
+#
+# For copyright and licensing information about this package, see the
+# NOTICE.txt and LICENSE.txt files in its top-level directory; they are
+# available at https://github.com/crcresearch/daspos-umbrella
+#
+# Licensed under the MIT License (MIT);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://opensource.org/licenses/MIT
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import urlparse
+from multiprocessing.pool import ThreadPool
+
+from umbrella.umbrella_errors import TransportError
+from umbrella.umbrella_transports import get_transport, get_total_size
+
+DEFAULT_PREFIX_SIZE = 65536
+DEFAULT_TIMEOUT = 60.0
+MINIMUM_TIMEOUT = 5.0
+SMOOTHING_FACTOR = 0.3  # Weight of the newest measurement in the moving averages
+
+# Scoreboard keys
+REQUESTS_KEY = "requests"
+FAILURES_KEY = "failures"
+LATENCY_KEY = "latency"
+THROUGHPUT_KEY = "throughput"
+PROBE_THROUGHPUT_KEY = "probe_throughput"
+
+
+class MirrorScoreboard(object):
+    """
+    Health of every host seen so far: number of requests and failures, and moving averages of latency (seconds) and
+    throughput (bytes per second). Throughput of short probes is averaged apart from that of full downloads, since
+    the connection setup weighs much more in it, and is only used for hosts nothing was downloaded from yet. When a
+    path is given the scoreboard is loaded from it and save() writes it back,
+    so later runs start from what earlier runs learned. This class is thread safe.
+    """
+    def __init__(self, path=None, default_timeout=DEFAULT_TIMEOUT):
+        self.path = path
+        self.default_timeout = default_timeout
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+        if path is not None and os.path.exists(path):
+            with open(path) as scoreboard_file:
+                self._hosts = json.load(scoreboard_file)
+
+    def record_success(self, url, latency=None, byte_count=None, seconds=None, is_probe=False):
+        with self._lock:
+            host = self._get_host(url)
+            host[REQUESTS_KEY] += 1
+
+            if latency is not None:
+                host[LATENCY_KEY] = _get_moving_average(host[LATENCY_KEY], latency)
+
+            if byte_count and seconds:
+                key = PROBE_THROUGHPUT_KEY if is_probe else THROUGHPUT_KEY
+                host[key] = _get_moving_average(host[key], byte_count / seconds)
+
+    def record_failure(self, url):
+        with self._lock:
+            host = self._get_host(url)
+            host[REQUESTS_KEY] += 1
+            host[FAILURES_KEY] += 1
+
+    def get_failure_rate(self, url):
+        with self._lock:
+            host = self._hosts.get(get_host_name(url))
+
+            if not host or not host[REQUESTS_KEY]:
+                return 0.0
+
+            return float(host[FAILURES_KEY]) / host[REQUESTS_KEY]
+
+    def get_throughput(self, url):
+        with self._lock:
+            host = self._hosts.get(get_host_name(url))
+
+            if not host:
+                return None
+
+            return host[THROUGHPUT_KEY] if host[THROUGHPUT_KEY] is not None else host.get(PROBE_THROUGHPUT_KEY)
+
+    def get_timeout(self, url):
+        # Hosts that keep failing get less of our time
+        return max(MINIMUM_TIMEOUT, self.default_timeout * (1.0 - self.get_failure_rate(url)))
+
+    def order(self, urls):
+        # Most reliable first, then fastest. Unknown hosts go before known slow ones so they get measured
+        def score(url):
+            throughput = self.get_throughput(url)
+
+            return self.get_failure_rate(url), -(throughput if throughput is not None else float("inf"))
+
+        return sorted(urls, key=score)
+
+    def save(self):
+        if self.path is None:
+            return
+
+        with self._lock:
+            hosts_json = json.dumps(self._hosts, indent=2, sort_keys=True)
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        file_descriptor, temporary_path = tempfile.mkstemp(dir=directory)
+
+        with os.fdopen(file_descriptor, "w") as temporary_file:
+            temporary_file.write(hosts_json)
+
+        os.rename(temporary_path, self.path)
+
+    def _get_host(self, url):
+        host = self._hosts.setdefault(
+            get_host_name(url), {REQUESTS_KEY: 0, FAILURES_KEY: 0, LATENCY_KEY: None, THROUGHPUT_KEY: None}
+        )
+        host.setdefault(PROBE_THROUGHPUT_KEY, None)  # Missing from scoreboards saved by earlier versions
+
+        return host
+
+
+class MirrorProbe(object):
+    """
+    Result of reading the first bytes of a mirror. total_size comes from the Content-Range or Content-Length headers
+    and is None when the server doesn't say.
+    """
+    def __init__(self, url):
+        self.url = url
+        self.error = None
+        self.prefix = ""
+        self.total_size = None
+        self.latency = None
+        self.seconds = None
+
+    @property
+    def is_complete(self):
+        return self.error is None and self.total_size is not None and len(self.prefix) == self.total_size
+
+
+def probe_mirror(url, prefix_size=DEFAULT_PREFIX_SIZE, timeout=DEFAULT_TIMEOUT, transports=None):
+    probe = MirrorProbe(url)
+    start = time.time()
+
+    try:
+        with get_transport(url, transports).open_range(url, 0, prefix_size, timeout) as remote:
+            probe.latency = time.time() - start
+            probe.prefix = remote.read(prefix_size)
+            probe.seconds = time.time() - start
+            probe.total_size = remote.total_size
+    except (TransportError, IOError) as error:
+        probe.error = error.reason if isinstance(error, TransportError) else str(error)
+
+    return probe
+
+
+def probe_mirrors(urls, scoreboard=None, prefix_size=DEFAULT_PREFIX_SIZE, transports=None):
+    """
+    Reads the first prefix_size bytes of every url at the same time
+
+    :param urls: list of urls holding the same file
+    :param scoreboard: MirrorScoreboard that decides timeouts and records the results
+    :param prefix_size: number of bytes to read from each mirror
+    :param transports: TransportRegistry to fetch with, DEFAULT_TRANSPORTS when None
+    :return: list of MirrorProbe objects, in the same order as urls
+    """
+    def probe(url):
+        timeout = scoreboard.get_timeout(url) if scoreboard is not None else DEFAULT_TIMEOUT
+        the_probe = probe_mirror(url, prefix_size, timeout, transports)
+
+        if scoreboard is not None:
+            if the_probe.error is None:
+                scoreboard.record_success(
+                    url, the_probe.latency, len(the_probe.prefix), the_probe.seconds, is_probe=True
+                )
+            else:
+                scoreboard.record_failure(url)
+
+        return the_probe
+
+    pool = ThreadPool(max(1, len(urls)))
+
+    try:
+        return pool.map(probe, urls)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def get_fastest_probe(probes):
+    finished_probes = [probe for probe in probes if probe.error is None]
+
+    if not finished_probes:
+        return None
+
+    return min(finished_probes, key=lambda probe: probe.seconds)
+
+
+def get_host_name(url):
+    parsed_url = urlparse.urlparse(url)
+
+    return parsed_url.netloc or parsed_url.scheme
+
+
+def _get_moving_average(average, value):
+    if average is None:
+        return value
+
+    return (1.0 - SMOOTHING_FACTOR) * average + SMOOTHING_FACTOR * value
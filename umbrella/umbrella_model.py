@@ -0,0 +1,212 @@
+# This file is part of the daspos-umbrella package.
+#
+# For copyright and licensing information about this package, see the
+# NOTICE.txt and LICENSE.txt files in its top-level directory; they are
+# available at https://github.com/crcresearch/daspos-umbrella
+#
+# Licensed under the MIT License (MIT);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://opensource.org/licenses/MIT
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from umbrella.umbrella_components import HardwareComponent, KernelComponent, OsComponent, \
+    PackageManagerComponent, EnvironmentVariableComponent, OutputComponent, SPECIFICATION_NAME, \
+    SPECIFICATION_DESCRIPTION, HARDWARE, KERNEL, OS, PACKAGE_MANAGER, SOFTWARE, DATA_FILES, ENVIRONMENT_VARIABLES, \
+    COMMANDS, OUTPUT, ARCHITECTURE, NAME, VERSION, FILES, DIRECTORIES, ID, URL_SOURCES, MOUNT_POINT, MD5, \
+    FILE_SIZE, FILE_FORMAT, UNCOMPRESSED_FILE_SIZE
+
+FILE_COMPONENT_NAMES = [OS, PACKAGE_MANAGER, SOFTWARE, DATA_FILES]
+
+
+class ModelObject(object):
+    """
+    Base of the specification model. Model objects use __slots__ and can't be changed once built, so millions of them
+    fit in memory and they can be shared freely.
+    """
+    __slots__ = ()
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            object.__setattr__(self, name, fields.get(name))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(self.__class__.__name__ + " objects can't be changed")
+
+    def __delattr__(self, name):
+        raise AttributeError(self.__class__.__name__ + " objects can't be changed")
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(tuple(getattr(self, name) for name in self.__slots__))
+
+    def __repr__(self):
+        fields = ", ".join(name + "=" + repr(getattr(self, name)) for name in self.__slots__)
+
+        return self.__class__.__name__ + "(" + fields + ")"
+
+
+class FileEntry(ModelObject):
+    # size and uncompressed_size are ints, or None when they are missing or can't be read
+    __slots__ = (
+        "component_name", "file_name", "id", "sources", "file_format", "checksum", "size", "uncompressed_size",
+        "mount_point",
+    )
+
+
+class Hardware(ModelObject):
+    # memory and disk_space are numbers of bytes
+    __slots__ = ("architecture", "cores", "memory", "disk_space")
+
+
+class Kernel(ModelObject):
+    __slots__ = ("name", "version")
+
+
+class OperatingSystem(ModelObject):
+    __slots__ = ("name", "version", "file_entry")
+
+
+class PackageManager(ModelObject):
+    __slots__ = ("name", "package_names")
+
+
+class SpecificationModel(ModelObject):
+    """
+    Parsed, read only form of a specification. Sections that are missing or of the wrong type are None, and so are
+    values that can't be read. file_entries holds every artifact of the os, package_manager, software and data
+    sections, in that order. environment is a tuple of (name, value) pairs sorted by name.
+    """
+    __slots__ = (
+        "name", "description", "hardware", "kernel", "os", "package_manager", "file_entries", "environment",
+        "command", "output_files", "output_directories",
+    )
+
+    def get_file_entries(self, component_name):
+        return tuple(file_entry for file_entry in self.file_entries if file_entry.component_name == component_name)
+
+    @property
+    def total_size(self):
+        return sum(file_entry.size or 0 for file_entry in self.file_entries)
+
+
+def get_specification_model(specification):
+    """
+    Builds the model of a specification through its components
+
+    :param specification: UmbrellaSpecification
+    :return: SpecificationModel
+    """
+    hardware = _get_dict_component(specification, HARDWARE, HardwareComponent)
+    kernel = _get_dict_component(specification, KERNEL, KernelComponent)
+    operating_system = _get_dict_component(specification, OS, OsComponent)
+    package_manager = _get_dict_component(specification, PACKAGE_MANAGER, PackageManagerComponent)
+    environment = _get_dict_component(specification, ENVIRONMENT_VARIABLES, EnvironmentVariableComponent)
+    output = _get_dict_component(specification, OUTPUT, OutputComponent)
+
+    file_entries = []
+
+    for component_name in FILE_COMPONENT_NAMES:
+        component = specification.get_component(component_name)
+
+        if not isinstance(component.component_json, dict):
+            continue
+
+        file_entries.extend(
+            get_file_entry(file_info) for file_info in component.get_file_infos()
+            if isinstance(file_info.component_json, dict)
+        )
+
+    return SpecificationModel(
+        name=_get_string(specification.specification_json.get(SPECIFICATION_NAME)),
+        description=_get_string(specification.specification_json.get(SPECIFICATION_DESCRIPTION)),
+        hardware=hardware and Hardware(
+            architecture=_get_string(hardware.component_json.get(ARCHITECTURE)),
+            cores=hardware.get_cores(),
+            memory=hardware.get_memory(),
+            disk_space=hardware.get_disk_space(),
+        ),
+        kernel=kernel and Kernel(
+            name=_get_string(kernel.component_json.get(NAME)),
+            version=_get_string(kernel.component_json.get(VERSION)),
+        ),
+        os=operating_system and OperatingSystem(
+            name=_get_string(operating_system.component_json.get(NAME)),
+            version=_get_string(operating_system.component_json.get(VERSION)),
+            file_entry=next((entry for entry in file_entries if entry.component_name == OS), None),
+        ),
+        package_manager=package_manager and PackageManager(
+            name=_get_string(package_manager.component_json.get(NAME)),
+            package_names=_get_strings([requirement.name for requirement in package_manager.get_packages()]),
+        ),
+        file_entries=tuple(file_entries),
+        environment=environment and tuple(
+            (_get_string(name), _get_string(value)) for name, value in sorted(environment.component_json.items())
+        ),
+        command=_get_string(specification.specification_json.get(COMMANDS)),
+        output_files=output and _get_strings(output.component_json.get(FILES)),
+        output_directories=output and _get_strings(output.component_json.get(DIRECTORIES)),
+    )
+
+
+def get_file_entry(file_info):
+    file_json = file_info.component_json
+
+    return FileEntry(
+        component_name=_get_string(file_info.name),
+        file_name=_get_string(file_info.file_name),
+        id=_get_string(file_json.get(ID)),
+        sources=_get_strings(file_json.get(URL_SOURCES)),
+        file_format=_get_string(file_json.get(FILE_FORMAT)),
+        checksum=_get_string(file_json.get(MD5)),
+        size=_get_int(file_json.get(FILE_SIZE)),
+        uncompressed_size=_get_int(file_json.get(UNCOMPRESSED_FILE_SIZE)),
+        mount_point=_get_string(file_json.get(MOUNT_POINT)),
+    )
+
+
+def _get_dict_component(specification, component_name, component_class):
+    component = specification.get_component(component_name)
+
+    if isinstance(component, component_class) and isinstance(component.component_json, dict):
+        return component
+
+    return None
+
+
+def _get_string(value):
+    # Interned, so the names, formats and hosts repeated across a corpus are only kept once
+    if isinstance(value, unicode):
+        try:
+            value = value.encode("ascii")
+        except UnicodeEncodeError:
+            return value
+
+    if isinstance(value, str):
+        return intern(value)
+
+    return None
+
+
+def _get_strings(values):
+    if not isinstance(values, list):
+        return None
+
+    return tuple(_get_string(value) for value in values)
+
+
+def _get_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,169 @@
+# This file is part of the daspos-umbrella package.
+#
+# For copyright and licensing information about this package, see the
+# NOTICE.txt and LICENSE.txt files in its top-level directory; they are
+# available at https://github.com/crcresearch/daspos-umbrella
+#
+# Licensed under the MIT License (MIT);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://opensource.org/licenses/MIT
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import re
+
+# Comparison operators of a package requirement, longest first so that ">=" isn't read as ">"
+OPERATORS = [">=", "<=", "==", "=", ">", "<"]
+
+PACKAGE_TOKEN_PATTERN = re.compile(r"^([^<>=\s,]+)(?:(>=|<=|==|=|>|<)([^<>=\s,]+))?$")
+VERSION_SEGMENT_PATTERN = re.compile(r"\d+|[a-zA-Z]+")
+
+
+class PackageRequirement(object):
+    """
+    One entry of a package manager's "list": a package name and, optionally, a version constraint such as ">=1.2".
+    "=" and "==" both mean an exact version. A version with a "-" is compared with the package's version-release.
+    """
+    __slots__ = ["name", "operator", "version"]
+
+    def __init__(self, name, operator=None, version=None):
+        self.name = name
+        self.operator = "==" if operator == "=" else operator
+        self.version = version
+
+    def is_satisfied_by(self, version, release=None):
+        if self.operator is None:
+            return True
+
+        if "-" in self.version and release:
+            version = version + "-" + release
+
+        comparison = compare_versions(version, self.version)
+
+        return {
+            "==": comparison == 0, ">=": comparison >= 0, "<=": comparison <= 0, ">": comparison > 0, "<": comparison < 0,
+        }[self.operator]
+
+    def __eq__(self, other):
+        return isinstance(other, PackageRequirement) and \
+            (self.name, self.operator, self.version) == (other.name, other.operator, other.version)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __str__(self):
+        return self.name + (self.operator + self.version if self.operator else "")
+
+    def __repr__(self):
+        return "PackageRequirement(" + repr(str(self)) + ")"
+
+
+def parse_package_list(package_list):
+    """
+    Parses a package manager's "list" such as "python cmake>=2.8 boost-devel == 1.41.0". Entries are separated by
+    spaces or commas, and an operator may be surrounded by spaces.
+
+    :return: list of PackageRequirement, in the order given
+    :raises ValueError: when an entry can't be read, such as an operator without a version
+    """
+    tokens = [token for token in re.split(r"[\s,]+", package_list.strip()) if token]
+    tokens = _join_spaced_operators(tokens)
+    requirements = []
+
+    for token in tokens:
+        match = PACKAGE_TOKEN_PATTERN.match(token)
+
+        if match is None:
+            raise ValueError("Invalid package entry \"" + token + '"')
+
+        requirements.append(PackageRequirement(*match.groups()))
+
+    return requirements
+
+
+def get_conflicts(requirements):
+    """
+    :return: list of the package names whose requirements can't all be met by a single version
+    """
+    requirements_by_name = {}
+
+    for requirement in requirements:
+        requirements_by_name.setdefault(requirement.name, []).append(requirement)
+
+    return [
+        name for name, name_requirements in sorted(requirements_by_name.items())
+        if not _can_be_met_together([requirement for requirement in name_requirements if requirement.operator])
+    ]
+
+
+def compare_versions(first_version, second_version):
+    """
+    Compares versions segment by segment like rpm does: numbers as numbers, letters as text, a number is newer than
+    letters and the version with segments left over is newer
+
+    :return: -1, 0 or 1
+    """
+    first_segments = VERSION_SEGMENT_PATTERN.findall(first_version)
+    second_segments = VERSION_SEGMENT_PATTERN.findall(second_version)
+
+    for first_segment, second_segment in zip(first_segments, second_segments):
+        if first_segment.isdigit() != second_segment.isdigit():
+            return 1 if first_segment.isdigit() else -1
+
+        if first_segment.isdigit():
+            first_segment, second_segment = int(first_segment), int(second_segment)
+
+        if first_segment != second_segment:
+            return 1 if first_segment > second_segment else -1
+
+    return cmp(len(first_segments), len(second_segments))
+
+
+def _join_spaced_operators(tokens):
+    # ["cmake", ">=", "2.8"] becomes ["cmake>=2.8"]
+    joined_tokens = []
+    index = 0
+
+    while index < len(tokens):
+        token = tokens[index]
+
+        if index + 1 < len(tokens) and tokens[index + 1] in OPERATORS:
+            if index + 2 >= len(tokens):
+                raise ValueError("Package entry \"" + token + " " + tokens[index + 1] + "\" has no version")
+
+            token += tokens[index + 1] + tokens[index + 2]
+            index += 2
+        elif index + 1 < len(tokens) and token[-1] in "<>=" and tokens[index + 1] not in OPERATORS:
+            token += tokens[index + 1]  # "cmake>= 2.8"
+            index += 1
+
+        joined_tokens.append(token)
+        index += 1
+
+    return joined_tokens
+
+
+def _can_be_met_together(requirements):
+    # Each exact version, and the highest lower bound and lowest upper bound, must leave some version possible
+    exact_versions = [requirement.version for requirement in requirements if requirement.operator == "=="]
+
+    for exact_version in exact_versions:
+        if not all(requirement.is_satisfied_by(exact_version) for requirement in requirements):
+            return False
+
+    lower_bounds = [requirement for requirement in requirements if requirement.operator in (">=", ">")]
+    upper_bounds = [requirement for requirement in requirements if requirement.operator in ("<=", "<")]
+
+    for lower_bound in lower_bounds:
+        for upper_bound in upper_bounds:
+            comparison = compare_versions(lower_bound.version, upper_bound.version)
+
+            if comparison > 0 or (comparison == 0 and (lower_bound.operator == ">" or upper_bound.operator == "<")):
+                return False
+
+    return True
@@ -0,0 +1,294 @@
+# This file is part of the daspos-umbrella package.
+#
+# For copyright and licensing information about this package, see the
+# NOTICE.txt and LICENSE.txt files in its top-level directory; they are
+# available at https://github.com/crcresearch/daspos-umbrella
+#
+# Licensed under the MIT License (MIT);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://opensource.org/licenses/MIT
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from collections import OrderedDict
+
+from umbrella.misc import LazyModule
+from umbrella.umbrella_components import FILE_SIZE, FILE_FORMAT, MD5, URL_SOURCES, UNCOMPRESSED_FILE_SIZE
+from umbrella.umbrella_errors import ValidationCancelledError
+
+# Every validation that downloads makes a planner, but these are only needed to plan and to run in parallel
+_mirrors = LazyModule("umbrella.umbrella_mirrors")
+_pool = LazyModule("multiprocessing.pool")
+
+# Schedules
+DECLARED_ORDER = "declared"
+LARGEST_FIRST = "largest_first"  # Keeps a pool of workers busy until the end, so the whole run finishes sooner
+SHORTEST_FIRST = "shortest_first"  # Finishes the most work items early, so most errors are found quickly
+
+SCHEDULES = [DECLARED_ORDER, LARGEST_FIRST, SHORTEST_FIRST]
+
+
+class VerificationPlanner(object):
+    """
+    Collects the sources that FileInfo objects want to download, within one specification or across many, and
+    verifies every unique (url, checksum, size) work item only once. The errors found are copied to each FileInfo
+    that referenced the work item, with that FileInfo's component and file name.
+
+    FileInfo.validate() hands its sources to the context's planner instead of downloading them. Nothing is downloaded
+    until run() is called. When the context has a mirror scoreboard, all the sources of a FileInfo form one work item
+    so they can be verified as mirrors of each other.
+
+    Work items are run in the order given by schedule, using the specification's declared sizes, by as many threads
+    as workers. With a sampler (such as RotationSampler), only the work items it selects are run.
+    """
+    def __init__(self, schedule=DECLARED_ORDER, workers=1, sampler=None):
+        if schedule is None:
+            schedule = DECLARED_ORDER
+
+        if schedule not in SCHEDULES:
+            raise ValueError("schedule must be one of " + ", ".join(SCHEDULES))
+
+        self.schedule = schedule
+        self.workers = workers
+        self.sampler = sampler
+        self._work_items = OrderedDict()
+        self._invalid_error_logs = set()
+
+    def add(self, file_info, error_log, callback_function=None, *args):
+        urls = file_info.component_json[URL_SOURCES]
+
+        if file_info.context.mirror_scoreboard is not None and len(urls) > 1:
+            url_groups = [urls]
+        else:
+            url_groups = [[url] for url in urls]
+
+        for urls in url_groups:
+            key = self.get_key(file_info, urls)
+
+            if key not in self._work_items:
+                self._work_items[key] = WorkItem(urls, callback_function, args)
+
+            self._work_items[key].references.append((file_info, error_log))
+
+    def get_key(self, file_info, urls):
+        key = (tuple(urls), str(file_info.component_json[MD5]).lower(), str(file_info.component_json[FILE_SIZE]))
+
+        if file_info.context.check_decompression:  # The archive checks depend on the format
+            key += (str(file_info.component_json[FILE_FORMAT]).lower(),)
+
+        return key
+
+    @property
+    def work_items(self):
+        return self._work_items.values()
+
+    def get_scheduled_work_items(self):
+        work_items = list(self._work_items.values())
+
+        # Entries whose size can't be read go last either way
+        if self.schedule == LARGEST_FIRST:
+            work_items.sort(key=lambda work_item: work_item.file_size, reverse=True)
+        elif self.schedule == SHORTEST_FIRST:
+            work_items.sort(key=lambda work_item: (work_item.file_size is None, work_item.file_size))
+
+        return work_items
+
+    def get_plan(self, context):
+        """
+        Estimates what run() would cost without downloading anything
+
+        :param context: ValidationContext whose checksum cache, artifact store and mirror scoreboard are consulted
+        :return: VerificationPlan
+        """
+        plan = VerificationPlan()
+        worker_loads = [0.0] * max(1, self.workers)
+        unpacked_sizes = {}
+
+        for work_item in self.get_scheduled_work_items():
+            plan.work_item_count += 1
+            file_info = work_item.references[0][0]
+            file_size = work_item.file_size or 0
+            checksum = str(file_info.component_json[MD5]).lower()
+            unpacked_sizes[checksum] = _get_int(file_info.component_json.get(UNCOMPRESSED_FILE_SIZE), file_size)
+
+            if context.artifact_store is not None and context.artifact_store.contains(checksum):
+                plan.cached_bytes += file_size
+                continue
+
+            seconds = 0.0
+
+            for url_number, url in enumerate(work_item.urls):
+                if context.checksum_cache is not None and url in context.checksum_cache:
+                    plan.cached_bytes += file_size
+                    continue
+
+                # In mirror mode only the first mirror is downloaded in full. The others are probed
+                byte_count = file_size if url_number == 0 else min(file_size, _mirrors.DEFAULT_PREFIX_SIZE)
+                throughput = context.mirror_scoreboard.get_throughput(url) if context.mirror_scoreboard else None
+                plan.total_bytes += byte_count
+                plan.hosts.add(_mirrors.get_host_name(url))
+
+                if throughput:
+                    seconds += byte_count / throughput
+                else:
+                    plan.unknown_throughput_bytes += byte_count
+
+            # Same greedy assignment the worker pool ends up doing: the next item goes to the least busy worker
+            worker_loads[worker_loads.index(min(worker_loads))] += seconds
+
+        plan.expected_seconds = max(worker_loads)
+        plan.required_space = sum(unpacked_sizes.values())
+
+        return plan
+
+    def run(self):
+        work_items = self.get_scheduled_work_items()
+        self._work_items.clear()
+
+        if self.sampler is not None:
+            work_items = self.sampler.select(work_items)
+
+        if self.workers > 1 and len(work_items) > 1:
+            return self._run_in_pool(work_items)
+
+        is_valid = True
+
+        for work_item in work_items:
+            if not self.run_work_item(work_item):
+                is_valid = False
+
+        return is_valid
+
+    def _run_in_pool(self, work_items):
+        is_valid = True
+        pool = _pool.ThreadPool(min(self.workers, len(work_items)))
+
+        try:
+            # The first exception (such as ValidationCancelledError) is raised here and the other items are dropped
+            for is_work_item_valid in pool.imap_unordered(self.run_work_item, work_items):
+                if not is_work_item_valid:
+                    is_valid = False
+        finally:
+            pool.terminate()
+            pool.join()
+
+        return is_valid
+
+    def run_work_item(self, work_item):
+        error_log = []
+        first_file_info = work_item.references[0][0]
+
+        if first_file_info.context.error_budget is not None:
+            first_file_info.context.error_budget.check()
+
+        # Same sections as the FileInfo's structural check, so the profiler reports both together
+        with first_file_info.context.profile(first_file_info.name), \
+                first_file_info.context.profile(first_file_info.file_name):
+            is_valid = first_file_info.verify_sources(
+                error_log, work_item.urls, work_item.callback_function, *work_item.args
+            )
+        self.report(work_item, error_log, is_valid)
+
+        if self.sampler is not None:
+            self.sampler.record(work_item, is_valid)
+
+        return is_valid
+
+    def report(self, work_item, error_log, is_valid):
+        # Every reference expects the same checksum, size and format from the same urls, so only the names differ
+        for file_info, reference_error_log in work_item.references:
+            for umbrella_error in error_log:
+                reference_error_log.append(
+                    umbrella_error.copy(component_name=file_info.name, file_name=file_info.file_name)
+                )
+
+            if not is_valid:
+                self._invalid_error_logs.add(id(reference_error_log))
+
+    def is_valid(self, error_log):
+        # Whether every work item that reported into this error log so far was valid
+        return id(error_log) not in self._invalid_error_logs
+
+
+class VerificationPlan(object):
+    """
+    Cost of a validation, worked out before downloading. expected_seconds only covers hosts with a known throughput,
+    unknown_throughput_bytes is what it leaves out. required_space is what all unique artifacts take once unpacked.
+    It is compared with both disk_space and memory, the specification's hardware values in bytes (None when they are
+    missing or can't be read), since Umbrella may build the sandbox in either.
+    """
+    def __init__(self):
+        self.work_item_count = 0
+        self.total_bytes = 0
+        self.cached_bytes = 0
+        self.unknown_throughput_bytes = 0
+        self.hosts = set()
+        self.expected_seconds = 0.0
+        self.required_space = 0
+        self.disk_space = None
+        self.memory = None
+        self.structural_error_count = 0
+
+    @property
+    def host_count(self):
+        return len(self.hosts)
+
+    @property
+    def fits_disk_space(self):
+        if self.disk_space is None:
+            return None
+
+        return self.required_space <= self.disk_space
+
+    @property
+    def fits_memory(self):
+        if self.memory is None:
+            return None
+
+        return self.required_space <= self.memory
+
+    @property
+    def json(self):
+        the_json = {}
+        the_json["work_item_count"] = self.work_item_count
+        the_json["total_bytes"] = self.total_bytes
+        the_json["cached_bytes"] = self.cached_bytes
+        the_json["unknown_throughput_bytes"] = self.unknown_throughput_bytes
+        the_json["hosts"] = sorted(self.hosts)
+        the_json["host_count"] = self.host_count
+        the_json["expected_seconds"] = self.expected_seconds
+        the_json["required_space"] = self.required_space
+        the_json["disk_space"] = self.disk_space
+        the_json["memory"] = self.memory
+        the_json["fits_disk_space"] = self.fits_disk_space
+        the_json["fits_memory"] = self.fits_memory
+        the_json["structural_error_count"] = self.structural_error_count
+
+        return the_json
+
+
+class WorkItem(object):
+    def __init__(self, urls, callback_function=None, args=()):
+        self.urls = urls
+        self.callback_function = callback_function
+        self.args = args
+        self.references = []  # (FileInfo, error log) pairs
+
+    @property
+    def file_size(self):
+        try:
+            return int(self.references[0][0].component_json[FILE_SIZE])
+        except (TypeError, ValueError):
+            return None
+
+
+def _get_int(value, default):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
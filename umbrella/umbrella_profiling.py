@@ -0,0 +1,272 @@
+# This file is part of the daspos-umbrella package.
+#
+# For copyright and licensing information about this package, see the
+# NOTICE.txt and LICENSE.txt files in its top-level directory; they are
+# available at https://github.com/crcresearch/daspos-umbrella
+#
+# Licensed under the MIT License (MIT);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://opensource.org/licenses/MIT
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import cProfile
+import os
+import pstats
+import re
+import sys
+import threading
+
+from umbrella.misc import LazyModule
+
+_hashlib = LazyModule("hashlib")  # Only to tell colliding file names apart
+
+DEFAULT_SAMPLE_INTERVAL = 0.005  # Seconds
+
+COLLAPSED_STACKS_FILE_NAME = "stacks.collapsed"
+ALL_STATS_FILE_NAME = "all.pstats"
+UNSAFE_FILE_NAME_CHARACTERS = re.compile(r"[^\w.-]+")
+
+
+class ValidationProfiler(object):
+    """
+    Profiles a validation section by section. Sections are the specification parsing, each root component and each
+    FileInfo (both its structural check and its downloads), nested in each other as they are run.
+
+    Each section gets a cProfile profile of its own code, not counting the sections nested in it, and a thread
+    samples the stacks of every thread that is inside a section every sample_interval seconds. write() saves a pstats
+    file per section, one for all of them together, and the samples as collapsed stacks (one "frame;frame;frame count"
+    line per stack, prefixed with the section names) that flamegraph.pl and speedscope can read.
+
+    Sections nested deeper than max_depth are counted in their enclosing section, so max_depth=1 keeps specifications
+    with many entries down to a file per component. Sections may run in several threads at once. Only the code
+    between start() and stop() is profiled.
+    """
+    def __init__(self, sample_interval=DEFAULT_SAMPLE_INTERVAL, max_depth=None):
+        self.sample_interval = sample_interval
+        self.max_depth = max_depth
+        self.stack_counts = {}
+        self._profiles = {}  # (section labels, thread id): cProfile.Profile
+        self._section_labels = {}  # thread id: list of section labels the thread is in
+        self._running_profiles = {}  # thread id: list of the profiles enabled in the thread, innermost last
+        self._stop_event = threading.Event()
+        self._sampler_thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_running(self):
+        return self._sampler_thread is not None
+
+    def start(self):
+        if self.is_running:
+            return
+
+        self._stop_event.clear()
+        self._sampler_thread = threading.Thread(target=self._sample_stacks, name="umbrella-profiler")
+        self._sampler_thread.daemon = True
+        self._sampler_thread.start()
+
+    def stop(self):
+        if not self.is_running:
+            return
+
+        self._stop_event.set()
+        self._sampler_thread.join()
+        self._sampler_thread = None
+
+    def section(self, label):
+        return _ProfiledSection(self, label)
+
+    def enter_section(self, label):
+        if not self.is_running:
+            return
+
+        thread_id = threading.current_thread().ident
+        labels = self._section_labels.setdefault(thread_id, [])
+        running_profiles = self._running_profiles.setdefault(thread_id, [])
+
+        if self.max_depth is not None and len(labels) >= self.max_depth:
+            running_profiles.append(None)  # Keeps profiling into the enclosing section
+            return
+
+        labels.append(label)
+
+        with self._lock:
+            profile = self._profiles.setdefault((tuple(labels), thread_id), cProfile.Profile())
+
+        # Only one profile can be enabled in a thread, so the enclosing section is paused
+        if running_profiles:
+            running_profiles[-1].disable()
+
+        running_profiles.append(profile)
+        profile.enable()
+
+    def exit_section(self):
+        thread_id = threading.current_thread().ident
+        running_profiles = self._running_profiles.get(thread_id)
+
+        if not running_profiles:  # The section was entered before start()
+            return
+
+        profile = running_profiles.pop()
+
+        if profile is None:
+            return
+
+        profile.disable()
+        self._section_labels[thread_id].pop()
+
+        if running_profiles:
+            running_profiles[-1].enable()
+
+    def write(self, directory):
+        """
+        :param directory: where the pstats and collapsed stack files are written. It is created when needed
+        :return: list of the paths written
+        """
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        section_profiles = {}
+
+        with self._lock:
+            for (labels, thread_id), profile in self._profiles.items():
+                section_profiles.setdefault(labels, []).append(profile)
+
+            stack_counts = dict(self.stack_counts)
+
+        paths = []
+        all_stats = None
+        file_names = _get_unique_file_names(section_profiles)
+
+        for labels, profiles in sorted(section_profiles.items()):
+            stats = _get_stats(profiles)
+
+            if stats is None:
+                continue
+
+            path = os.path.join(directory, file_names[labels] + ".pstats")
+            stats.dump_stats(path)
+            paths.append(path)
+
+            if all_stats is None:
+                all_stats = pstats.Stats(path)
+            else:
+                all_stats.add(path)
+
+        if all_stats is not None:
+            path = os.path.join(directory, ALL_STATS_FILE_NAME)
+            all_stats.dump_stats(path)
+            paths.append(path)
+
+        path = os.path.join(directory, COLLAPSED_STACKS_FILE_NAME)
+
+        with open(path, "w") as collapsed_stacks_file:
+            for stack, count in sorted(stack_counts.items()):
+                collapsed_stacks_file.write(stack + " " + str(count) + "\n")
+
+        paths.append(path)
+
+        return paths
+
+    def _sample_stacks(self):
+        while not self._stop_event.wait(self.sample_interval):
+            frames = sys._current_frames()
+
+            for thread_id, labels in self._section_labels.items():
+                labels = list(labels)
+
+                if not labels or thread_id not in frames:
+                    continue
+
+                stack = ";".join(
+                    [get_stack_frame_name(label) for label in labels] + get_frame_names(frames[thread_id])
+                )
+
+                with self._lock:
+                    self.stack_counts[stack] = self.stack_counts.get(stack, 0) + 1
+
+
+class _ProfiledSection(object):
+    def __init__(self, profiler, label):
+        self.profiler = profiler
+        self.label = label
+
+    def __enter__(self):
+        self.profiler.enter_section(self.label)
+
+    def __exit__(self, *exception_info):
+        self.profiler.exit_section()
+
+
+class _NoSection(object):
+    # Stands in for a section when nothing is profiled
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exception_info):
+        pass
+
+
+NO_SECTION = _NoSection()
+
+
+def get_frame_names(frame):
+    # Names of the frames from the outermost call to frame, in the "module:function" form flamegraphs show
+    names = []
+
+    while frame is not None:
+        module_name = os.path.splitext(os.path.basename(frame.f_code.co_filename))[0]
+        names.append(module_name + ":" + frame.f_code.co_name)
+        frame = frame.f_back
+
+    names.reverse()
+
+    return [get_stack_frame_name(name) for name in names]
+
+
+def get_stack_frame_name(name):
+    # Collapsed stacks separate frames with ";" and the count with a space, so neither may be in a frame name
+    return name.replace(";", ":").replace(" ", "_")
+
+
+def get_file_name(labels):
+    return UNSAFE_FILE_NAME_CHARACTERS.sub("_", ".".join(labels))
+
+
+def _get_unique_file_names(labels_list):
+    # File name of each section's labels. Names that several sections get (such as "a/b" and "a_b"), or that would
+    # overwrite the combined stats, end with a hash of the labels
+    file_names = dict((labels, get_file_name(labels)) for labels in labels_list)
+    name_counts = {}
+
+    for file_name in file_names.itervalues():
+        name_counts[file_name] = name_counts.get(file_name, 0) + 1
+
+    for labels, file_name in file_names.items():
+        if name_counts[file_name] > 1 or file_name + ".pstats" == ALL_STATS_FILE_NAME:
+            file_names[labels] = file_name + "-" + _hashlib.sha1(repr(labels)).hexdigest()[:8]
+
+    return file_names
+
+
+def _get_stats(profiles):
+    stats = None
+
+    for profile in profiles:
+        profile.create_stats()
+
+        if not profile.stats:  # Never ran any code
+            continue
+
+        if stats is None:
+            stats = pstats.Stats(profile)
+        else:
+            stats.add(profile)
+
+    return stats
@@ -0,0 +1,240 @@
+# This file is part of the daspos-umbrella package.
+#
+# For copyright and licensing information about this package, see the
+# NOTICE.txt and LICENSE.txt files in its top-level directory; they are
+# available at https://github.com/crcresearch/daspos-umbrella
+#
+# Licensed under the MIT License (MIT);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://opensource.org/licenses/MIT
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import json
+import threading
+import time
+
+from umbrella.umbrella_errors import UmbrellaError, BAD_URL_ERROR_CODE, BAD_RECEIPT_ERROR_CODE, \
+    STALE_RECEIPT_ERROR_CODE, TransportError
+from umbrella.misc import LazyModule
+
+# Every validation records its downloads, but only receipts that are made or checked need these
+_hashlib = LazyModule("hashlib")
+_hmac = LazyModule("hmac")
+_pool = LazyModule("multiprocessing.pool")
+_transports = LazyModule("umbrella.umbrella_transports")
+
+RECEIPT_VERSION = 1
+
+# Verification levels, from the least to the most thorough
+STRUCTURE_LEVEL = "structure"  # Only the specification itself was checked
+SAMPLED_LEVEL = "sampled"  # A sampler chose which sources were downloaded
+CHECKSUM_LEVEL = "checksum"  # Every source was downloaded and matched its checksum and size
+ARCHIVE_LEVEL = "archive"  # And the archives were decompressed
+
+LEVELS = [STRUCTURE_LEVEL, SAMPLED_LEVEL, CHECKSUM_LEVEL, ARCHIVE_LEVEL]
+
+
+class VerificationReceipt(object):
+    """
+    Record of a successful validation that later stages can check with check_receipt() instead of validating again.
+    artifacts are dictionaries with the component_name, file_name, url, checksum, size and validators (ETAG and
+    LAST_MODIFIED of the source when it was downloaded) of every source. validators are None for the sources the
+    validation didn't download (cached, stored, only probed or left out by the sampler), which are unverified. signature is an HMAC-SHA256 of the rest of the
+    receipt, or None when it wasn't signed.
+    """
+    def __init__(self, fingerprint, level, artifacts, created_at=None, signature=None):
+        self.fingerprint = fingerprint
+        self.level = level
+        self.artifacts = artifacts
+        self.created_at = time.time() if created_at is None else created_at
+        self.signature = signature
+
+    @property
+    def json(self):
+        the_json = self.get_signed_json()
+        the_json["signature"] = self.signature
+
+        return the_json
+
+    def get_signed_json(self):
+        the_json = {}
+        the_json["version"] = RECEIPT_VERSION
+        the_json["specification"] = self.fingerprint
+        the_json["level"] = self.level
+        the_json["created_at"] = self.created_at
+        the_json["artifacts"] = self.artifacts
+
+        return the_json
+
+    def sign(self, key):
+        self.signature = self._get_signature(key)
+
+    def has_valid_signature(self, key):
+        return self.signature is not None and _hmac.compare_digest(str(self.signature), self._get_signature(key))
+
+    def dumps(self):
+        return json.dumps(self.json, sort_keys=True)
+
+    def _get_signature(self, key):
+        signed_json = json.dumps(self.get_signed_json(), sort_keys=True, separators=(",", ":"))
+
+        return _hmac.new(key, signed_json, _hashlib.sha256).hexdigest()
+
+    @staticmethod
+    def from_json(the_json):
+        if isinstance(the_json, (str, unicode)):
+            the_json = json.loads(the_json)
+
+        if not isinstance(the_json, dict) or the_json.get("version") != RECEIPT_VERSION:
+            raise ValueError("Not a version " + str(RECEIPT_VERSION) + " verification receipt")
+
+        return VerificationReceipt(
+            the_json["specification"], the_json["level"], the_json["artifacts"], the_json["created_at"],
+            the_json.get("signature")
+        )
+
+
+class ReceiptRecorder(object):
+    # Listener that keeps the validators of every source downloaded during a validation, by url
+    def __init__(self):
+        self.validators = {}
+        self._lock = threading.Lock()  # Downloads may run in several threads
+
+    def __call__(self, event, **fields):
+        if event == "download_finished" and fields.get("validators"):
+            with self._lock:
+                self.validators[fields["url"]] = dict(fields["validators"])
+
+
+def get_fingerprint(specification_json):
+    # Hash of the specification that doesn't depend on the order or spacing of its json
+    canonical_json = json.dumps(specification_json, sort_keys=True, separators=(",", ":"))
+
+    return _hashlib.sha256(canonical_json).hexdigest()
+
+
+def get_verification_level(context):
+    if not context.verify_downloads:
+        return STRUCTURE_LEVEL
+
+    if context.sampler is not None:
+        return SAMPLED_LEVEL
+
+    return ARCHIVE_LEVEL if context.check_decompression else CHECKSUM_LEVEL
+
+
+def create_receipt(umbrella_specification, level, validators, hmac_key=None):
+    """
+    :param umbrella_specification: UmbrellaSpecification that was found valid
+    :param validators: dictionary of the validators of the downloaded sources, by url. The other sources are recorded
+        as unverified, since their current validators say nothing about the bytes that were checked
+    :param hmac_key: key the receipt is signed with, when given
+    :return: VerificationReceipt
+    """
+    artifacts = []
+
+    for file_entry in umbrella_specification.get_model().file_entries:
+        for url in file_entry.sources or ():
+            artifacts.append({
+                "component_name": file_entry.component_name, "file_name": file_entry.file_name, "url": url,
+                "checksum": file_entry.checksum, "size": file_entry.size, "validators": validators.get(url),
+            })
+
+    receipt = VerificationReceipt(get_fingerprint(umbrella_specification.specification_json), level, artifacts)
+
+    if hmac_key is not None:
+        receipt.sign(hmac_key)
+
+    return receipt
+
+
+def check_receipt(umbrella_specification, receipt, error_log, hmac_key=None, level=CHECKSUM_LEVEL, max_age=None):
+    """
+    Checks that a receipt still vouches for a specification: it was issued for this very specification, at level
+    or better, max_age seconds ago at most, and every source still has the size and validators it had. Sources are
+    only probed (HEAD requests for http), nothing is downloaded. Unverified sources are refused from CHECKSUM_LEVEL
+    on, and left out below it.
+
+    :param error_log: list the problems are reported to as UmbrellaError objects
+    :param hmac_key: when given, the receipt must have been signed with it
+    :return: True when the receipt can be trusted instead of validating again
+    """
+    problem = None
+
+    if hmac_key is not None and not receipt.has_valid_signature(hmac_key):
+        problem = "Receipt signature is missing or doesn't match"
+    elif receipt.fingerprint != get_fingerprint(umbrella_specification.specification_json):
+        problem = "Receipt was issued for another version of the specification"
+    elif receipt.level not in LEVELS or LEVELS.index(receipt.level) < LEVELS.index(level):
+        problem = "Receipt level \"" + str(receipt.level) + "\" is below \"" + str(level) + '"'
+    elif max_age is not None and time.time() - receipt.created_at > max_age:
+        problem = "Receipt is older than " + str(max_age) + " seconds"
+
+    if problem is not None:
+        error_log.append(UmbrellaError(error_code=BAD_RECEIPT_ERROR_CODE, description=problem, may_be_temporary=False))
+
+        return False
+
+    if receipt.level == STRUCTURE_LEVEL:
+        return True
+
+    context = umbrella_specification.context
+    requires_every_source = LEVELS.index(level) >= LEVELS.index(CHECKSUM_LEVEL)
+    artifacts = [artifact for artifact in receipt.artifacts if artifact["validators"] or requires_every_source]
+    urls = list(set(artifact["url"] for artifact in artifacts if artifact["validators"]))
+    source_infos = dict(zip(urls, _probe(urls, context.transports, context.download_workers)))
+    is_valid = True
+
+    for artifact in artifacts:
+        umbrella_error = _check_artifact(artifact, source_infos.get(artifact["url"]))
+
+        if umbrella_error is not None:
+            error_log.append(umbrella_error)
+            is_valid = False
+
+    return is_valid
+
+
+def _check_artifact(artifact, source_info):
+    fields = dict(component_name=artifact["component_name"], file_name=artifact["file_name"], url=artifact["url"])
+
+    if not artifact["validators"]:
+        description = "The source wasn't downloaded when the receipt was issued, or had no validators (ETag or " \
+                      "Last-Modified) to check it against"
+    elif isinstance(source_info, TransportError):
+        return UmbrellaError(error_code=BAD_URL_ERROR_CODE, description=str(source_info), may_be_temporary=True, **fields)
+    elif source_info.validators != artifact["validators"]:
+        description = "The source changed since it was verified"
+    elif source_info.total_size is not None and artifact["size"] is not None and \
+            source_info.total_size != artifact["size"]:
+        description = "The source is " + str(source_info.total_size) + " bytes instead of " + str(artifact["size"])
+    else:
+        return None
+
+    return UmbrellaError(error_code=STALE_RECEIPT_ERROR_CODE, description=description, may_be_temporary=False, **fields)
+
+
+def _probe(urls, transports, workers):
+    # SourceInfo of each url, or the TransportError raised for it
+    def stat(url):
+        try:
+            return _transports.get_transport(url, transports).stat(url)
+        except TransportError as error:
+            return error
+
+    if workers <= 1 or len(urls) < 2:
+        return [stat(url) for url in urls]
+
+    pool = _pool.ThreadPool(min(workers, len(urls)))
+
+    try:
+        return pool.map(stat, urls)
+    finally:
+        pool.terminate()
+        pool.join()
@@ -0,0 +1,430 @@
+# This file is part of the daspos-umbrella package.
+#
+# For copyright and licensing information about this package, see the
+# NOTICE.txt and LICENSE.txt files in its top-level directory; they are
+# available at https://github.com/crcresearch/daspos-umbrella
+#
+# Licensed under the MIT License (MIT);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://opensource.org/licenses/MIT
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import ConfigParser
+import sqlite3
+import threading
+import time
+import urlparse
+from StringIO import StringIO
+from xml.etree import cElementTree
+
+from umbrella.umbrella_compression import get_decompression_checker
+from umbrella.umbrella_errors import TransportError
+from umbrella.umbrella_packages import compare_versions
+from umbrella.umbrella_transports import get_transport
+
+MAX_CONFIG_SIZE = 1024 * 1024  # Repository configs are a few lines. Anything bigger isn't kept
+READ_SIZE = 64 * 1024
+INSERT_BATCH_SIZE = 1000
+DEFAULT_TIMEOUT = 60.0
+
+REPOMD_PATH = "repodata/repomd.xml"
+REPO_NAMESPACE = "{http://linux.duke.edu/metadata/repo}"
+COMMON_NAMESPACE = "{http://linux.duke.edu/metadata/common}"
+RPM_NAMESPACE = "{http://linux.duke.edu/metadata/rpm}"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS configs (
+    checksum TEXT PRIMARY KEY,
+    content TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS indexes (
+    id INTEGER PRIMARY KEY,
+    checksum TEXT NOT NULL,
+    variables TEXT NOT NULL,
+    indexed_at REAL NOT NULL,
+    UNIQUE (checksum, variables)
+);
+CREATE TABLE IF NOT EXISTS packages (
+    index_id INTEGER NOT NULL REFERENCES indexes (id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    version TEXT,
+    release TEXT
+);
+CREATE INDEX IF NOT EXISTS packages_name ON packages (name, index_id);
+"""
+
+
+class RepositoryConfigReader(object):
+    # Keeps the content of a repository config while it is being hashed, so it doesn't have to be downloaded again
+    def __init__(self):
+        self.content = ""
+        self.error = None
+
+    def update(self, data):
+        if self.error is not None:
+            return
+
+        if len(self.content) + len(data) > MAX_CONFIG_SIZE:
+            self.content = ""
+            self.error = "Repository config is larger than " + str(MAX_CONFIG_SIZE) + " bytes"
+            return
+
+        self.content += data
+
+    def get_cache_fields(self):
+        return {}
+
+    def load_cache_fields(self, cached):
+        return False  # The content isn't cached, so the data is needed
+
+
+class RepositoryIndex(object):
+    """
+    SQLite file with the content of the verified repository configs, by md5 checksum, and the names and versions of
+    the packages their repositories hold. The packages are indexed once per config and set of yum variables
+    ($releasever, $basearch) from the repositories' metadata, then every specification that uses the same config is
+    resolved offline.
+
+    The index is shared by the planner's threads. Use one RepositoryIndex per process.
+    """
+    def __init__(self, path, transports=None, timeout=DEFAULT_TIMEOUT):
+        self.path = path
+        self.transports = transports
+        self.timeout = timeout
+        self.connection = sqlite3.connect(path, timeout=60.0, check_same_thread=False)
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        self.connection.executescript(SCHEMA)
+        self._lock = threading.RLock()
+
+    def close(self):
+        self.connection.close()
+
+    def contains_config(self, checksum):
+        with self._lock:
+            return self.connection.execute(
+                "SELECT 1 FROM configs WHERE checksum = ?", (checksum.lower(),)
+            ).fetchone() is not None
+
+    def save_config(self, checksum, content):
+        with self._lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO configs (checksum, content) VALUES (?, ?)",
+                (checksum.lower(), content.decode("utf-8", "replace"))
+            )
+
+    def get_config(self, checksum):
+        with self._lock:
+            row = self.connection.execute("SELECT content FROM configs WHERE checksum = ?", (checksum.lower(),)).fetchone()
+
+        return row[0] if row else None
+
+    def get_index_id(self, checksum, variables=None):
+        """
+        Indexes the packages of the repositories of a saved config the first time it is needed
+
+        :param variables: dictionary of the yum variables to substitute in the config, such as {"releasever": "6"}
+        :return: id of the index, or None when the config wasn't saved
+        :raises TransportError: when the metadata of a repository can't be fetched
+        :raises ValueError: when the config or the metadata can't be read
+        """
+        variables_key = _get_variables_key(variables)
+
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT id FROM indexes WHERE checksum = ? AND variables = ?", (checksum.lower(), variables_key)
+            ).fetchone()
+
+            if row is not None:
+                return row[0]
+
+            content = self.get_config(checksum)
+
+            if content is None:
+                return None
+
+            return self._index(checksum.lower(), variables_key, content, variables or {})
+
+    def get_versions(self, index_ids, name):
+        # (version, release) of every package and capability called name in the indexes
+        if not index_ids:
+            return []
+
+        with self._lock:
+            return self.connection.execute(
+                "SELECT version, release FROM packages WHERE name = ? AND index_id IN (" +
+                ", ".join("?" * len(index_ids)) + ")",
+                [name] + list(index_ids)
+            ).fetchall()
+
+    def find_unresolved(self, index_ids, requirements):
+        # Requirements that no package of the indexes satisfies
+        return [
+            requirement for requirement in requirements
+            if not any(
+                version is None or requirement.is_satisfied_by(version, release)
+                for version, release in self.get_versions(index_ids, requirement.name)
+            )
+        ]
+
+    def _index(self, checksum, variables_key, content, variables):
+        # Everything is fetched before anything is written, so a failed repository leaves no partial index behind
+        rows = []
+
+        for repository in parse_repository_config(content, variables):
+            rows.extend(self._read_repository(repository))
+
+        with self.connection:
+            cursor = self.connection.execute(
+                "INSERT INTO indexes (checksum, variables, indexed_at) VALUES (?, ?, ?)",
+                (checksum, variables_key, time.time())
+            )
+            index_id = cursor.lastrowid
+
+            for start in xrange(0, len(rows), INSERT_BATCH_SIZE):
+                self.connection.executemany(
+                    "INSERT INTO packages (index_id, name, version, release) VALUES (?, ?, ?, ?)",
+                    [(index_id,) + row for row in rows[start:start + INSERT_BATCH_SIZE]]
+                )
+
+        return index_id
+
+    def _read_repository(self, repository):
+        errors = []
+
+        for base_url in self._get_base_urls(repository):
+            try:
+                return read_primary_metadata(base_url, self.transports, self.timeout)
+            except (TransportError, ValueError) as error:  # Try the next mirror
+                errors.append(error)
+
+        if errors:
+            raise errors[-1]
+
+        raise ValueError("Repository \"" + repository.id + "\" has neither baseurl nor mirrorlist")
+
+    def _get_base_urls(self, repository):
+        if repository.base_urls:
+            return repository.base_urls
+
+        if repository.mirror_list is None:
+            return []
+
+        content = _read_url(repository.mirror_list, self.transports, self.timeout)
+
+        return [line.strip() for line in content.splitlines() if line.strip() and not line.strip().startswith("#")]
+
+
+class Repository(object):
+    __slots__ = ["id", "base_urls", "mirror_list"]
+
+    def __init__(self, id, base_urls, mirror_list=None):
+        self.id = id
+        self.base_urls = base_urls
+        self.mirror_list = mirror_list
+
+
+def parse_repository_config(content, variables=None):
+    """
+    Reads the enabled repositories of a yum .repo file
+
+    :param variables: dictionary of the yum variables to substitute, without the "$"
+    :return: list of Repository
+    :raises ValueError: when the config can't be read
+    """
+    parser = ConfigParser.RawConfigParser()
+
+    try:
+        parser.readfp(StringIO(_substitute_variables(content, variables or {})))
+    except ConfigParser.Error as error:
+        raise ValueError("Invalid repository config: " + str(error))
+
+    repositories = []
+
+    for section in parser.sections():
+        options = dict(parser.items(section))
+
+        if options.get("enabled", "1").strip() in ("0", "false", "no"):
+            continue
+
+        base_urls = options.get("baseurl", "").replace(",", " ").split()
+        repositories.append(Repository(section, base_urls, options.get("mirrorlist")))
+
+    return repositories
+
+
+def read_primary_metadata(base_url, transports=None, timeout=None):
+    """
+    Reads the packages of a yum repository from its primary metadata, which is streamed and decompressed without
+    being kept whole in memory
+
+    :return: list of (name, version, release) of every package and of every capability the packages provide
+    """
+    if not base_url.endswith("/"):
+        base_url += "/"
+
+    repomd = _read_url(_join_url(base_url, REPOMD_PATH), transports, timeout)
+
+    try:
+        root = cElementTree.fromstring(repomd)
+    except SyntaxError as error:
+        raise ValueError("Invalid repomd.xml: " + str(error))
+
+    location = None
+
+    for data in root.findall(REPO_NAMESPACE + "data"):
+        if data.get("type") == "primary":
+            location = data.find(REPO_NAMESPACE + "location")
+
+    if location is None or not location.get("href"):
+        raise ValueError("repomd.xml of " + base_url + " has no primary metadata")
+
+    href = location.get("href")
+    url = _join_url(base_url, href)
+    reader = PrimaryMetadataReader()
+    checker = get_decompression_checker(href.rsplit(".", 1)[-1])
+    observer = reader
+
+    if checker is not None:
+        checker.output_observers.append(reader)
+        observer = checker
+
+    stream = get_transport(url, transports).open(url, timeout)
+
+    try:
+        data = stream.read(READ_SIZE)
+
+        while data:
+            observer.update(data)
+            data = stream.read(READ_SIZE)
+    finally:
+        stream.close()
+
+    observer.finish()
+
+    if checker is not None and checker.error is not None:
+        raise ValueError("Primary metadata of " + base_url + " could not be decompressed: " + str(checker.error))
+
+    return reader.rows
+
+
+class PrimaryMetadataReader(object):
+    # Parses primary.xml as it is fed, keeping only the package and capability rows
+    def __init__(self):
+        self.rows = []
+        self._parser = cElementTree.XMLParser(target=self)
+        self._text = []
+        self._package = None
+
+    def update(self, data):
+        try:
+            self._parser.feed(data)
+        except SyntaxError as error:
+            raise ValueError("Invalid primary metadata: " + str(error))
+
+    def finish(self):
+        try:
+            self._parser.close()
+        except SyntaxError as error:
+            raise ValueError("Invalid primary metadata: " + str(error))
+
+    # XMLParser target methods
+    def start(self, tag, attributes):
+        self._text = []
+
+        if tag == COMMON_NAMESPACE + "package":
+            self._package = {"provides": []}
+        elif self._package is None:
+            return
+        elif tag == COMMON_NAMESPACE + "version":
+            self._package["version"] = attributes.get("ver")
+            self._package["release"] = attributes.get("rel")
+        elif tag == RPM_NAMESPACE + "entry" and self._package.get("in_provides"):
+            self._package["provides"].append((attributes.get("name"), attributes.get("ver"), attributes.get("rel")))
+        elif tag == RPM_NAMESPACE + "provides":
+            self._package["in_provides"] = True
+
+    def end(self, tag):
+        if self._package is None:
+            return
+
+        if tag == COMMON_NAMESPACE + "name":
+            self._package["name"] = "".join(self._text).strip()
+        elif tag == RPM_NAMESPACE + "provides":
+            self._package["in_provides"] = False
+        elif tag == COMMON_NAMESPACE + "package":
+            package = self._package
+            self._package = None
+
+            if package.get("name"):
+                self.rows.append((package["name"], package.get("version"), package.get("release")))
+                self.rows.extend(provide for provide in package["provides"] if provide[0] != package["name"])
+
+    def data(self, data):
+        self._text.append(data)
+
+    def close(self):
+        return None
+
+
+def get_repository_variables(os_version, architecture):
+    # yum's $releasever is the major version of the os, $basearch the architecture family
+    variables = {}
+
+    if os_version:
+        variables["releasever"] = os_version.split(".")[0]
+
+    if architecture:
+        base_architecture = "i386" if architecture in ("i486", "i586", "i686") else architecture
+        variables["basearch"] = base_architecture
+        variables["arch"] = architecture
+
+    return variables
+
+
+def get_newest_version(versions):
+    # Newest (version, release) of a get_versions() result, or None
+    newest = None
+
+    for version, release in versions:
+        if version is None:
+            continue
+
+        if newest is None or compare_versions(version + "-" + (release or ""), newest[0] + "-" + (newest[1] or "")) > 0:
+            newest = (version, release)
+
+    return newest
+
+
+def _read_url(url, transports, timeout):
+    stream = get_transport(url, transports).open(url, timeout)
+
+    try:
+        return stream.read()
+    finally:
+        stream.close()
+
+
+def _join_url(base_url, href):
+    # urlparse.urljoin() ignores the base of schemes it doesn't know, such as the ones of registered transports
+    if urlparse.urlparse(href).scheme:
+        return href
+
+    return base_url + href.lstrip("/")
+
+
+def _substitute_variables(content, variables):
+    # Longest names first, so $basearch isn't replaced as $arch
+    for name in sorted(variables, key=len, reverse=True):
+        content = content.replace("$" + name, variables[name]).replace("${" + name + "}", variables[name])
+
+    return content
+
+
+def _get_variables_key(variables):
+    return "&".join(name + "=" + str(value) for name, value in sorted((variables or {}).items()))
@@ -0,0 +1,177 @@
+# This file is part of the daspos-umbrella package.
+#
+# For copyright and licensing information about this package, see the
+# NOTICE.txt and LICENSE.txt files in its top-level directory; they are
+# available at https://github.com/crcresearch/daspos-umbrella
+#
+# Licensed under the MIT License (MIT);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://opensource.org/licenses/MIT
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+
+from umbrella.umbrella_components import MD5
+
+# Entry state keys
+LAST_VERIFIED_KEY = "last_verified"
+IS_VALID_KEY = "is_valid"
+RUN_KEY = "run"
+RUN_COUNT_KEY = "run_count"
+ENTRIES_KEY = "entries"
+
+
+class RotationSampler(object):
+    """
+    Verifies only part of the work items on each run, rotating through them so that the ones verified longest ago (or
+    never) always go first.
+
+    fraction is the share of work items verified per run, byte_budget caps the declared bytes per run and
+    rotation_runs guarantees every work item is verified at least once every rotation_runs runs (it raises the
+    per-run share to 1 / rotation_runs when needed). A byte budget can break that guarantee; get_coverage() shows how
+    far behind the rotation is. Work items that aren't sampled on a run are not checked and don't make it invalid.
+
+    When a path is given the state is loaded from it and save() writes it back. This class is thread safe.
+    """
+    def __init__(self, path=None, fraction=None, byte_budget=None, rotation_runs=None):
+        if fraction is None and byte_budget is None and rotation_runs is None:
+            raise ValueError("At least one of fraction, byte_budget and rotation_runs is required")
+
+        self.path = path
+        self.fraction = fraction
+        self.byte_budget = byte_budget
+        self.rotation_runs = rotation_runs
+        self.run_count = 0
+        self._entries = {}
+        self._current_keys = []
+        self._selected_keys = set()
+        self._selected_bytes = 0
+        self._lock = threading.Lock()
+
+        if path is not None and os.path.exists(path):
+            with open(path) as state_file:
+                state = json.load(state_file)
+
+            self.run_count = state[RUN_COUNT_KEY]
+            self._entries = state[ENTRIES_KEY]
+
+    def select(self, work_items):
+        with self._lock:
+            self.run_count += 1
+            keys = [get_work_item_key(work_item) for work_item in work_items]
+            self._current_keys = keys
+
+            order = sorted(
+                range(len(work_items)),
+                key=lambda index: (self._get_last_verified(keys[index]), keys[index])
+            )
+            limit = self._get_count_limit(len(work_items))
+            selected = []
+            selected_bytes = 0
+
+            for index in order[:limit]:
+                file_size = work_items[index].file_size or 0
+
+                if self.byte_budget is not None and selected and selected_bytes + file_size > self.byte_budget:
+                    break
+
+                selected.append(index)
+                selected_bytes += file_size
+
+            self._selected_keys = set(keys[index] for index in selected)
+            self._selected_bytes = selected_bytes
+
+            return [work_items[index] for index in sorted(selected)]  # Keep the planner's schedule
+
+    def record(self, work_item, is_valid):
+        with self._lock:
+            self._entries[get_work_item_key(work_item)] = {
+                LAST_VERIFIED_KEY: time.time(), IS_VALID_KEY: is_valid, RUN_KEY: self.run_count,
+            }
+
+    def get_last_verified(self, work_item):
+        with self._lock:
+            entry = self._entries.get(get_work_item_key(work_item))
+
+            return entry[LAST_VERIFIED_KEY] if entry else None
+
+    def get_coverage(self):
+        """
+        Coverage of the work items seen by the last select()
+
+        :return: dictionary with entry_count, selected_count, selected_bytes, verified_count (verified at least once),
+            never_verified_count, overdue_count (not verified within rotation_runs runs) and oldest_verification
+            (time of the least recent verification, None when some were never verified)
+        """
+        with self._lock:
+            entries = [self._entries.get(key) for key in self._current_keys]
+            verified_entries = [entry for entry in entries if entry is not None]
+            overdue_count = 0
+
+            if self.rotation_runs is not None:
+                overdue_count = sum(
+                    1 for entry in entries if entry is None or self.run_count - entry[RUN_KEY] >= self.rotation_runs
+                )
+
+            return {
+                "entry_count": len(entries),
+                "selected_count": len(self._selected_keys),
+                "selected_bytes": self._selected_bytes,
+                "verified_count": len(verified_entries),
+                "never_verified_count": len(entries) - len(verified_entries),
+                "overdue_count": overdue_count,
+                "oldest_verification": (
+                    min(entry[LAST_VERIFIED_KEY] for entry in verified_entries)
+                    if verified_entries and len(verified_entries) == len(entries) else None
+                ),
+            }
+
+    def save(self):
+        if self.path is None:
+            return
+
+        with self._lock:
+            state_json = json.dumps({RUN_COUNT_KEY: self.run_count, ENTRIES_KEY: self._entries})
+
+        file_descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)))
+
+        with os.fdopen(file_descriptor, "w") as temporary_file:
+            temporary_file.write(state_json)
+
+        os.rename(temporary_path, self.path)
+
+    def _get_last_verified(self, key):
+        entry = self._entries.get(key)
+
+        return entry[LAST_VERIFIED_KEY] if entry else -1
+
+    def _get_count_limit(self, count):
+        limits = []
+
+        if self.fraction is not None:
+            limits.append(int(math.ceil(count * self.fraction)))
+
+        if self.rotation_runs is not None:
+            limits.append(int(math.ceil(count / float(self.rotation_runs))))
+
+        if not limits:  # Only a byte budget
+            return count
+
+        return max(1, max(limits)) if count else 0
+
+
+def get_work_item_key(work_item):
+    file_info = work_item.references[0][0]
+
+    return json.dumps([work_item.urls, str(file_info.component_json[MD5]).lower()])
@@ -0,0 +1,198 @@
+# This file is part of the daspos-umbrella package.
+#
+# For copyright and licensing information about this package, see the
+# NOTICE.txt and LICENSE.txt files in its top-level directory; they are
+# available at https://github.com/crcresearch/daspos-umbrella
+#
+# Licensed under the MIT License (MIT);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://opensource.org/licenses/MIT
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import hashlib
+import mmap
+import os
+from multiprocessing import Pool
+
+from umbrella.umbrella_components import MissingComponent, SPECIFICATION_ROOT_COMPONENT_NAMES, FILE_FORMAT, \
+    FILE_SIZE, MD5, MOUNT_POINT
+from umbrella.umbrella_errors import UmbrellaError, WRONG_FILE_SIZE_ERROR_CODE, WRONG_MD5_ERROR_CODE, \
+    SANDBOX_FILE_MISSING_ERROR_CODE, SANDBOX_ESCAPE_ERROR_CODE
+
+# Slices of the mapped file handed to md5 at a time. md5 releases the GIL on buffers this big
+HASH_SLICE_SIZE = 16 * 1024 * 1024
+
+# Only plain files are copied into the sandbox as they were downloaded. Archives are unpacked at their mountpoint,
+# so their checksum can't be compared and they are only checked for existence
+PLAIN_FILE_FORMAT = "plain"
+
+
+class SandboxEntry(object):
+    # is_inside is False when the mountpoint, or a link on the way to it, leads out of the sandbox
+    def __init__(self, component_name, file_name, path, md5, file_size, is_plain, is_inside=True):
+        self.component_name = component_name
+        self.file_name = file_name
+        self.path = path
+        self.md5 = md5
+        self.file_size = file_size
+        self.is_plain = is_plain
+        self.is_inside = is_inside
+
+
+def get_sandbox_entries(umbrella_specification, sandbox_root):
+    """
+    Maps every file entry of a specification that has a mountpoint to its path under sandbox_root
+
+    :param umbrella_specification: UmbrellaSpecification
+    :param sandbox_root: directory that stands for "/" in the mountpoints
+    :return: list of SandboxEntry. Entries that are structurally invalid are left out, validate() reports them
+    """
+    sandbox_root = os.path.realpath(sandbox_root)
+    entries = []
+
+    for component_name in SPECIFICATION_ROOT_COMPONENT_NAMES:
+        component = umbrella_specification.get_component(component_name)
+
+        if isinstance(component, MissingComponent) or not isinstance(component.component_json, dict):
+            continue
+
+        for file_info in component.get_file_infos():
+            file_json = file_info.component_json
+
+            if not isinstance(file_json, dict) or not isinstance(file_json.get(MOUNT_POINT), (str, unicode)):
+                continue
+
+            # A mountpoint such as "/../etc", or a link in the sandbox, must not lead out of the sandbox
+            path = os.path.realpath(os.path.join(sandbox_root, file_json[MOUNT_POINT].lstrip("/")))
+
+            entries.append(SandboxEntry(
+                file_info.name, file_info.file_name, path, str(file_json.get(MD5, "")).lower(),
+                file_json.get(FILE_SIZE), str(file_json.get(FILE_FORMAT, "")).lower() == PLAIN_FILE_FORMAT,
+                path == sandbox_root or path.startswith(sandbox_root + os.sep)
+            ))
+
+    return entries
+
+
+def verify_sandbox(umbrella_specification, sandbox_root, error_log, processes=None):
+    """
+    Checks that the files Umbrella materialized under sandbox_root still match the specification's checksums and
+    sizes. Nothing is downloaded. Files are hashed in parallel by a pool of processes, largest first.
+
+    :param umbrella_specification: UmbrellaSpecification
+    :param sandbox_root: directory that stands for "/" in the mountpoints
+    :param error_log: list the drift is reported to as UmbrellaError objects
+    :param processes: number of hashing processes. None uses one per cpu, 1 hashes in this process
+    :return: True when no drift was found
+    """
+    entries = get_sandbox_entries(umbrella_specification, sandbox_root)
+    is_valid = True
+
+    for entry in entries:
+        if not entry.is_inside:
+            error_log.append(UmbrellaError(
+                error_code=SANDBOX_ESCAPE_ERROR_CODE,
+                description="Mountpoint leads out of the sandbox, to " + entry.path,
+                may_be_temporary=False, component_name=entry.component_name, file_name=entry.file_name
+            ))
+            is_valid = False
+
+    entries = [entry for entry in entries if entry.is_inside]
+
+    for entry in entries:
+        if not entry.is_plain and not os.path.exists(entry.path):
+            error_log.append(_get_missing_error(entry))
+            is_valid = False
+
+    plain_entries = sorted(
+        [entry for entry in entries if entry.is_plain], key=lambda entry: _get_size(entry.path), reverse=True
+    )
+    paths = [entry.path for entry in plain_entries]
+
+    if processes == 1 or len(paths) < 2:
+        results = [hash_file(path) for path in paths]
+    else:
+        pool = Pool(processes)
+
+        try:
+            results = pool.map(hash_file, paths, chunksize=1)
+        finally:
+            pool.terminate()
+            pool.join()
+
+    for entry, (md5, file_size) in zip(plain_entries, results):
+        if not _check_entry(entry, md5, file_size, error_log):
+            is_valid = False
+
+    return is_valid
+
+
+def hash_file(path):
+    """
+    :return: (md5 hex digest, file size), or (None, None) when the file can't be read
+    """
+    try:
+        with open(path, "rb") as local_file:
+            file_size = os.fstat(local_file.fileno()).st_size
+            md5 = hashlib.md5()
+
+            if file_size:  # Empty files can't be mapped
+                mapped_file = mmap.mmap(local_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+                try:
+                    for offset in xrange(0, file_size, HASH_SLICE_SIZE):
+                        md5.update(mapped_file[offset:offset + HASH_SLICE_SIZE])
+                finally:
+                    mapped_file.close()
+
+            return md5.hexdigest(), file_size
+    except (IOError, OSError):
+        return None, None
+
+
+def _check_entry(entry, md5, file_size, error_log):
+    if md5 is None:
+        error_log.append(_get_missing_error(entry))
+        return False
+
+    is_valid = True
+
+    if str(file_size) != str(entry.file_size):
+        error_log.append(UmbrellaError(
+            error_code=WRONG_FILE_SIZE_ERROR_CODE,
+            description="Sandbox file " + entry.path + " has a size of " + str(file_size) +
+                        " bytes. The specification says " + str(entry.file_size),
+            may_be_temporary=False, component_name=entry.component_name, file_name=entry.file_name
+        ))
+        is_valid = False
+
+    if md5 != entry.md5:
+        error_log.append(UmbrellaError(
+            error_code=WRONG_MD5_ERROR_CODE,
+            description="Sandbox file " + entry.path + " has an md5 of " + md5 + ". The specification says " +
+                        entry.md5,
+            may_be_temporary=False, component_name=entry.component_name, file_name=entry.file_name
+        ))
+        is_valid = False
+
+    return is_valid
+
+
+def _get_missing_error(entry):
+    return UmbrellaError(
+        error_code=SANDBOX_FILE_MISSING_ERROR_CODE, description="Sandbox file " + entry.path + " could not be read",
+        may_be_temporary=False, component_name=entry.component_name, file_name=entry.file_name
+    )
+
+
+def _get_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
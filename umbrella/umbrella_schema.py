@@ -0,0 +1,347 @@
+# This file is part of the daspos-umbrella package.
+#
+# For copyright and licensing information about this package, see the
+# NOTICE.txt and LICENSE.txt files in its top-level directory; they are
+# available at https://github.com/crcresearch/daspos-umbrella
+#
+# Licensed under the MIT License (MIT);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://opensource.org/licenses/MIT
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import json
+import os
+import re
+import threading
+
+from umbrella.umbrella_errors import UmbrellaError, REQUIRED_ATTRIBUTE_MISSING_ERROR_CODE, \
+    WRONG_ATTRIBUTE_TYPE_ERROR_CODE
+
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "umbrella_schema.json")
+
+# Legacy required keys format of Component.required_keys, walked by Component.validate_subcomponent
+TYPE = "type"
+NEST = "nest"
+END_NEST = "end_nest"
+
+# JSON schema types, and the names the error descriptions give them
+SCHEMA_TYPES = {
+    "string": ((str, unicode), "string"),
+    "array": ((list,), "list"),
+    "object": ((dict,), "dict"),
+    "integer": ((int, long), "int"),
+    "number": ((int, long, float), "number"),
+    "boolean": ((bool,), "bool"),
+    "null": ((type(None),), "None"),
+}
+
+MATCH_ALL_PATTERNS = ["", ".*", "^.*$", "^.*", ".*$"]
+
+_compiled_schemas = {}
+_compiled_schemas_lock = threading.Lock()
+
+
+class CompiledSchema(object):
+    """
+    Validator functions compiled from the Umbrella JSON schema. Each one checks a value in a single pass, with the
+    type tuples, required keys and child validators of its schema bound in, and reports what's wrong to an error log
+    as REQUIRED_ATTRIBUTE_MISSING and WRONG_ATTRIBUTE_TYPE UmbrellaError objects.
+
+    The validators are called as validator(value, error_log, component_name, key_name) and return whether value is
+    valid. A section validator stops at the "$ref" file entries of the section (it only checks their type), since
+    FileInfo objects validate those with the definition validators.
+
+    Supported keywords are type, properties, required, patternProperties, additionalProperties, items, allOf, $ref
+    and definitions. The others (such as minItems) are documentation only.
+    """
+    def __init__(self, schema):
+        self.schema = schema
+        self.definitions = schema.get("definitions", {})
+        self.required_sections = list(schema.get("required", []))
+        self._sections = schema.get("properties", {})
+        self._validators = {}
+        self._lock = threading.Lock()
+
+    def get_section_validator(self, section_name):
+        # None when the schema doesn't describe the section
+        if section_name not in self._sections:
+            return None
+
+        return self._get_validator(("section", section_name), self._sections[section_name], False)
+
+    def get_definition_validator(self, definition_name):
+        return self._get_validator(("definition", definition_name), self.definitions[definition_name], True)
+
+    def get_required_keys(self, section_name=None, definition_name=None):
+        # The section's or definition's rules in the legacy Component.required_keys format
+        if definition_name is not None:
+            return self._get_required_keys(self.definitions[definition_name], True)
+
+        if section_name not in self._sections:
+            return {}
+
+        return self._get_required_keys(self._sections[section_name], False)
+
+    def _get_validator(self, key, schema, follow_references):
+        validator = self._validators.get(key)
+
+        if validator is not None:
+            return validator
+
+        with self._lock:
+            if key not in self._validators:
+                self._validators[key] = self._compile(schema, follow_references)
+
+            return self._validators[key]
+
+    def _resolve(self, schema):
+        reference = schema["$ref"]
+
+        if not reference.startswith("#/definitions/"):
+            raise ValueError("Only references to the schema's definitions are supported: " + str(reference))
+
+        return self.definitions[reference[len("#/definitions/"):]]
+
+    def _compile(self, schema, follow_references):
+        return _ValidatorGenerator(self, follow_references).generate_function(schema)
+
+    def _get_required_keys(self, schema, follow_references):
+        return dict(
+            (key, self._get_info(schema.get("properties", {}).get(key, {}), follow_references))
+            for key in schema.get("required", [])
+        )
+
+    def _get_info(self, schema, follow_references):
+        if "$ref" in schema:
+            if follow_references:
+                return self._get_info(self._resolve(schema), follow_references)
+
+            return {TYPE: _get_types(self._resolve(schema).get("type"))[0], NEST: END_NEST}
+
+        info = {TYPE: _get_types(schema.get("type"))[0]}
+
+        if isinstance(schema.get("items"), dict):
+            info[NEST] = self._get_info(schema["items"], follow_references)
+        elif schema.get("patternProperties"):
+            info[NEST] = self._get_info(schema["patternProperties"].values()[0], follow_references)
+        elif schema.get("properties"):
+            info[NEST] = END_NEST  # The legacy format can't tell keys apart below the first level
+
+        return info
+
+
+def get_compiled_schema(path=SCHEMA_PATH):
+    # Compiled once per schema file, the first time it is needed
+    compiled_schema = _compiled_schemas.get(path)
+
+    if compiled_schema is not None:
+        return compiled_schema
+
+    with _compiled_schemas_lock:
+        if path not in _compiled_schemas:
+            with open(path) as schema_file:
+                _compiled_schemas[path] = CompiledSchema(json.load(schema_file))
+
+        return _compiled_schemas[path]
+
+
+def _get_types(schema_type):
+    # (tuple of python types, name used in the error descriptions). Any type when the schema doesn't say
+    if schema_type is None:
+        return object, None
+
+    schema_types = schema_type if isinstance(schema_type, list) else [schema_type]
+    python_types = ()
+
+    for the_type in schema_types:
+        if the_type not in SCHEMA_TYPES:
+            raise ValueError("Unsupported schema type \"" + str(the_type) + '"')
+
+        python_types += SCHEMA_TYPES[the_type][0]
+
+    name = " or ".join(SCHEMA_TYPES[the_type][1] for the_type in schema_types)
+
+    if len(python_types) == 1:
+        python_types = python_types[0]
+
+    return python_types, name
+
+
+def _report_type(value, error_log, component_name, key_name, type_name):
+    umbrella_error = UmbrellaError(
+        error_code=WRONG_ATTRIBUTE_TYPE_ERROR_CODE,
+        description="Attribute \"" + str(key_name) + "\" is of type \"" + str(value.__class__.__name__) +
+                    "\" but should be of type \"" + type_name + '"',
+        may_be_temporary=False, component_name=component_name
+    )
+    error_log.append(umbrella_error)
+
+    return False
+
+
+def _report_missing(error_log, component_name, key_name):
+    umbrella_error = UmbrellaError(
+        error_code=REQUIRED_ATTRIBUTE_MISSING_ERROR_CODE, description="Attribute \"" + str(key_name) + "\" is required",
+        may_be_temporary=False, component_name=component_name
+    )
+    error_log.append(umbrella_error)
+
+    return False
+
+
+class _ValidatorGenerator(object):
+    """
+    Writes the python source of the validator of a schema, with every check of every level inlined, and compiles it.
+    Nothing is looked up in the schema when the validator runs, and a value of the wrong type isn't looked into.
+    """
+    def __init__(self, compiled_schema, follow_references):
+        self.compiled_schema = compiled_schema
+        self.follow_references = follow_references
+        self.lines = []
+        self.namespace = {"_report_type": _report_type, "_report_missing": _report_missing, "_MISSING": object()}
+        self.name_count = 0
+
+    def generate_function(self, schema):
+        self.emit(0, "def validate(value, error_log, component_name, key_name):")
+        self.emit(1, "is_valid = True")
+        self.generate(schema, "value", "key_name", 1)
+        self.emit(1, "return is_valid")
+        exec compile("\n".join(self.lines) + "\n", "<umbrella schema validator>", "exec") in self.namespace
+
+        return self.namespace["validate"]
+
+    def emit(self, indent, line):
+        self.lines.append("    " * indent + line)
+
+    def get_name(self, prefix, value=None):
+        self.name_count += 1
+        name = prefix + str(self.name_count)
+
+        if value is not None:
+            self.namespace[name] = value
+
+        return name
+
+    def generate_block(self, indent, generate):
+        line_count = len(self.lines)
+        generate(indent)
+
+        if len(self.lines) == line_count:
+            self.emit(indent, "pass")
+
+    def generate(self, schema, value, key, indent):
+        if "$ref" in schema:
+            schema = self.compiled_schema._resolve(schema)
+
+            if not self.follow_references:  # File entries are validated by their FileInfo objects
+                schema = {"type": schema.get("type")}
+
+        python_types, type_name = _get_types(schema.get("type"))
+
+        if type_name is None:
+            self.generate_checks(schema, value, key, indent, python_types)
+            return
+
+        lines, self.lines = self.lines, []
+        self.generate_checks(schema, value, key, indent + 1, python_types)
+        lines, self.lines = self.lines, lines
+
+        self.emit(indent, "if not isinstance(" + value + ", " + self.get_name("types", python_types) + "):")
+        self.emit(
+            indent + 1,
+            "is_valid = _report_type(" + value + ", error_log, component_name, " + key + ", " + repr(type_name) + ")"
+        )
+
+        if lines:
+            self.emit(indent, "else:")
+            self.lines.extend(lines)
+
+    def generate_checks(self, schema, value, key, indent, python_types):
+        for subschema in schema.get("allOf", []):
+            self.generate(subschema, value, key, indent)
+
+        properties = schema.get("properties", {})
+        patterns = schema.get("patternProperties", {})
+        additional_properties = schema.get("additionalProperties")
+
+        if properties or patterns or schema.get("required") or isinstance(additional_properties, dict):
+            self.generate_guarded(dict, python_types, value, indent, lambda block_indent: self.generate_object(
+                schema, value, block_indent
+            ))
+
+        if isinstance(schema.get("items"), dict):
+            self.generate_guarded(list, python_types, value, indent, lambda block_indent: self.generate_items(
+                schema["items"], value, key, block_indent
+            ))
+
+    def generate_guarded(self, the_type, python_types, value, indent, generate):
+        # Keywords of objects and arrays only apply to values of that type
+        if python_types is the_type:
+            generate(indent)
+        else:
+            self.emit(indent, "if isinstance(" + value + ", " + the_type.__name__ + "):")
+            generate(indent + 1)
+
+    def generate_object(self, schema, value, indent):
+        properties = schema.get("properties", {})
+        required_keys = schema.get("required", [])
+
+        for key in required_keys:
+            if key not in properties:
+                self.emit(indent, "if " + repr(key) + " not in " + value + ":")
+                self.emit(indent + 1, "is_valid = _report_missing(error_log, component_name, " + repr(key) + ")")
+
+        for key, subschema in sorted(properties.items()):
+            item = self.get_name("item")
+            self.emit(indent, item + " = " + value + ".get(" + repr(key) + ", _MISSING)")
+
+            if key in required_keys:
+                self.emit(indent, "if " + item + " is _MISSING:")
+                self.emit(indent + 1, "is_valid = _report_missing(error_log, component_name, " + repr(key) + ")")
+                self.emit(indent, "else:")
+            else:
+                self.emit(indent, "if " + item + " is not _MISSING:")
+
+            self.generate_block(
+                indent + 1, lambda block_indent: self.generate(subschema, item, repr(key), block_indent)
+            )
+
+        patterns = sorted(schema.get("patternProperties", {}).items())
+        additional_properties = schema.get("additionalProperties")
+
+        if not patterns and not isinstance(additional_properties, dict):
+            return
+
+        key = self.get_name("key")
+        item = self.get_name("item")
+        self.emit(indent, "for " + key + ", " + item + " in " + value + ".iteritems():")
+        conditions = []
+
+        for pattern, subschema in patterns:
+            if pattern in MATCH_ALL_PATTERNS:
+                conditions.append("True")
+                self.generate_block(indent + 1, lambda block_indent: self.generate(subschema, item, key, block_indent))
+            else:
+                condition = self.get_name("pattern", re.compile(pattern)) + ".search(" + key + ")"
+                conditions.append(condition)
+                self.emit(indent + 1, "if " + condition + ":")
+                self.generate_block(indent + 2, lambda block_indent: self.generate(subschema, item, key, block_indent))
+
+        if isinstance(additional_properties, dict) and "True" not in conditions:
+            conditions.append(key + " in " + self.get_name("properties", frozenset(properties)))
+            self.emit(indent + 1, "if not (" + " or ".join(conditions) + "):")
+            self.generate_block(
+                indent + 2, lambda block_indent: self.generate(additional_properties, item, key, block_indent)
+            )
+
+    def generate_items(self, schema, value, key, indent):
+        # Items are reported under the name of their list
+        item = self.get_name("item")
+        self.emit(indent, "for " + item + " in " + value + ":")
+        self.generate_block(indent + 1, lambda block_indent: self.generate(schema, item, key, block_indent))
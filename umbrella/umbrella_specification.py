@@ -18,21 +18,38 @@
 
 import json
 
-from umbrella.umbrella_components import MissingComponent, Component, MissingComponentError, \
-    SPECIFICATION_ROOT_COMPONENT_NAMES
+from umbrella.misc import LazyModule
+from umbrella.umbrella_components import MissingComponent, Component, MissingComponentError, HardwareComponent, \
+    PackageManagerComponent, SPECIFICATION_ROOT_COMPONENT_NAMES, HARDWARE, OS, PACKAGE_MANAGER, VERSION, \
+    ARCHITECTURE, get_component_class
 from umbrella.umbrella_errors import UmbrellaError, REQUIRED_SECTION_MISSING_ERROR_CODE, ComponentTypeError, \
-    WRONG_SECTION_TYPE_ERROR_CODE, JsonError
+    WRONG_SECTION_TYPE_ERROR_CODE, JsonError, ErrorBudget, ErrorLog, ValidationCancelledError
+from umbrella.umbrella_context import get_context
+from umbrella.umbrella_model import get_specification_model
+from umbrella.umbrella_planner import VerificationPlanner
+from umbrella.umbrella_profiling import ValidationProfiler
+from umbrella.umbrella_receipts import ReceiptRecorder, VerificationReceipt, create_receipt, check_receipt, \
+    get_verification_level, CHECKSUM_LEVEL
+
+# Only needed to resolve packages and to verify sandboxes
+_repositories = LazyModule("umbrella.umbrella_repositories")
+_sandbox = LazyModule("umbrella.umbrella_sandbox")
 
 
 class UmbrellaSpecification:
     """
     Note this class is NOT thread safe. Do not use it in multithreaded environment.
     """
-    def __init__(self, specification=None):
+    def __init__(self, specification=None, context=None):
+        self.context = get_context(context)
         self._error_log = []
         self._warning_log = []
         self.callback_function = lambda *args, **kwargs: True
         self.args = []
+        self._receipt_recorder = None
+        self._verification_level = None  # Of the last validation, when it was valid
+        self._cache_key = None  # Key in the context's specification cache, until the specification is saved there
+        self._is_cached = False  # Loaded from the specification cache, so the structural checks already passed
 
         if specification is None:
             self.specification_json = {}
@@ -41,20 +58,43 @@ class UmbrellaSpecification:
                 raise TypeError("Specification must be a file-like object, json in string form, or a python dictionary")
 
             # Open Specification
-            if hasattr(specification, "read"):
-                try:
-                    self.specification_json = json.load(specification)
-                except:
-                    raise JsonError("Specification was invalid json")
-            elif isinstance(specification, (str, unicode)):
-                try:
-                    self.specification_json = json.loads(specification)
-                except:
-                    raise JsonError("Specification was invalid json")
-            elif isinstance(specification, dict):
-                self.specification_json = specification
-            else:
-                raise ValueError("Specification must be an open file, json in string form, or a python dictionary")
+            with self.context.profile("parse"):
+                if self.context.specification_cache is not None and not isinstance(specification, dict):
+                    specification = self._load_from_cache(specification)
+
+                if self._is_cached:  # Already in specification_json
+                    pass
+                elif hasattr(specification, "read"):
+                    try:
+                        self.specification_json = json.load(specification)
+                    except:
+                        raise JsonError("Specification was invalid json")
+                elif isinstance(specification, (str, unicode)):
+                    try:
+                        self.specification_json = json.loads(specification)
+                    except:
+                        raise JsonError("Specification was invalid json")
+                elif isinstance(specification, dict):
+                    self.specification_json = specification
+                else:
+                    raise ValueError(
+                        "Specification must be an open file, json in string form, or a python dictionary"
+                    )
+
+    def _load_from_cache(self, specification):
+        # Returns the json text, which is only parsed when the cache doesn't have it
+        if hasattr(specification, "read"):
+            specification = specification.read()
+
+        self._cache_key = self.context.specification_cache.get_key(specification)
+        specification_json = self.context.specification_cache.load(self._cache_key)
+
+        if specification_json is not None:
+            self.specification_json = specification_json
+            self._cache_key = None
+            self._is_cached = True
+
+        return specification
 
     @property
     def error_log(self):
@@ -64,56 +104,320 @@ class UmbrellaSpecification:
     def warning_log(self):
         return self._warning_log
 
-    def validate(self, callback_function=None, *args):
-        is_valid = True
-
+    def validate(self, callback_function=None, *args, **kwargs):
+        # Keyword arguments stop_on_first_error=True or max_errors=N cancel the validation, including the downloads
+        # that are queued or running, as soon as more errors than allowed are found.
+        # profile_directory=path profiles the validation and writes the results there (see ValidationProfiler). To
+        # profile the parsing too, or several validations together, put a started profiler in the context instead
         self._error_log = []
         self._warning_log = []
+        self._verification_level = None
 
         self.callback_function = callback_function
         self.args = args
 
+        context = self.context.copy()
+        planner = context.planner
+        self._receipt_recorder = ReceiptRecorder()
+        context.add_listener(self._receipt_recorder)
+
+        if kwargs.get("stop_on_first_error"):
+            context = context.copy(error_budget=ErrorBudget(0))
+        elif kwargs.get("max_errors") is not None:
+            context = context.copy(error_budget=ErrorBudget(kwargs["max_errors"]))
+
+        if context.error_budget is not None:
+            self._error_log = ErrorLog(context.error_budget)
+
+        profile_directory = kwargs.get("profile_directory")
+
+        if profile_directory is not None and context.profiler is None:
+            context = context.copy(profiler=ValidationProfiler())
+            context.profiler.start()
+        else:
+            profile_directory = None
+
+        # Downloads are planned while the components are checked, so a source referenced several times is only
+        # downloaded once. A planner shared through the context is run by its owner (see validate_specifications)
+        if planner is None and context.verify_downloads:
+            context = context.copy(planner=VerificationPlanner(context.schedule, context.download_workers, context.sampler))
+
+        try:
+            if context.error_budget is not None:
+                context.error_budget.check()
+
+            if self._is_cached:
+                is_valid = self._check_sources(context, self._error_log)
+            else:
+                is_valid = self._validate_components(context, self._error_log)
+                self._save_to_cache(context, is_valid)
+
+            if planner is None and context.planner is not None and not context.planner.run():
+                is_valid = False
+
+            # The repository configs were just verified, or come from earlier runs
+            if planner is None:
+                self.resolve_packages(context)
+        except ValidationCancelledError:
+            is_valid = False
+        finally:
+            if planner is None:
+                _save_state(context)
+
+            if profile_directory is not None:
+                context.profiler.stop()
+                context.profiler.write(profile_directory)
+
+        if is_valid:
+            self._verification_level = get_verification_level(context)
+
+        return is_valid
+
+    def get_receipt(self, hmac_key=None):
+        """
+        Receipt of the last validation, which must have been valid, that check_receipt() accepts later instead of
+        validating again. Sources that weren't downloaded by this validation (cached, stored or mirrors that were
+        only probed) are recorded as unverified, so the receipt doesn't vouch for them.
+
+        :param hmac_key: key the receipt is signed with, when given
+        :return: VerificationReceipt
+        """
+        if self._verification_level is None:
+            raise ValueError("Only a specification that was just found valid gets a receipt")
+
+        return create_receipt(self, self._verification_level, self._receipt_recorder.validators, hmac_key)
+
+    def check_receipt(self, receipt, hmac_key=None, level=CHECKSUM_LEVEL, max_age=None):
+        """
+        Checks, with probes of the sources instead of downloads, that a receipt still vouches for this specification.
+        Like validate(), the error log is replaced by the problems that were found. See umbrella_receipts.check_receipt
+
+        :param receipt: VerificationReceipt, or its json
+        :return: True when the receipt can be trusted
+        """
+        self._error_log = []
+
+        if not isinstance(receipt, VerificationReceipt):
+            receipt = VerificationReceipt.from_json(receipt)
+
+        return check_receipt(self, receipt, self._error_log, hmac_key, level, max_age)
+
+    def verify_sandbox(self, sandbox_root, processes=None):
+        """
+        Checks the files Umbrella materialized under sandbox_root against the specification, without any network.
+        Like validate(), the error log is replaced by the drift that was found.
+
+        :param sandbox_root: directory that stands for "/" in the mountpoints
+        :param processes: number of hashing processes. None uses one per cpu
+        :return: True when every file still matches its checksum and size
+        """
+        self._error_log = []
+
+        return _sandbox.verify_sandbox(self, sandbox_root, self._error_log, processes)
+
+    def _validate_components(self, context, error_log):
+        is_valid = True
+
         # Go through each of the known components and check their validity
         for component_name in SPECIFICATION_ROOT_COMPONENT_NAMES:
-            component = self.get_component(component_name)
-
-            try:
-                is_component_valid = component.validate(self._error_log)
-            except MissingComponentError:
-                if component.is_required:
-                    umbrella_error = UmbrellaError(
-                        error_code=REQUIRED_SECTION_MISSING_ERROR_CODE, description="Missing section",
-                        may_be_temporary=False, component_name=component_name
-                    )
-                    self._error_log.append(umbrella_error)
-                    is_component_valid = False
-                else:
-                    is_component_valid = True
-            except ComponentTypeError as error:
-                if isinstance(error.correct_type, tuple):
-                    correct_type = "string"
-                else:
-                    correct_type = error.correct_type.__name__
+            if not self.validate_component(component_name, error_log, context):
+                is_valid = False
 
+        return is_valid
+
+    def _check_sources(self, context, error_log):
+        # What _validate_components() does for a specification whose structure is known to be valid
+        is_valid = True
+
+        if not context.verify_downloads:
+            return is_valid
+
+        for component_name in SPECIFICATION_ROOT_COMPONENT_NAMES:
+            component = self.get_component(component_name, context)
+
+            with context.profile(component_name):
+                for file_info in component.get_file_infos():
+                    with context.profile(file_info.file_name):
+                        if not file_info.check_sources(error_log):
+                            is_valid = False
+
+        return is_valid
+
+    def _save_to_cache(self, context, is_structurally_valid):
+        if self._cache_key is None or context.specification_cache is None or not is_structurally_valid:
+            return
+
+        # Only once: specification_json may be changed after the first validation
+        context.specification_cache.save(self._cache_key, self.specification_json)
+        self._cache_key = None
+
+    def validate_component(self, component_name, error_log, context=None):
+        # Validates one root component into error_log. Downloads go to the context's planner when it has one
+        component = self.get_component(component_name, context)
+
+        if context is None:
+            context = self.context
+
+        try:
+            with context.profile(component_name):
+                is_component_valid = component.validate(error_log)
+        except MissingComponentError:
+            if component.is_required:
                 umbrella_error = UmbrellaError(
-                    error_code=WRONG_SECTION_TYPE_ERROR_CODE,
-                    description="Wrong section type of \"" + str(error.attempted_type.__name__) + "\". Should be type \"" +
-                                str(correct_type) + '"',
+                    error_code=REQUIRED_SECTION_MISSING_ERROR_CODE, description="Missing section",
                     may_be_temporary=False, component_name=component_name
                 )
-                self._error_log.append(umbrella_error)
+                error_log.append(umbrella_error)
                 is_component_valid = False
+            else:
+                is_component_valid = True
+        except ComponentTypeError as error:
+            if isinstance(error.correct_type, tuple):
+                correct_type = "string"
+            else:
+                correct_type = error.correct_type.__name__
 
-            if not is_component_valid:
-                is_valid = False
+            umbrella_error = UmbrellaError(
+                error_code=WRONG_SECTION_TYPE_ERROR_CODE,
+                description="Wrong section type of \"" + str(error.attempted_type.__name__) + "\". Should be type \"" +
+                            str(correct_type) + '"',
+                may_be_temporary=False, component_name=component_name
+            )
+            error_log.append(umbrella_error)
+            is_component_valid = False
 
-        return is_valid
+        return is_component_valid
+
+    def resolve_packages(self, context=None):
+        """
+        Adds a warning to the warning log for each package that isn't in the package manager's repositories, when the
+        context has a repository index
+
+        :return: list of the PackageRequirement that were not found
+        """
+        if context is None:
+            context = self.context
+
+        package_manager = self.get_component(PACKAGE_MANAGER, context)
+
+        if context.repository_index is None or not isinstance(package_manager, PackageManagerComponent) or \
+                not isinstance(package_manager.component_json, dict):
+            return []
+
+        operating_system = self.specification_json.get(OS)
+        hardware = self.specification_json.get(HARDWARE)
+        variables = _repositories.get_repository_variables(
+            operating_system.get(VERSION) if isinstance(operating_system, dict) else None,
+            hardware.get(ARCHITECTURE) if isinstance(hardware, dict) else None
+        )
+
+        with context.profile("resolve_packages"):
+            return package_manager.resolve_packages(self._warning_log, variables)
+
+    def plan(self):
+        """
+        Works out what validate() would download, and whether the artifacts fit the declared hardware, without
+        downloading anything. The error log is left untouched.
+
+        :return: VerificationPlan
+        """
+        planner = VerificationPlanner(self.context.schedule, self.context.download_workers)
+        context = self.context.copy(planner=planner, verify_downloads=True, error_budget=None)
+        error_log = []
+
+        self._validate_components(context, error_log)
+
+        plan = planner.get_plan(context)
+        plan.structural_error_count = len(error_log)
+
+        hardware = self.get_component(HARDWARE)
+
+        if isinstance(hardware, HardwareComponent):
+            plan.disk_space = hardware.get_disk_space()
+            plan.memory = hardware.get_memory()
+
+        return plan
+
+    def get_model(self):
+        # SpecificationModel of the specification as it is now. Build it again after changing specification_json
+        return get_specification_model(self)
+
+    def get_component(self, component_name, context=None):
+        if context is None:
+            context = self.context
 
-    def get_component(self, component_name):
         if component_name in self.specification_json:
-            return Component.get_specific_component(component_name, self.specification_json[component_name])
+            return Component.get_specific_component(
+                component_name, self.specification_json[component_name], context
+            )
         else:
-            missing_component = MissingComponent(component_name)
-            missing_component.is_required = Component.get_specific_component(component_name, None).is_required
+            missing_component = MissingComponent(component_name, context=context)
+            missing_component.is_required = get_component_class(component_name).is_required
+
+            return missing_component
+
+
+def validate_specifications(specifications, context=None, profile_directory=None):
+    """
+    Validates several specifications together. A source referenced by more than one of them is only downloaded once.
+    An error budget in the context counts the errors of all the specifications. When it is exceeded the rest of the
+    batch is cancelled and every specification is reported as invalid.
+
+    :param specifications: UmbrellaSpecification objects. Their own contexts are replaced by the shared one
+    :param context: ValidationContext shared by all of the specifications
+    :param profile_directory: when given, the whole batch is profiled and the results are written there
+    :return: list with whether each specification is valid, in the same order
+    """
+    context = get_context(context)
+
+    if profile_directory is not None and context.profiler is None:
+        context = context.copy(profiler=ValidationProfiler())
+        context.profiler.start()
+    else:
+        profile_directory = None
+
+    if context.planner is None:
+        context = context.copy(planner=VerificationPlanner(context.schedule, context.download_workers, context.sampler))
+
+    structural_results = []
+
+    for specification in specifications:
+        specification.context = context
+        structural_results.append(specification.validate())
+
+    try:
+        context.planner.run()
+        is_cancelled = False
+    except ValidationCancelledError:
+        is_cancelled = True
+    finally:
+        _save_state(context)
+
+        if profile_directory is not None:
+            context.profiler.stop()
+            context.profiler.write(profile_directory)
+
+    if context.error_budget is not None and context.error_budget.is_exceeded:
+        is_cancelled = True
+
+    if not is_cancelled:
+        for specification in specifications:
+            specification.resolve_packages(context)
+
+    results = [
+        not is_cancelled and is_valid and context.planner.is_valid(specification.error_log)
+        for is_valid, specification in zip(structural_results, specifications)
+    ]
+
+    # The downloads ran after validate() returned, so its verdict was only structural
+    for is_valid, specification in zip(results, specifications):
+        specification._verification_level = get_verification_level(context) if is_valid else None
+
+    return results
+
 
-            return missing_component
\ No newline at end of file
+def _save_state(context):
+    # Whatever the context learned during the run that should outlive it
+    for state in [context.mirror_scoreboard, context.sampler]:
+        if state is not None:
+            state.save()
@@ -0,0 +1,141 @@
+# This file is part of the daspos-umbrella package.
+#
+# For copyright and licensing information about this package, see the
+# NOTICE.txt and LICENSE.txt files in its top-level directory; they are
+# available at https://github.com/crcresearch/daspos-umbrella
+#
+# Licensed under the MIT License (MIT);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://opensource.org/licenses/MIT
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import gc
+import hashlib
+import marshal
+import mmap
+import os
+import sys
+import tempfile
+
+import umbrella
+from umbrella.umbrella_components import COMPONENT_CLASSES
+from umbrella.umbrella_schema import SCHEMA_PATH
+from umbrella.umbrella_store import _make_directories
+
+CACHE_MAGIC = "UMBSPEC1"  # First bytes of every cache file, followed by the marshal data
+CACHE_FILE_EXTENSION = ".spec"
+
+_schema_hashes = {}  # sha256 of each schema file, by path
+
+
+class SpecificationCache(object):
+    """
+    Parsed specifications that passed their structural checks, kept on local disk in marshal's binary format. Entries
+    are keyed by the sha256 of the specification's json text, the library and python versions, the schema and the
+    registered component classes, so anything that could change the structural verdict makes a new key.
+
+    With a cache in its context, UmbrellaSpecification maps a cached specification's file instead of parsing its json,
+    and validate() skips the structural checks and only verifies the downloads. A specification is saved the first
+    time validate() finds it structurally valid, so its specification_json must not be changed before that.
+    Files are written to a temporary file and renamed into place. Several processes may share a cache directory.
+    """
+    def __init__(self, directory):
+        self.directory = os.path.abspath(directory)
+
+        _make_directories(self.directory)
+
+    def get_key(self, specification_text):
+        if isinstance(specification_text, unicode):
+            specification_text = specification_text.encode("utf-8")
+
+        key_hash = hashlib.sha256(_get_library_fingerprint())
+        key_hash.update(specification_text)
+
+        return key_hash.hexdigest()
+
+    def get_path(self, key):
+        return os.path.join(self.directory, key[:2], key + CACHE_FILE_EXTENSION)
+
+    def contains(self, key):
+        return os.path.isfile(self.get_path(key))
+
+    def load(self, key):
+        # Parsed json of the specification, or None when it isn't cached
+        path = self.get_path(key)
+
+        try:
+            with open(path, "rb") as cache_file:
+                data = mmap.mmap(cache_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (IOError, OSError, ValueError):  # Missing, or empty so it can't be mapped
+            return None
+
+        # The cyclic garbage collector would otherwise run over and over while millions of containers are created,
+        # and marshal data can't hold cycles anyway
+        is_gc_enabled = gc.isenabled()
+        gc.disable()
+
+        try:
+            if data[:len(CACHE_MAGIC)] != CACHE_MAGIC:
+                raise ValueError("Not a specification cache file")
+
+            # marshal reads straight from the mapped pages, without copying them into a string first
+            return marshal.loads(buffer(data, len(CACHE_MAGIC)))
+        except (ValueError, EOFError, TypeError):
+            self.discard(key)
+
+            return None
+        finally:
+            if is_gc_enabled:
+                gc.enable()
+
+            data.close()
+
+    def save(self, key, specification_json):
+        path = self.get_path(key)
+        _make_directories(os.path.dirname(path))
+        file_descriptor, temporary_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+
+        try:
+            with os.fdopen(file_descriptor, "wb") as temporary_file:
+                temporary_file.write(CACHE_MAGIC)
+                marshal.dump(specification_json, temporary_file, marshal.version)
+
+            os.rename(temporary_path, path)
+        except:
+            os.remove(temporary_path)
+            raise
+
+    def discard(self, key):
+        try:
+            os.remove(self.get_path(key))
+        except OSError:
+            pass
+
+
+def _get_library_fingerprint():
+    # The structural checks depend on the library, its schema and the registered components, and marshal's format on
+    # python's version
+    component_classes = sorted(
+        component_name + "=" + component_class.__module__ + "." + component_class.__name__
+        for component_name, component_class in COMPONENT_CLASSES.iteritems()
+    )
+
+    return "\n".join(
+        [CACHE_MAGIC, umbrella.__version__, _get_schema_hash(), str(marshal.version), sys.version.split()[0]] +
+        component_classes
+    ) + "\n\n"
+
+
+def _get_schema_hash(path=SCHEMA_PATH):
+    # Read once per process, like the compiled schema the structural checks use
+    if path not in _schema_hashes:
+        with open(path, "rb") as schema_file:
+            _schema_hashes[path] = hashlib.sha256(schema_file.read()).hexdigest()
+
+    return _schema_hashes[path]
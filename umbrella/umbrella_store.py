@@ -0,0 +1,215 @@
+# This file is part of the daspos-umbrella package.
+#
+# For copyright and licensing information about this package, see the
+# NOTICE.txt and LICENSE.txt files in its top-level directory; they are
+# available at https://github.com/crcresearch/daspos-umbrella
+#
+# Licensed under the MIT License (MIT);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://opensource.org/licenses/MIT
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import errno
+import os
+import tempfile
+import threading
+import time
+import urllib
+
+TEMPORARY_DIRECTORY_NAME = "tmp"
+
+
+class ArtifactStore(object):
+    """
+    Content addressed store of verified artifacts on local disk, keyed by md5 checksum.
+
+    Files are written to a temporary file and renamed into place, so readers never see partial artifacts. When
+    max_size (in bytes) is set, the least recently used artifacts are removed once the store grows past it.
+    This class is thread safe. Several processes may share a store directory.
+    """
+    def __init__(self, directory, max_size=None):
+        self.directory = os.path.abspath(directory)
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries = None  # checksum -> [size, last used time], loaded on first use
+        self._total_size = 0
+
+        _make_directories(os.path.join(self.directory, TEMPORARY_DIRECTORY_NAME))
+
+    def get_path(self, checksum):
+        return os.path.join(self.directory, checksum[:2], checksum)
+
+    def get_url(self, checksum):
+        checksum = _normalize_checksum(checksum)
+
+        if not self.contains(checksum):
+            return None
+
+        return "file://" + urllib.pathname2url(self.get_path(checksum))
+
+    def contains(self, checksum):
+        return os.path.isfile(self.get_path(_normalize_checksum(checksum)))
+
+    def open(self, checksum):
+        checksum = _normalize_checksum(checksum)
+
+        try:
+            stored_file = open(self.get_path(checksum), "rb")
+        except IOError:
+            return None
+
+        self._touch(checksum)
+
+        return stored_file
+
+    def get_writer(self, checksum, file_size=None):
+        return ArtifactStoreWriter(self, _normalize_checksum(checksum), file_size)
+
+    def remove(self, checksum):
+        checksum = _normalize_checksum(checksum)
+
+        with self._lock:
+            self._load_entries()
+            self._remove(checksum)
+
+    def _add(self, temporary_path, checksum, file_size):
+        path = self.get_path(checksum)
+        _make_directories(os.path.dirname(path))
+        os.rename(temporary_path, path)
+
+        with self._lock:
+            self._load_entries()
+
+            if checksum in self._entries:
+                self._total_size -= self._entries[checksum][0]
+
+            self._entries[checksum] = [file_size, time.time()]
+            self._total_size += file_size
+            self._evict()
+
+    def _touch(self, checksum):
+        now = time.time()
+
+        try:
+            os.utime(self.get_path(checksum), (now, now))  # mtime is the last used time for other processes
+        except OSError:
+            pass
+
+        with self._lock:
+            if self._entries is not None and checksum in self._entries:
+                self._entries[checksum][1] = now
+
+    def _evict(self):
+        if self.max_size is None or self._total_size <= self.max_size:
+            return
+
+        for checksum in sorted(self._entries, key=lambda key: self._entries[key][1]):
+            if self._total_size <= self.max_size:
+                break
+
+            self._remove(checksum)
+
+    def _remove(self, checksum):
+        entry = self._entries.pop(checksum, None)
+
+        if entry is None:
+            return
+
+        self._total_size -= entry[0]
+
+        try:
+            os.remove(self.get_path(checksum))
+        except OSError as error:
+            if error.errno != errno.ENOENT:  # Another process may have evicted it already
+                raise
+
+    def _load_entries(self):
+        if self._entries is not None:
+            return
+
+        self._entries = {}
+        self._total_size = 0
+
+        for prefix in os.listdir(self.directory):
+            prefix_directory = os.path.join(self.directory, prefix)
+
+            if prefix == TEMPORARY_DIRECTORY_NAME or not os.path.isdir(prefix_directory):
+                continue
+
+            for checksum in os.listdir(prefix_directory):
+                stat = os.stat(os.path.join(prefix_directory, checksum))
+                self._entries[checksum] = [stat.st_size, stat.st_mtime]
+                self._total_size += stat.st_size
+
+
+class ArtifactStoreWriter(object):
+    """
+    Download observer that copies the bytes into a temporary file of the store. Call commit() with the calculated md5
+    and file size once the download is done; the artifact is only kept when both match what was expected.
+    """
+    def __init__(self, artifact_store, checksum, file_size=None):
+        self.artifact_store = artifact_store
+        self.checksum = checksum
+        self.file_size = file_size
+        self.bytes_written = 0
+
+        file_descriptor, self.temporary_path = tempfile.mkstemp(
+            dir=os.path.join(artifact_store.directory, TEMPORARY_DIRECTORY_NAME)
+        )
+        self._file = os.fdopen(file_descriptor, "wb")
+
+    def update(self, data):
+        self._file.write(data)
+        self.bytes_written += len(data)
+
+    def finish(self):
+        self._file.close()
+
+    def get_cache_fields(self):
+        return {}
+
+    def load_cache_fields(self, cached):
+        return False  # Never asked, since the store is only written to after the checksum cache missed
+
+    def commit(self, md5, file_size):
+        self._file.close()
+
+        if md5 == self.checksum and file_size == self.bytes_written and \
+                (self.file_size is None or int(self.file_size) == file_size):
+            self.artifact_store._add(self.temporary_path, self.checksum, file_size)
+            return True
+
+        self.abort()
+
+        return False
+
+    def abort(self):
+        self._file.close()
+
+        try:
+            os.remove(self.temporary_path)
+        except OSError:
+            pass
+
+
+def _normalize_checksum(checksum):
+    checksum = str(checksum).lower()
+
+    if not checksum or os.sep in checksum or checksum.startswith("."):
+        raise ValueError("Invalid checksum \"" + checksum + '"')
+
+    return checksum
+
+
+def _make_directories(directory):
+    try:
+        os.makedirs(directory)
+    except OSError as error:
+        if error.errno != errno.EEXIST:
+            raise
@@ -0,0 +1,475 @@
+# This file is part of the daspos-umbrella package.
+#
+# For copyright and licensing information about this package, see the
+# NOTICE.txt and LICENSE.txt files in its top-level directory; they are
+# available at https://github.com/crcresearch/daspos-umbrella
+#
+# Licensed under the MIT License (MIT);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://opensource.org/licenses/MIT
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import hashlib
+import httplib
+import os
+import socket
+import threading
+import urllib
+import urllib2
+import urlparse
+from StringIO import StringIO
+
+from umbrella.misc import DEFAULT_RANGE_SIZE
+from umbrella.umbrella_errors import TransportError
+
+DEFAULT_RANGE_RETRIES = 2
+
+
+ETAG = "etag"
+LAST_MODIFIED = "last_modified"
+
+
+class SourceInfo(object):
+    # What stat() found out about a source. total_size is None when it is unknown. validators are the ETAG and
+    # LAST_MODIFIED values, when the transport knows them, that change whenever the source does
+    def __init__(self, total_size=None, accepts_ranges=False, validators=None):
+        self.total_size = total_size
+        self.accepts_ranges = accepts_ranges
+        self.validators = validators or {}
+
+
+class SourceStream(object):
+    """
+    File-like object returned by Transport.open() and open_range(). size is the number of bytes the stream will give,
+    total_size the size of the whole source (either is None when unknown). is_range is False when a range was asked
+    for but the whole source is sent instead. validators are those of the source, as in SourceInfo.
+    """
+    def __init__(self, data_source, size=None, total_size=None, is_range=False, validators=None):
+        self.data_source = data_source
+        self.size = size
+        self.total_size = total_size
+        self.is_range = is_range
+        self.validators = validators or {}
+
+    def read(self, size=-1):
+        return self.data_source.read(size)
+
+    def close(self):
+        self.data_source.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception_info):
+        self.close()
+
+
+class Transport(object):
+    """
+    Fetches the sources of one or more url schemes. Failures are raised as TransportError.
+
+    Subclasses implement stat(), open() and open_range(). A transport for another client library (or a site specific
+    service) only needs those three methods and register_transport().
+    """
+    def stat(self, url, timeout=None):
+        raise NotImplementedError()
+
+    def open(self, url, timeout=None):
+        raise NotImplementedError()
+
+    def open_range(self, url, offset, length, timeout=None):
+        raise NotImplementedError()
+
+    def read_range(self, url, offset, length, timeout=None):
+        # The bytes from offset to offset + length, fewer at the end of the source
+        with self.open_range(url, offset, length, timeout) as stream:
+            if not stream.is_range and offset:
+                raise TransportError("Byte ranges are not supported", url=url)
+
+            return _read_exactly(stream, length)
+
+
+class UrllibTransport(Transport):
+    # http, https and ftp through urllib2
+    def stat(self, url, timeout=None):
+        request = urllib2.Request(url)
+        request.get_method = lambda: "HEAD"
+
+        with self._open_request(request, timeout) as stream:
+            return SourceInfo(
+                stream.total_size, stream.data_source.headers.get("accept-ranges") == "bytes", stream.validators
+            )
+
+    def open(self, url, timeout=None):
+        return self._open_request(urllib2.Request(url), timeout)
+
+    def open_range(self, url, offset, length, timeout=None):
+        request = urllib2.Request(url, headers={"Range": "bytes=" + str(offset) + "-" + str(offset + length - 1)})
+        stream = self._open_request(request, timeout)
+
+        if not stream.is_range:  # Servers that ignore Range send everything. Only the first length bytes are read
+            size = min(length, stream.total_size) if stream.total_size is not None else length
+            stream = SourceStream(
+                _LimitedReader(stream.data_source, size), size, stream.total_size, validators=stream.validators
+            )
+
+        return stream
+
+    def _open_request(self, request, timeout=None):
+        try:
+            # Without a timeout, the socket module's default applies
+            remote = urllib2.urlopen(request, timeout=timeout) if timeout else urllib2.urlopen(request)
+        except urllib2.HTTPError as error:
+            raise TransportError(str(error), url=request.get_full_url(), is_http_error=True)
+        except (urllib2.URLError, socket.error, IOError) as error:
+            raise TransportError(str(error), url=request.get_full_url())
+
+        is_range = remote.getcode() == 206
+        total_size = get_total_size(remote.headers)
+
+        try:
+            size = int(remote.headers["content-length"])
+        except (KeyError, ValueError):
+            size = None
+
+        validators = {}
+
+        for header, key in [("etag", ETAG), ("last-modified", LAST_MODIFIED)]:
+            if remote.headers.get(header):
+                validators[key] = remote.headers[header]
+
+        return SourceStream(remote, size, total_size, is_range, validators)
+
+
+class FileTransport(Transport):
+    # file:// urls of the local file system
+    def stat(self, url, timeout=None):
+        try:
+            file_stat = os.stat(get_path(url))
+        except OSError as error:
+            raise TransportError(str(error), url=url)
+
+        return SourceInfo(file_stat.st_size, accepts_ranges=True, validators=_get_file_validators(file_stat))
+
+    def open(self, url, timeout=None):
+        return self.open_range(url, 0, None)
+
+    def open_range(self, url, offset, length, timeout=None):
+        try:
+            local_file = open(get_path(url), "rb")
+        except IOError as error:
+            raise TransportError(str(error), url=url)
+
+        file_stat = os.fstat(local_file.fileno())
+        total_size = file_stat.st_size
+        size = max(0, total_size - offset) if length is None else max(0, min(length, total_size - offset))
+        local_file.seek(offset)
+
+        return SourceStream(
+            _LimitedReader(local_file, size), size, total_size, length is not None, _get_file_validators(file_stat)
+        )
+
+
+class MemoryTransport(Transport):
+    """
+    Serves sources held in memory, for tests and for artifacts that were produced in the same process. Urls are
+    matched exactly, so any scheme it is registered for works (memory:// by default).
+    """
+    def __init__(self, sources=None):
+        self.sources = dict(sources or {})
+        self.request_count = 0
+        self._lock = threading.Lock()
+
+    def add(self, url, data):
+        self.sources[url] = data
+
+    def stat(self, url, timeout=None):
+        data = self._get_data(url)
+
+        return SourceInfo(len(data), accepts_ranges=True, validators=_get_memory_validators(data))
+
+    def open(self, url, timeout=None):
+        data = self._get_data(url)
+
+        return SourceStream(StringIO(data), len(data), len(data), validators=_get_memory_validators(data))
+
+    def open_range(self, url, offset, length, timeout=None):
+        data = self._get_data(url)
+        data_range = data[offset:offset + length]
+
+        return SourceStream(StringIO(data_range), len(data_range), len(data), True, _get_memory_validators(data))
+
+    def _get_data(self, url):
+        with self._lock:
+            self.request_count += 1
+
+        if url not in self.sources:
+            raise TransportError("No such source", url=url)
+
+        return self.sources[url]
+
+
+class TransportRegistry(object):
+    # Transports by url scheme. A ValidationContext may hold its own, otherwise DEFAULT_TRANSPORTS is used
+    def __init__(self, transports=None):
+        self._transports = dict(transports or {})
+
+    def register(self, scheme, transport):
+        self._transports[scheme.lower()] = transport
+
+    def unregister(self, scheme):
+        self._transports.pop(scheme.lower(), None)
+
+    def get_transport(self, url):
+        scheme = urlparse.urlparse(url).scheme.lower()
+
+        if scheme not in self._transports:
+            raise TransportError("No transport for the \"" + scheme + "\" scheme", url=url)
+
+        return self._transports[scheme]
+
+    @property
+    def schemes(self):
+        return sorted(self._transports)
+
+    def copy(self):
+        return TransportRegistry(self._transports)
+
+
+DEFAULT_TRANSPORTS = TransportRegistry({
+    "http": UrllibTransport(),
+    "https": UrllibTransport(),
+    "ftp": UrllibTransport(),
+    "file": FileTransport(),
+    "memory": MemoryTransport(),
+})
+
+
+class ParallelRangeReader(object):
+    """
+    Reads a source of a known size through several connections at once, each fetching the next range that nobody has
+    taken yet. Ranges may arrive in any order but read() gives the bytes in order, so the md5 can be fed as usual.
+
+    At most max_buffered_ranges ranges (twice the connections by default) are being fetched or waiting to be read,
+    which caps the memory at about max_buffered_ranges * range_size. A range that fails is tried again retries
+    times before read() raises TransportError. first_range is the data of the first range when it was already read.
+    """
+    def __init__(self, transport, url, total_size, connections=4, range_size=DEFAULT_RANGE_SIZE, timeout=None,
+                 retries=DEFAULT_RANGE_RETRIES, max_buffered_ranges=None, first_range=None):
+        self.transport = transport
+        self.url = url
+        self.total_size = total_size
+        self.range_size = range_size
+        self.timeout = timeout
+        self.retries = retries
+        self.range_count = (total_size + range_size - 1) // range_size
+        self.max_buffered_ranges = max_buffered_ranges or 2 * connections
+        self._ranges = {}  # Range number: data, for the fetched ranges that weren't read yet
+        self._next_range_to_read = 0
+        self._next_range_to_fetch = 0
+
+        if first_range is not None:
+            self._ranges[0] = first_range
+            self._next_range_to_fetch = 1
+        self._data = ""  # What is left of the range being read
+        self._error = None
+        self._is_closed = False
+        self._condition = threading.Condition()
+
+        for connection in range(min(connections, self.range_count - self._next_range_to_fetch)):
+            fetcher = threading.Thread(target=self._fetch_ranges, name="umbrella-range-" + str(connection))
+            fetcher.daemon = True
+            fetcher.start()
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            return "".join(iter(lambda: self.read(self.range_size), ""))
+
+        if not self._data:
+            if self._next_range_to_read >= self.range_count:
+                return ""
+
+            self._data = self._take_next_range()
+
+        data = self._data[:size]
+        self._data = self._data[size:]
+
+        return data
+
+    def close(self):
+        with self._condition:
+            self._is_closed = True
+            self._ranges.clear()
+            self._condition.notify_all()
+
+    def _take_next_range(self):
+        with self._condition:
+            while self._next_range_to_read not in self._ranges and self._error is None:
+                self._condition.wait()
+
+            if self._error is not None:
+                raise self._error
+
+            data = self._ranges.pop(self._next_range_to_read)
+            self._next_range_to_read += 1
+            self._condition.notify_all()  # There is room for another range
+
+        return data
+
+    def _fetch_ranges(self):
+        while True:
+            with self._condition:
+                while not self._is_closed and self._error is None and \
+                        self._next_range_to_fetch < self.range_count and \
+                        self._next_range_to_fetch >= self._next_range_to_read + self.max_buffered_ranges:
+                    self._condition.wait()
+
+                if self._is_closed or self._error is not None or self._next_range_to_fetch >= self.range_count:
+                    return
+
+                range_number = self._next_range_to_fetch
+                self._next_range_to_fetch += 1
+
+            try:
+                data = self._fetch_range(range_number)
+            except TransportError as error:
+                data = None
+            except Exception as error:  # Anything else would end the thread and leave read() waiting forever
+                data = None
+                error = TransportError(error, url=self.url)
+            else:
+                error = None
+
+            with self._condition:
+                if error is not None:
+                    self._error = error
+                elif not self._is_closed:
+                    self._ranges[range_number] = data
+
+                self._condition.notify_all()
+
+    def _fetch_range(self, range_number):
+        offset = range_number * self.range_size
+        length = min(self.range_size, self.total_size - offset)
+
+        for attempt in range(self.retries + 1):
+            try:
+                data = self.transport.read_range(self.url, offset, length, self.timeout)
+            except (TransportError, IOError, httplib.HTTPException) as error:  # IOError covers socket errors and timeouts
+                if attempt == self.retries:
+                    if not isinstance(error, TransportError):
+                        raise TransportError(error, url=self.url)
+                    raise
+                continue
+
+            if len(data) == length:
+                return data
+
+        raise TransportError(
+            "Range at " + str(offset) + " had " + str(len(data)) + " bytes instead of " + str(length), url=self.url
+        )
+
+
+def open_source(transport, url, timeout=None, connections=1, range_size=DEFAULT_RANGE_SIZE):
+    """
+    Opens a source for a streaming read, through a ParallelRangeReader when more than one connection is asked for
+    and stat() says the source accepts ranges and is bigger than a range. Otherwise a single stream is used, as it is
+    when the server answers the first range with the whole source (some advertise ranges but ignore them).
+
+    :return: SourceStream
+    """
+    if connections > 1:
+        try:
+            source_info = transport.stat(url, timeout)
+        except TransportError:  # Such as a server that doesn't allow HEAD requests
+            source_info = SourceInfo()
+
+        if source_info.accepts_ranges and source_info.total_size is not None and source_info.total_size > range_size:
+            with transport.open_range(url, 0, range_size, timeout) as first_stream:
+                first_range = _read_exactly(first_stream, range_size) if first_stream.is_range else None
+
+            if first_range is not None:
+                reader = ParallelRangeReader(
+                    transport, url, source_info.total_size, connections, range_size, timeout, first_range=first_range
+                )
+
+                return SourceStream(
+                    reader, source_info.total_size, source_info.total_size, validators=source_info.validators
+                )
+
+    return transport.open(url, timeout)
+
+
+def register_transport(scheme, transport):
+    DEFAULT_TRANSPORTS.register(scheme, transport)
+
+
+def get_transport(url, transports=None):
+    return (transports or DEFAULT_TRANSPORTS).get_transport(url)
+
+
+def get_path(url):
+    return urllib.url2pathname(urlparse.urlparse(url).path)
+
+
+def get_total_size(headers):
+    content_range = headers.get("content-range")
+
+    if content_range and "/" in content_range:  # bytes 0-65535/1234567
+        total_size = content_range.rsplit("/", 1)[1].strip()
+
+        return int(total_size) if total_size.isdigit() else None
+
+    try:
+        return int(headers["content-length"])
+    except (KeyError, ValueError):
+        return None
+
+
+def _get_file_validators(file_stat):
+    return {LAST_MODIFIED: repr(file_stat.st_mtime)}
+
+
+def _get_memory_validators(data):
+    # Like the ETag of object stores, the md5 of the content
+    return {ETAG: hashlib.md5(data).hexdigest()}
+
+
+class _LimitedReader(object):
+    # Reads at most size bytes of a file
+    def __init__(self, the_file, size):
+        self.the_file = the_file
+        self.remaining_size = size
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.remaining_size:
+            size = self.remaining_size
+
+        data = self.the_file.read(size)
+        self.remaining_size -= len(data)
+
+        return data
+
+    def close(self):
+        self.the_file.close()
+
+
+def _read_exactly(stream, length):
+    chunks = []
+
+    while length > 0:
+        data = stream.read(length)
+
+        if not data:
+            break
+
+        chunks.append(data)
+        length -= len(data)
+
+    return "".join(chunks)
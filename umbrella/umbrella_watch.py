@@ -0,0 +1,206 @@
+# This file is part of the daspos-umbrella package.
+#
+# For copyright and licensing information about this package, see the
+# NOTICE.txt and LICENSE.txt files in its top-level directory; they are
+# available at https://github.com/crcresearch/daspos-umbrella
+#
+# Licensed under the MIT License (MIT);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://opensource.org/licenses/MIT
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import argparse
+import json
+import os
+import sys
+import time
+
+try:
+    import pyinotify
+except ImportError:  # Changes are then found by polling the modification times only
+    pyinotify = None
+
+from umbrella.umbrella_cache import ChecksumCache
+from umbrella.umbrella_components import SPECIFICATION_ROOT_COMPONENT_NAMES
+from umbrella.umbrella_context import get_context
+from umbrella.umbrella_errors import JsonError
+from umbrella.umbrella_index import find_specifications, DEFAULT_SPECIFICATION_PATTERN
+from umbrella.umbrella_planner import VerificationPlanner
+from umbrella.umbrella_specification import UmbrellaSpecification
+
+DEFAULT_POLL_INTERVAL = 1.0
+
+# Event keys and events
+EVENT_KEY = "event"
+RESULT_EVENT = "result"
+REMOVED_EVENT = "removed"
+FAILED_EVENT = "failed"
+
+
+class SpecificationWatcher(object):
+    """
+    Validates every specification of a directory tree, then again each time one changes. Only the root components
+    whose json changed are validated again, the results of the others are reused. Downloads go through the context's
+    checksum cache (a new one when it has none), so an artifact that was verified once isn't downloaded again.
+
+    check() looks for changes once, by comparing the modification times and sizes with the ones seen before, and
+    returns the events. watch() keeps checking and yields the events as they come. With pyinotify installed it wakes
+    up as soon as a file changes, otherwise every poll_interval seconds.
+
+    Events are dictionaries: {"event": "result", "path", "is_valid", "errors", "validated_components"},
+    {"event": "failed", "path", "description"} for files that aren't valid json and {"event": "removed", "path"}.
+    """
+    def __init__(self, directory, pattern=DEFAULT_SPECIFICATION_PATTERN, context=None,
+                 poll_interval=DEFAULT_POLL_INTERVAL):
+        self.directory = os.path.abspath(directory)
+        self.pattern = pattern
+        self.poll_interval = poll_interval
+        self.context = get_context(context)
+
+        if self.context.checksum_cache is None:
+            self.context = self.context.copy(checksum_cache=ChecksumCache())
+
+        self._file_states = {}  # Path: (modification time, size)
+        self._component_results = {}  # Path: {component name: (component json, is_valid, errors)}
+
+    def check(self):
+        events = []
+        found_paths = set()
+
+        for path in find_specifications(self.directory, self.pattern):
+            found_paths.add(path)
+
+            try:
+                stat = os.stat(path)
+            except OSError:  # Removed while walking
+                continue
+
+            # Specifications with temporary errors (timeouts, server errors, ...) are validated again even unchanged
+            if self._file_states.get(path) == (stat.st_mtime, stat.st_size) and not self._has_temporary_errors(path):
+                continue
+
+            self._file_states[path] = (stat.st_mtime, stat.st_size)
+            events.append(self.validate(path))
+
+        for path in sorted(set(self._file_states) - found_paths):
+            del self._file_states[path]
+            self._component_results.pop(path, None)
+            events.append({EVENT_KEY: REMOVED_EVENT, "path": path})
+
+        return events
+
+    def validate(self, path):
+        try:
+            with open(path) as specification_file:
+                specification = UmbrellaSpecification(specification_file, self.context)
+        except (IOError, JsonError) as error:
+            self._component_results.pop(path, None)
+
+            return {EVENT_KEY: FAILED_EVENT, "path": path, "description": str(error)}
+
+        if not isinstance(specification.specification_json, dict):
+            self._component_results.pop(path, None)
+
+            return {EVENT_KEY: FAILED_EVENT, "path": path, "description": "Specification must be a json object"}
+
+        previous_results = self._component_results.get(path, {})
+        results = {}
+        planner = VerificationPlanner(self.context.schedule, self.context.download_workers)
+        context = self.context.copy(planner=planner)
+        error_logs = {}
+
+        for component_name in SPECIFICATION_ROOT_COMPONENT_NAMES:
+            component_json = specification.specification_json.get(component_name)
+            previous_result = previous_results.get(component_name)
+
+            if previous_result is not None and previous_result[0] == component_json and \
+                    not _has_temporary_errors(previous_result):
+                results[component_name] = previous_result
+                continue
+
+            error_logs[component_name] = []
+            is_valid = specification.validate_component(component_name, error_logs[component_name], context)
+            results[component_name] = (component_json, is_valid, error_logs[component_name])
+
+        if context.verify_downloads:
+            planner.run()
+
+        for component_name, error_log in error_logs.iteritems():
+            component_json, is_valid, errors = results[component_name]
+            results[component_name] = (component_json, is_valid and planner.is_valid(error_log), errors)
+
+        self._component_results[path] = results
+        errors = [error for component_name in SPECIFICATION_ROOT_COMPONENT_NAMES for error in results[component_name][2]]
+
+        return {
+            EVENT_KEY: RESULT_EVENT,
+            "path": path,
+            "is_valid": all(result[1] for result in results.itervalues()),
+            "errors": [error.json for error in errors],
+            "validated_components": sorted(error_logs),
+        }
+
+    def _has_temporary_errors(self, path):
+        return any(_has_temporary_errors(result) for result in self._component_results.get(path, {}).itervalues())
+
+    def watch(self):
+        notifier = self._get_notifier()
+
+        try:
+            while True:
+                for event in self.check():
+                    yield event
+
+                if notifier is None:
+                    time.sleep(self.poll_interval)
+                elif notifier.check_events(int(self.poll_interval * 1000)):
+                    notifier.read_events()
+                    notifier.process_events()
+        finally:
+            if notifier is not None:
+                notifier.stop()
+
+    def _get_notifier(self):
+        if pyinotify is None:
+            return None
+
+        watch_manager = pyinotify.WatchManager()
+        mask = pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MOVED_TO | pyinotify.IN_MOVED_FROM | pyinotify.IN_DELETE | \
+            pyinotify.IN_CREATE
+        watch_manager.add_watch(self.directory, mask, rec=True, auto_add=True)
+
+        # Events only wake the loop up, check() finds out what changed
+        return pyinotify.Notifier(watch_manager, lambda event: None)
+
+
+def _has_temporary_errors(component_result):
+    return any(error.may_be_temporary for error in component_result[2])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Validate the umbrella specifications of a directory as they change")
+    parser.add_argument("directory")
+    parser.add_argument("--pattern", default=DEFAULT_SPECIFICATION_PATTERN)
+    parser.add_argument("--interval", type=float, default=DEFAULT_POLL_INTERVAL, help="Seconds between checks")
+    parser.add_argument("--no-downloads", action="store_true", help="Only check the structure of the specifications")
+    arguments = parser.parse_args()
+
+    watcher = SpecificationWatcher(arguments.directory, arguments.pattern, poll_interval=arguments.interval)
+    watcher.context.verify_downloads = not arguments.no_downloads
+
+    try:
+        for event in watcher.watch():
+            sys.stdout.write(json.dumps(event) + "\n")
+            sys.stdout.flush()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
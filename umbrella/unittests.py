@@ -16,8 +16,59 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import bz2
+import gzip
+import hashlib
+import json
+import os
+import random
+import shutil
+import socket
+import tarfile
+import tempfile
+import threading
+import time
 import unittest
-from umbrella.misc import get_callback_function
+import urllib
+from StringIO import StringIO
+
+from umbrella import benchmarks
+from umbrella.misc import get_callback_function, get_md5_and_file_size, parse_byte_size
+from umbrella.umbrella_cache import ChecksumCache
+from umbrella.umbrella_components import Component, FileInfo, PackageManagerComponent, MissingComponent, DATA_FILES, \
+    SOFTWARE, PACKAGE_MANAGER, SPECIFICATION_ROOT_COMPONENT_NAMES, COMPONENT_CLASSES, register_component
+from umbrella.umbrella_context import ValidationContext
+from umbrella.umbrella_daemon import ValidationDaemon, get_unix_socket_server, request_validation
+from umbrella.umbrella_distributed import WorkQueue, Coordinator, Worker
+from umbrella.umbrella_errors import WRONG_MD5_ERROR_CODE, CORRUPT_ARCHIVE_ERROR_CODE, \
+    WRONG_UNCOMPRESSED_FILE_SIZE_ERROR_CODE, MIRROR_MISMATCH_ERROR_CODE, BAD_URL_ERROR_CODE, ValidationCancelledError, \
+    SANDBOX_FILE_MISSING_ERROR_CODE, SANDBOX_ESCAPE_ERROR_CODE, WORK_ITEM_FAILED_ERROR_CODE, \
+    BAD_PACKAGE_LIST_ERROR_CODE, CONFLICTING_PACKAGES_ERROR_CODE, MISSING_PACKAGE_ERROR_CODE, BAD_RECEIPT_ERROR_CODE, \
+    STALE_RECEIPT_ERROR_CODE, REQUIRED_ATTRIBUTE_MISSING_ERROR_CODE, WRONG_ATTRIBUTE_TYPE_ERROR_CODE, \
+    REQUIRED_SECTION_MISSING_ERROR_CODE, WRONG_SECTION_TYPE_ERROR_CODE, TransportError
+from umbrella.umbrella_generator import generate_specification
+from umbrella.umbrella_manifest import ManifestStore, TarManifestReader, BLOCK_SIZE
+from umbrella.umbrella_mirrors import MirrorScoreboard
+from umbrella.umbrella_index import SpecificationIndex
+from umbrella.umbrella_model import FileEntry
+from umbrella.umbrella_planner import VerificationPlanner, LARGEST_FIRST, SHORTEST_FIRST
+from umbrella.umbrella_packages import PackageRequirement, parse_package_list, get_conflicts, compare_versions
+from umbrella.umbrella_profiling import ValidationProfiler, COLLAPSED_STACKS_FILE_NAME, ALL_STATS_FILE_NAME
+from umbrella.umbrella_receipts import VerificationReceipt, SAMPLED_LEVEL, CHECKSUM_LEVEL, ARCHIVE_LEVEL
+from umbrella.umbrella_repositories import RepositoryIndex
+from umbrella.umbrella_sampling import RotationSampler
+from umbrella.umbrella_schema import get_compiled_schema, SCHEMA_PATH
+from umbrella.umbrella_specification import UmbrellaSpecification, validate_specifications
+from umbrella import umbrella_specification_cache
+from umbrella.umbrella_specification_cache import SpecificationCache, CACHE_MAGIC
+from umbrella.umbrella_store import ArtifactStore
+from umbrella.umbrella_watch import SpecificationWatcher
+from umbrella.umbrella_transports import TransportRegistry, MemoryTransport, FileTransport, SourceInfo, \
+    ParallelRangeReader
+
+base_dir = os.path.dirname(os.path.abspath(__file__))
+
+VALID_FILE = os.path.join(base_dir, "openmalaria.umbrella")
 
 
 def callback_validation_filename(filename, percentage, validation_job):
@@ -42,5 +93,1383 @@ class TestGetCallbackFunction(unittest.TestCase):
         self.assertEqual(get_callback_function(callback_validation_filename, "123")("file", 0.0), "file")
         self.assertEqual(get_callback_function(callback_validation_percentage, "123")("file", 0.0), 0.0)
 
+
+def get_file_info_json(path, content, **changes):
+    file_info_json = {
+        "id": hashlib.md5(content).hexdigest(),
+        "source": ["file://" + urllib.pathname2url(path)],
+        "format": "plain",
+        "checksum": hashlib.md5(content).hexdigest(),
+        "size": str(len(content)),
+        "mountpoint": "/tmp/" + os.path.basename(path),
+    }
+    file_info_json.update(changes)
+
+    return file_info_json
+
+
+class ArtifactTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_artifact(self, name, content):
+        path = os.path.join(self.directory, name)
+
+        with open(path, "wb") as artifact:
+            artifact.write(content)
+
+        return path
+
+
+class TestChecksumCache(ArtifactTestCase):
+    def test_cached_download_is_not_repeated(self):
+        path = self.write_artifact("data.txt", "some data")
+        context = ValidationContext(checksum_cache=ChecksumCache())
+        file_info = FileInfo("data.txt", DATA_FILES, get_file_info_json(path, "some data"), context)
+
+        error_log = []
+        self.assertTrue(file_info.validate(error_log))
+        self.assertEqual(len(context.checksum_cache), 1)
+
+        # Change the file behind the cache's back. The cached result is used, so nothing is downloaded
+        self.write_artifact("data.txt", "other data")
+        self.assertTrue(file_info.validate(error_log))
+
+        context.checksum_cache.clear()
+        self.assertFalse(file_info.validate(error_log))
+        self.assertEqual(error_log[-1].error_code, WRONG_MD5_ERROR_CODE)
+
+    def test_expired_entries_are_dropped(self):
+        checksum_cache = ChecksumCache(max_age=-1)
+        checksum_cache.set("http://example.com/file", "abc", 3)
+
+        self.assertIsNone(checksum_cache.get("http://example.com/file"))
+
+
+class TestValidationDaemon(ArtifactTestCase):
+    def test_structural_request(self):
+        messages = []
+        ValidationDaemon().handle_request({"path": VALID_FILE, "verify_downloads": False}, messages.append)
+
+        self.assertEqual(messages[0]["event"], "accepted")
+        self.assertEqual(messages[-1], {"event": "result", "is_valid": True, "error_count": 0})
+
+    def test_bad_request(self):
+        messages = []
+        ValidationDaemon().handle_request({}, messages.append)
+
+        self.assertEqual(len(messages), 1)
+        self.assertEqual(messages[0]["event"], "failed")
+
+    def test_validation_exception(self):
+        path = self.write_artifact("data.txt", "some data")
+        specification = {"data": {"data.txt": get_file_info_json(path, "some data")}}
+        messages = []
+
+        self.assertFalse(_BrokenValidationDaemon().handle_request({"specification": specification}, messages.append))
+        self.assertEqual(messages[-1]["event"], "failed")
+        self.assertIn("listener broke", messages[-1]["description"])
+
+    def test_unix_socket(self):
+        path = self.write_artifact("data.txt", "some data")
+        specification = {"data": {"data.txt": get_file_info_json(path, "some data")}}
+        socket_path = os.path.join(self.directory, "daemon.sock")
+        server = get_unix_socket_server(socket_path)
+        server_thread = threading.Thread(target=server.serve_forever)
+        server_thread.daemon = True
+        server_thread.start()
+
+        try:
+            messages = list(request_validation(socket_path, {"specification": specification}))
+            events = [message["event"] for message in messages]
+            self.assertIn("download_finished", events)
+
+            messages = list(request_validation(socket_path, {"specification": specification}))
+            events = [message["event"] for message in messages]
+            self.assertIn("download_cached", events)
+            self.assertEqual(events[-1], "result")
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+class _BrokenValidationDaemon(ValidationDaemon):
+    # validate() raises as soon as a download starts
+    def _get_context(self, request, send_message):
+        context = super(_BrokenValidationDaemon, self)._get_context(request, send_message)
+        context.add_listener(_raise_on_download)
+
+        return context
+
+
+def _raise_on_download(event, **fields):
+    if event == "download_started":
+        raise RuntimeError("listener broke")
+
+
+def gzip_compress(content):
+    compressed = StringIO()
+    gzip_file = gzip.GzipFile(fileobj=compressed, mode="wb")
+    gzip_file.write(content)
+    gzip_file.close()
+
+    return compressed.getvalue()
+
+
+class TestDecompressionCheck(ArtifactTestCase):
+    content = "umbrella " * 10000
+
+    def validate_archive(self, compressed, file_format, uncompressed_size):
+        path = self.write_artifact("archive", compressed)
+        file_info_json = get_file_info_json(path, compressed, format=file_format, uncompressed_size=uncompressed_size)
+        file_info = FileInfo("archive", DATA_FILES, file_info_json, ValidationContext(check_decompression=True))
+
+        error_log = []
+        file_info.validate(error_log)
+
+        return [error.error_code for error in error_log]
+
+    def test_valid_archives(self):
+        size = str(len(self.content))
+
+        self.assertEqual(self.validate_archive(gzip_compress(self.content), "tgz", size), [])
+        self.assertEqual(self.validate_archive(bz2.compress(self.content), "bz2", size), [])
+
+    def test_concatenated_streams(self):
+        compressed = gzip_compress(self.content) + gzip_compress(self.content)
+
+        self.assertEqual(self.validate_archive(compressed, "tgz", str(2 * len(self.content))), [])
+
+    def test_wrong_uncompressed_size(self):
+        error_codes = self.validate_archive(gzip_compress(self.content), "tgz", "1")
+
+        self.assertEqual(error_codes, [WRONG_UNCOMPRESSED_FILE_SIZE_ERROR_CODE])
+
+    def test_truncated_archives(self):
+        size = str(len(self.content))
+
+        self.assertEqual(self.validate_archive(gzip_compress(self.content)[:-4], "tgz", size), [CORRUPT_ARCHIVE_ERROR_CODE])
+        self.assertEqual(self.validate_archive(bz2.compress(self.content)[:-4], "bz2", size), [CORRUPT_ARCHIVE_ERROR_CODE])
+
+    def test_corrupt_archive(self):
+        compressed = gzip_compress(self.content)
+        compressed = compressed[:100] + "garbage" + compressed[107:]
+
+        self.assertEqual(self.validate_archive(compressed, "tgz", None), [CORRUPT_ARCHIVE_ERROR_CODE])
+
+
+class TestArtifactStore(ArtifactTestCase):
+    def test_verified_download_is_stored_and_reused(self):
+        path = self.write_artifact("data.txt", "some data")
+        artifact_store = ArtifactStore(os.path.join(self.directory, "store"))
+        file_info_json = get_file_info_json(path, "some data")
+        file_info = FileInfo("data.txt", DATA_FILES, file_info_json, ValidationContext(artifact_store=artifact_store))
+
+        self.assertTrue(file_info.validate([]))
+        self.assertTrue(artifact_store.contains(file_info_json["checksum"]))
+
+        # The source is gone but the store still answers
+        os.remove(path)
+        self.assertTrue(file_info.validate([]))
+        self.assertTrue(artifact_store.get_url(file_info_json["checksum"]).startswith("file://"))
+
+    def test_wrong_download_is_not_stored(self):
+        path = self.write_artifact("data.txt", "some data")
+        artifact_store = ArtifactStore(os.path.join(self.directory, "store"))
+        file_info_json = get_file_info_json(path, "other data")
+        file_info = FileInfo("data.txt", DATA_FILES, file_info_json, ValidationContext(artifact_store=artifact_store))
+
+        self.assertFalse(file_info.validate([]))
+        self.assertFalse(artifact_store.contains(file_info_json["checksum"]))
+        self.assertEqual(os.listdir(os.path.join(artifact_store.directory, "tmp")), [])
+
+    def test_with_checksum_cache(self):
+        # The daemon's setup with --store
+        path = self.write_artifact("data.txt", "some data")
+        context = ValidationContext(
+            checksum_cache=ChecksumCache(), artifact_store=ArtifactStore(os.path.join(self.directory, "store"))
+        )
+        file_info_json = get_file_info_json(path, "some data")
+        file_info = FileInfo("data.txt", DATA_FILES, file_info_json, context)
+
+        self.assertTrue(file_info.validate([]))
+        self.assertTrue(context.artifact_store.contains(file_info_json["checksum"]))
+        self.assertEqual(len(context.checksum_cache), 1)
+
+    def test_least_recently_used_are_evicted(self):
+        artifact_store = ArtifactStore(os.path.join(self.directory, "store"), max_size=20)
+
+        for content in ["first artifact", "second artifact"]:
+            checksum = hashlib.md5(content).hexdigest()
+            writer = artifact_store.get_writer(checksum)
+            writer.update(content)
+            self.assertTrue(writer.commit(checksum, len(content)))
+
+        self.assertFalse(artifact_store.contains(hashlib.md5("first artifact").hexdigest()))
+        self.assertTrue(artifact_store.contains(hashlib.md5("second artifact").hexdigest()))
+
+
+class TestVerificationPlanner(ArtifactTestCase):
+    def setUp(self):
+        super(TestVerificationPlanner, self).setUp()
+
+        self.downloads = []
+        self.context = ValidationContext(listeners=[self.record_download])
+
+    def record_download(self, event, **fields):
+        if event == "download_started":
+            self.downloads.append(fields["url"])
+
+    def get_specification_json(self, file_info_json):
+        return {"software": {"tool": file_info_json}, "data": {"tool-copy": file_info_json}}
+
+    def test_shared_source_is_downloaded_once(self):
+        path = self.write_artifact("tool", "tool bytes")
+        file_info_json = get_file_info_json(path, "other bytes")
+        specification = UmbrellaSpecification(self.get_specification_json(file_info_json), self.context)
+
+        self.assertFalse(specification.validate())
+        self.assertEqual(len(self.downloads), 1)
+
+        wrong_md5_errors = [error for error in specification.error_log if error.error_code == WRONG_MD5_ERROR_CODE]
+        self.assertEqual(
+            sorted((error.component_name, error.file_name) for error in wrong_md5_errors),
+            [(DATA_FILES, "tool-copy"), (SOFTWARE, "tool")]
+        )
+
+    def test_shared_source_across_specifications(self):
+        path = self.write_artifact("tool", "tool bytes")
+        file_info_json = get_file_info_json(path, "tool bytes")
+        specifications = [UmbrellaSpecification(self.get_specification_json(file_info_json)) for i in range(3)]
+
+        # Required sections are missing, so the specifications are invalid, but not because of their downloads
+        self.assertEqual(validate_specifications(specifications, self.context), [False, False, False])
+        self.assertEqual(len(self.downloads), 1)
+        self.assertNotIn(WRONG_MD5_ERROR_CODE, [error.error_code for error in specifications[0].error_log])
+
+
+class TestMirrors(ArtifactTestCase):
+    def test_mirrors_are_probed(self):
+        content = "mirrored " * 1000
+        good_path = self.write_artifact("good", content)
+        bad_path = self.write_artifact("bad", "corrupted " * 1000)
+        file_info_json = get_file_info_json(good_path, content)
+        file_info_json["source"] += [
+            "file://" + urllib.pathname2url(bad_path),
+            "file://" + urllib.pathname2url(os.path.join(self.directory, "missing")),
+        ]
+
+        scoreboard = MirrorScoreboard(os.path.join(self.directory, "scoreboard.json"))
+        file_info = FileInfo("mirrored", DATA_FILES, file_info_json, ValidationContext(mirror_scoreboard=scoreboard))
+
+        error_log = []
+        self.assertFalse(file_info.validate(error_log))
+        error_codes = [error.error_code for error in error_log]
+        self.assertIn(BAD_URL_ERROR_CODE, error_codes)
+        self.assertIn(MIRROR_MISMATCH_ERROR_CODE, error_codes)
+
+    def test_scoreboard_is_persistent(self):
+        path = os.path.join(self.directory, "scoreboard.json")
+        scoreboard = MirrorScoreboard(path)
+        scoreboard.record_success("http://fast.example.com/file", 0.1, 1000000, 1.0)
+        scoreboard.record_success("http://slow.example.com/file", 0.1, 1000, 1.0)
+        scoreboard.record_failure("http://broken.example.com/file")
+        scoreboard.save()
+
+        scoreboard = MirrorScoreboard(path)
+        urls = ["http://broken.example.com/a", "http://slow.example.com/a", "http://fast.example.com/a"]
+        self.assertEqual(scoreboard.order(urls), list(reversed(urls)))
+        self.assertLess(
+            scoreboard.get_timeout("http://broken.example.com/a"), scoreboard.get_timeout("http://fast.example.com/a")
+        )
+
+    def test_probe_throughput_is_separate(self):
+        scoreboard = MirrorScoreboard()
+        url = "http://mirror.example.com/file"
+        scoreboard.record_success(url, 0.1, 1000, 1.0, is_probe=True)
+        self.assertEqual(scoreboard.get_throughput(url), 1000)  # Nothing else is known yet
+
+        scoreboard.record_success(url, None, 1000000, 1.0)
+        scoreboard.record_success(url, 0.1, 1000, 1.0, is_probe=True)
+        self.assertEqual(scoreboard.get_throughput(url), 1000000)
+
+
+class TestErrorBudget(ArtifactTestCase):
+    def setUp(self):
+        super(TestErrorBudget, self).setUp()
+
+        path = self.write_artifact("data.txt", "some data")
+        file_info_json = get_file_info_json(path, "other data")
+        self.specification_json = {"data": {"a.txt": file_info_json, "b.txt": file_info_json}, "cmd": 5}
+
+    def test_stop_on_first_error(self):
+        specification = UmbrellaSpecification(self.specification_json)
+
+        self.assertFalse(specification.validate(stop_on_first_error=True))
+        self.assertEqual(len(specification.error_log), 1)
+
+    def test_max_errors(self):
+        specification = UmbrellaSpecification(self.specification_json)
+
+        self.assertFalse(specification.validate(max_errors=4))
+        self.assertEqual(len(specification.error_log), 5)
+
+        # Without a budget every error is found
+        self.assertFalse(specification.validate())
+        self.assertEqual(len(specification.error_log), 9)
+
+    def test_running_download_is_cancelled(self):
+        cancel_event = threading.Event()
+        cancel_event.set()
+
+        with self.assertRaises(ValidationCancelledError):
+            get_md5_and_file_size(StringIO("some data"), cancel_event=cancel_event)
+
+
+class TestSchedule(ArtifactTestCase):
+    def get_planner(self, schedule, workers=1):
+        planner = VerificationPlanner(schedule, workers)
+        context = ValidationContext(planner=planner)
+        self.error_log = []
+
+        for size in [10, 1000, 100]:
+            content = "x" * size
+            path = self.write_artifact(str(size), content)
+            FileInfo(str(size), DATA_FILES, get_file_info_json(path, content), context).validate(self.error_log)
+
+        return planner
+
+    def get_sizes(self, planner):
+        return [work_item.file_size for work_item in planner.get_scheduled_work_items()]
+
+    def test_schedules(self):
+        self.assertEqual(self.get_sizes(self.get_planner(None)), [10, 1000, 100])
+        self.assertEqual(self.get_sizes(self.get_planner(LARGEST_FIRST)), [1000, 100, 10])
+        self.assertEqual(self.get_sizes(self.get_planner(SHORTEST_FIRST)), [10, 100, 1000])
+
+        with self.assertRaises(ValueError):
+            VerificationPlanner("random")
+
+    def test_worker_pool(self):
+        planner = self.get_planner(LARGEST_FIRST, workers=3)
+
+        self.assertTrue(planner.run())
+        self.assertEqual(self.error_log, [])
+        self.assertEqual(planner.work_items, [])
+
+
+class TestPlan(unittest.TestCase):
+    def test_parse_byte_size(self):
+        self.assertEqual(parse_byte_size("957"), 957)
+        self.assertEqual(parse_byte_size("2GB"), 2 * 1024 ** 3)
+        self.assertEqual(parse_byte_size("1.5 mb"), 1572864)
+
+        with self.assertRaises(ValueError):
+            parse_byte_size("lots")
+
+    def test_plan(self):
+        with open(VALID_FILE) as specification_file:
+            specification = UmbrellaSpecification(specification_file)
+
+        plan = specification.plan()
+
+        self.assertEqual(plan.structural_error_count, 0)
+        self.assertEqual(plan.host_count, 2)
+        self.assertEqual(plan.disk_space, 3 * 1024 ** 3)
+        self.assertEqual(plan.memory, 2 * 1024 ** 3)
+        self.assertTrue(plan.fits_disk_space)
+        self.assertEqual(plan.total_bytes, plan.unknown_throughput_bytes)
+        self.assertEqual(specification.error_log, [])
+
+
+class TestSpecificationModel(unittest.TestCase):
+    def test_model(self):
+        with open(VALID_FILE) as specification_file:
+            model = UmbrellaSpecification(specification_file).get_model()
+
+        self.assertEqual(model.hardware.cores, 1)
+        self.assertEqual(model.hardware.disk_space, 3 * 1024 ** 3)
+        self.assertEqual(model.os.file_entry.size, 72213624)
+        self.assertEqual(model.os.file_entry.uncompressed_size, 212684800)
+        self.assertEqual(len(model.get_file_entries(DATA_FILES)), 3)
+        self.assertIn("zlib-devel", model.package_manager.package_names)
+        self.assertEqual(model.total_size, sum(entry.size for entry in model.file_entries))
+
+    def test_model_objects_are_compact_and_immutable(self):
+        file_entry = FileEntry(file_name="a", size=1)
+
+        self.assertFalse(hasattr(file_entry, "__dict__"))
+        self.assertIsNone(file_entry.checksum)
+
+        with self.assertRaises(AttributeError):
+            file_entry.size = 2
+
+    def test_broken_sections_are_none(self):
+        model = UmbrellaSpecification({"hardware": "big", "data": {"file": {"size": "many"}}}).get_model()
+
+        self.assertIsNone(model.hardware)
+        self.assertIsNone(model.kernel)
+        self.assertIsNone(model.file_entries[0].size)
+
+
+class TestSpecificationIndex(ArtifactTestCase):
+    def setUp(self):
+        super(TestSpecificationIndex, self).setUp()
+
+        with open(VALID_FILE) as specification_file:
+            self.specification_text = specification_file.read()
+
+        self.specifications_directory = os.path.join(self.directory, "specifications")
+        os.makedirs(os.path.join(self.specifications_directory, "nested"))
+        self.write_artifact("specifications/openmalaria.umbrella", self.specification_text)
+        self.write_artifact("specifications/nested/big.umbrella", self.specification_text.replace('"1"', '"16"'))
+        self.write_artifact("specifications/broken.umbrella", "{ not json")
+
+        self.index = SpecificationIndex(os.path.join(self.directory, "index.sqlite"))
+        self.index.update(self.specifications_directory)
+
+    def tearDown(self):
+        self.index.close()
+
+        super(TestSpecificationIndex, self).tearDown()
+
+    def test_queries(self):
+        big_path = os.path.join(self.specifications_directory, "nested", "big.umbrella")
+
+        self.assertEqual(len(self.index), 3)
+        self.assertEqual(self.index.find(min_cores=16, architecture="x86_64"), [big_path])
+        self.assertEqual(len(self.index.find(os_name="CentOS", os_version="6.6")), 2)
+        self.assertEqual(len(self.index.find_by_checksum("54EA34D38D96C311122642AEC045BC40")), 2)
+        self.assertEqual(len(self.index.find_by_host("curate.nd.edu")), 2)
+        self.assertEqual(self.index.get_unparsable(), [os.path.join(self.specifications_directory, "broken.umbrella")])
+
+        self.index.record_validation(big_path, False, 3)
+        self.assertEqual(self.index.find(is_valid=0), [big_path])
+
+        with self.assertRaises(ValueError):
+            self.index.find(path="x")
+
+    def test_incremental_update(self):
+        self.assertEqual(self.index.update(self.specifications_directory), (0, 0))
+
+        os.remove(os.path.join(self.specifications_directory, "broken.umbrella"))
+        self.write_artifact("specifications/fixed.umbrella", self.specification_text)
+
+        self.assertEqual(self.index.update(self.specifications_directory), (1, 1))
+        self.assertEqual(self.index.get_unparsable(), [])
+
+    def test_vanished_specification(self):
+        broken_path = os.path.join(self.specifications_directory, "broken.umbrella")
+        os.remove(broken_path)
+        os.symlink(os.path.join(self.directory, "missing"), broken_path)  # Listed, but can't be read
+
+        self.assertEqual(self.index.update(self.specifications_directory), (0, 1))
+        self.assertEqual(len(self.index), 2)
+
+    def test_specification_that_is_not_an_object(self):
+        self.write_artifact("specifications/list.umbrella", "[1, 2]")
+        self.write_artifact("specifications/valid.umbrella", self.specification_text)
+
+        self.assertEqual(self.index.update(self.specifications_directory), (2, 0))
+        self.assertIn(os.path.join(self.specifications_directory, "list.umbrella"), self.index.get_unparsable())
+        self.assertEqual(len(self.index.find(os_name="CentOS", os_version="6.6")), 3)
+
+
+class TestRotationSampler(ArtifactTestCase):
+    def setUp(self):
+        super(TestRotationSampler, self).setUp()
+
+        self.downloads = []
+        self.specification_json = {}
+
+        for number in range(10):
+            content = "entry " * (number + 1)
+            path = self.write_artifact(str(number), content)
+            self.specification_json[str(number)] = get_file_info_json(path, content)
+
+    def record_download(self, event, **fields):
+        if event == "download_started":
+            self.downloads.append(fields["url"])
+
+    def run_validation(self, sampler):
+        context = ValidationContext(listeners=[self.record_download], sampler=sampler)
+        specification = UmbrellaSpecification({"data": self.specification_json}, context)
+        specification.validate()
+
+        return specification
+
+    def test_rotation_covers_every_entry(self):
+        sampler = RotationSampler(fraction=0.3, rotation_runs=4)
+
+        for run in range(3):
+            self.run_validation(sampler)
+            self.assertEqual(sampler.get_coverage()["selected_count"], 3)
+
+        self.assertEqual(sampler.get_coverage()["never_verified_count"], 1)
+
+        self.run_validation(sampler)
+        self.assertEqual(len(set(self.downloads)), 10)
+        self.assertEqual(sampler.get_coverage()["overdue_count"], 0)
+        self.assertIsNotNone(sampler.get_coverage()["oldest_verification"])
+
+    def test_byte_budget(self):
+        sampler = RotationSampler(byte_budget=60)
+        self.run_validation(sampler)
+
+        coverage = sampler.get_coverage()
+        self.assertLessEqual(coverage["selected_bytes"], 60)
+        self.assertEqual(len(self.downloads), coverage["selected_count"])
+
+    def test_state_is_saved(self):
+        path = os.path.join(self.directory, "rotation.json")
+        self.run_validation(RotationSampler(path, fraction=0.5))
+        first_downloads = set(self.downloads)
+
+        self.downloads = []
+        self.run_validation(RotationSampler(path, fraction=0.5))
+
+        self.assertEqual(len(first_downloads), 5)
+        self.assertEqual(first_downloads & set(self.downloads), set())
+
+
+class TestSandboxVerification(ArtifactTestCase):
+    def setUp(self):
+        super(TestSandboxVerification, self).setUp()
+
+        os.makedirs(os.path.join(self.directory, "sandbox", "data"))
+        self.specification_json = {"data": {}}
+
+        for name, content in [("same", "unchanged"), ("changed", "original"), ("deleted", "gone"), ("empty", "")]:
+            path = self.write_artifact(os.path.join("sandbox", "data", name), content)
+            self.specification_json["data"][name] = get_file_info_json(path, content, mountpoint="/data/" + name)
+
+        self.write_artifact(os.path.join("sandbox", "data", "changed"), "modified")
+        os.remove(os.path.join(self.directory, "sandbox", "data", "deleted"))
+
+    def test_drift_is_reported(self):
+        for processes in [1, 2]:
+            specification = UmbrellaSpecification(self.specification_json)
+
+            self.assertFalse(specification.verify_sandbox(os.path.join(self.directory, "sandbox"), processes))
+            self.assertEqual(
+                sorted((error.file_name, error.error_code) for error in specification.error_log),
+                [("changed", WRONG_MD5_ERROR_CODE), ("deleted", SANDBOX_FILE_MISSING_ERROR_CODE)]
+            )
+
+    def test_mountpoint_outside_sandbox(self):
+        self.specification_json["data"]["same"]["mountpoint"] = "/../../etc/passwd"
+        del self.specification_json["data"]["changed"]
+        del self.specification_json["data"]["deleted"]
+
+        specification = UmbrellaSpecification(self.specification_json)
+
+        self.assertFalse(specification.verify_sandbox(os.path.join(self.directory, "sandbox")))
+        self.assertEqual(
+            [(error.file_name, error.error_code) for error in specification.error_log],
+            [("same", SANDBOX_ESCAPE_ERROR_CODE)]
+        )
+
+    def test_link_outside_sandbox(self):
+        os.symlink(self.directory, os.path.join(self.directory, "sandbox", "outside"))
+        self.write_artifact("secret", "unchanged")
+        self.specification_json["data"]["same"]["mountpoint"] = "/outside/secret"
+        del self.specification_json["data"]["changed"]
+        del self.specification_json["data"]["deleted"]
+        specification = UmbrellaSpecification(self.specification_json)
+
+        self.assertFalse(specification.verify_sandbox(os.path.join(self.directory, "sandbox")))
+        self.assertEqual([error.error_code for error in specification.error_log], [SANDBOX_ESCAPE_ERROR_CODE])
+
+
+class TestSpecificationGenerator(unittest.TestCase):
+    def test_generated_specifications(self):
+        self.assertEqual(generate_specification(50, seed=3), generate_specification(50, seed=3))
+
+        for error_density in [0.0, 0.5]:
+            specification_json, error_count = generate_specification(100, 10, 10, 3, error_density, seed=1)
+            specification = UmbrellaSpecification(specification_json, ValidationContext(verify_downloads=False))
+
+            self.assertEqual(specification.validate(), error_count == 0)
+            self.assertEqual(len(specification.error_log), error_count)
+            self.assertEqual(len(specification_json["data"]), 100)
+
+
+class TestMemoryBounds(unittest.TestCase):
+    def test_download_memory_is_flat(self):
+        small_result = benchmarks.benchmark_download_memory(1024 ** 2)
+        large_result = benchmarks.benchmark_download_memory(16 * 1024 ** 2)
+
+        self.assertLess(large_result["peak_memory"], 2 * small_result["peak_memory"] + benchmarks.DOWNLOAD_CHUNK_BOUND)
+
+    def test_validation_memory(self):
+        benchmarks.benchmark_validation_memory(10000, error_density=0.5)  # Raises when a bound is broken
+
+
+class TestValidationProfiler(ArtifactTestCase):
+    def get_specification_json(self):
+        content = "profiled " * 1000
+        path = self.write_artifact("profiled", content)
+
+        return {"data": {"profiled": get_file_info_json(path, content)}, "environ": {"PWD": "/tmp"}}
+
+    def test_profile_directory(self):
+        profile_directory = os.path.join(self.directory, "profile")
+        specification = UmbrellaSpecification(self.get_specification_json())
+        specification.validate(profile_directory=profile_directory)
+
+        file_names = os.listdir(profile_directory)
+        self.assertIn(ALL_STATS_FILE_NAME, file_names)
+        self.assertIn(COLLAPSED_STACKS_FILE_NAME, file_names)
+        self.assertIn("data.profiled.pstats", file_names)
+        self.assertIn("environ.pstats", file_names)
+
+    def test_max_depth(self):
+        profiler = ValidationProfiler(sample_interval=0.001, max_depth=1)
+        profiler.start()
+        context = ValidationContext(profiler=profiler)
+        UmbrellaSpecification(json.dumps(self.get_specification_json()), context).validate()
+        profiler.stop()
+
+        file_names = os.listdir(self.directory)
+        profiler.write(self.directory)
+        file_names = sorted(set(os.listdir(self.directory)) - set(file_names))
+
+        self.assertIn("parse.pstats", file_names)
+        self.assertIn("data.pstats", file_names)
+        self.assertNotIn("data.profiled.pstats", file_names)
+
+        with open(os.path.join(self.directory, COLLAPSED_STACKS_FILE_NAME)) as collapsed_stacks_file:
+            for line in collapsed_stacks_file:
+                self.assertRegexpMatches(line, r"^[^; ]+;[^ ]+ \d+$")
+
+    def test_collapsed_stack_labels(self):
+        profiler = ValidationProfiler(sample_interval=0.001)
+        profiler.start()
+
+        with profiler.section("my data;v2"):
+            time.sleep(0.05)
+
+        profiler.stop()
+        profiler.write(self.directory)
+
+        with open(os.path.join(self.directory, COLLAPSED_STACKS_FILE_NAME)) as collapsed_stacks_file:
+            lines = collapsed_stacks_file.readlines()
+
+        self.assertTrue(lines)
+
+        for line in lines:
+            self.assertRegexpMatches(line, r"^my_data:v2;[^ ]+ \d+$")
+
+    def test_colliding_file_names(self):
+        profiler = ValidationProfiler()
+        profiler.start()
+
+        for label in ["a/b", "a_b", "all"]:
+            with profiler.section(label):
+                sum(range(1000))
+
+        profiler.stop()
+        paths = profiler.write(self.directory)
+
+        self.assertEqual(len(set(paths)), 5)  # Three sections, all.pstats and the collapsed stacks
+        self.assertEqual(len(os.listdir(self.directory)), 5)
+
+
+class TestTransports(ArtifactTestCase):
+    def test_file_transport(self):
+        path = self.write_artifact("ranged", "0123456789")
+        url = "file://" + urllib.pathname2url(path)
+        transport = FileTransport()
+
+        self.assertEqual(transport.stat(url).total_size, 10)
+        self.assertEqual(transport.read_range(url, 3, 4), "3456")
+        self.assertEqual(transport.read_range(url, 8, 4), "89")
+
+        with transport.open(url) as stream:
+            self.assertEqual((stream.read(), stream.size), ("0123456789", 10))
+
+    def test_registered_schemes(self):
+        memory_transport = MemoryTransport({"site://artifacts/tool": "tool bytes"})
+        transports = TransportRegistry({"site": memory_transport})
+        file_info_json = get_file_info_json("unused", "tool bytes", source=["site://artifacts/tool"])
+        context = ValidationContext(transports=transports)
+
+        self.assertTrue(FileInfo("tool", SOFTWARE, file_info_json, context).validate([]))
+        self.assertEqual(memory_transport.request_count, 1)
+
+        error_log = []
+        file_info_json["source"] = ["gopher://artifacts/tool"]
+
+        self.assertTrue(FileInfo("tool", SOFTWARE, file_info_json, context).validate(error_log))
+        self.assertEqual([error.error_code for error in error_log], [BAD_URL_ERROR_CODE])
+        self.assertIn("gopher", error_log[0].description)
+
+
+class TestDistributedValidation(ArtifactTestCase):
+    def setUp(self):
+        super(TestDistributedValidation, self).setUp()
+
+        self.queue_path = os.path.join(self.directory, "queue.sqlite")
+
+    def get_specifications(self):
+        good_path = self.write_artifact("good", "good bytes")
+        bad_path = self.write_artifact("bad", "bad bytes")
+        data = {"good": get_file_info_json(good_path, "good bytes"), "bad": get_file_info_json(bad_path, "other")}
+
+        return {
+            "first": UmbrellaSpecification({"data": data}),
+            "second": UmbrellaSpecification({"data": {"good-copy": data["good"]}}),
+        }
+
+    def test_batch(self):
+        coordinator = Coordinator(WorkQueue(self.queue_path))
+
+        self.assertEqual(coordinator.submit("batch", self.get_specifications()), 2)
+        self.assertFalse(coordinator.is_finished("batch"))
+
+        worker = Worker(WorkQueue(self.queue_path), worker_id="worker")
+        self.assertEqual(worker.run("batch", idle_timeout=0), 2)
+
+        results = coordinator.wait("batch", poll_interval=0)
+        first_error_codes = [(error.file_name, error.error_code) for error in results["first"][1]]
+
+        self.assertIn(("bad", WRONG_MD5_ERROR_CODE), first_error_codes)
+        self.assertNotIn("good", [file_name for file_name, error_code in first_error_codes])
+        self.assertNotIn(WRONG_MD5_ERROR_CODE, [error.error_code for error in results["second"][1]])
+
+    def test_lease_expiry(self):
+        work_queue = WorkQueue(self.queue_path, lease_seconds=-1, max_attempts=2)
+        Coordinator(work_queue).submit("batch", {"only": self.get_specifications()["second"]})
+
+        first_lease = work_queue.lease("first")
+        self.assertEqual(len(first_lease), 1)
+        self.assertEqual(len(work_queue.lease("second")), 1)  # The first lease expired at once
+        self.assertFalse(work_queue.complete(first_lease[0][0], "first", {"is_valid": True, "errors": []}))
+
+        self.assertEqual(work_queue.lease("third"), [])  # Out of attempts
+        self.assertTrue(work_queue.is_finished("batch"))
+
+        is_valid, error_log = Coordinator(work_queue).collect("batch")["only"]
+        self.assertFalse(is_valid)
+        self.assertIn(WORK_ITEM_FAILED_ERROR_CODE, [error.error_code for error in error_log])
+
+    def test_lease_renewal(self):
+        Coordinator(WorkQueue(self.queue_path)).submit("batch", {"only": self.get_specifications()["second"]})
+        worker = _SlowWorker(WorkQueue(self.queue_path, lease_seconds=0.3), worker_id="slow")
+
+        self.assertTrue(worker.run_once("batch"))
+        self.assertEqual(worker.stolen, [])  # The heartbeat kept the lease past its 0.3 seconds
+        self.assertEqual(WorkQueue(self.queue_path).get_counts("batch"), {"done": 1})
+
+    def test_submit_twice(self):
+        coordinator = Coordinator(WorkQueue(self.queue_path))
+        specifications = self.get_specifications()
+
+        self.assertEqual(coordinator.submit("batch", specifications), 2)
+        self.assertEqual(coordinator.submit("batch", specifications), 2)
+
+        references = [item[4] for item in coordinator.work_queue.get_work_items("batch")]
+        self.assertEqual(sorted(len(item_references) for item_references in references), [1, 2])
+
+
+class _SlowWorker(Worker):
+    # Verifies for longer than the lease, while another worker tries to take the item
+    def __init__(self, *args, **kwargs):
+        super(_SlowWorker, self).__init__(*args, **kwargs)
+        self.stolen = None
+
+    def verify(self, payload):
+        time.sleep(1.0)
+        self.stolen = WorkQueue(self.work_queue.path).lease("thief")
+
+        return super(_SlowWorker, self).verify(payload)
+
+
+class _ShuffledMemoryTransport(MemoryTransport):
+    # Ranges take a random time, so they finish out of order
+    def __init__(self, sources, accepts_ranges=True):
+        super(_ShuffledMemoryTransport, self).__init__(sources)
+        self.accepts_ranges = accepts_ranges
+        self.range_count = 0
+
+    def stat(self, url, timeout=None):
+        return SourceInfo(len(self.sources[url]), self.accepts_ranges)
+
+    def read_range(self, url, offset, length, timeout=None):
+        time.sleep(random.random() / 1000)
+        self.range_count += 1
+
+        return super(_ShuffledMemoryTransport, self).read_range(url, offset, length, timeout)
+
+
+class _RangeIgnoringMemoryTransport(_ShuffledMemoryTransport):
+    # Advertises ranges but sends the whole source for every one, like a server answering 200 instead of 206
+    def open_range(self, url, offset, length, timeout=None):
+        return self.open(url, timeout)
+
+
+class _TimingOutMemoryTransport(_ShuffledMemoryTransport):
+    # The connection times out partway through the ranges after the first ones
+    def read_range(self, url, offset, length, timeout=None):
+        if offset >= 1000:
+            raise socket.timeout("timed out")
+
+        return super(_TimingOutMemoryTransport, self).read_range(url, offset, length, timeout)
+
+
+class _BrokenMemoryTransport(_ShuffledMemoryTransport):
+    def read_range(self, url, offset, length, timeout=None):
+        raise RuntimeError("unexpected failure")
+
+
+class TestParallelRanges(unittest.TestCase):
+    def setUp(self):
+        self.content = "".join(chr(random.randint(0, 255)) for i in range(5000))
+        self.url = "memory://big"
+
+    def validate(self, transport):
+        file_info_json = get_file_info_json("unused", self.content, source=[self.url])
+        context = ValidationContext(
+            transports=TransportRegistry({"memory": transport}), range_connections=4, range_size=100
+        )
+
+        return FileInfo("big", DATA_FILES, file_info_json, context).validate([])
+
+    def test_ranges_are_read_in_order(self):
+        transport = _ShuffledMemoryTransport({self.url: self.content})
+
+        self.assertTrue(self.validate(transport))
+        self.assertEqual(transport.range_count, 49)  # open_source() read the first range to check it was one
+
+    def test_single_stream_fallback(self):
+        transport = _ShuffledMemoryTransport({self.url: self.content}, accepts_ranges=False)
+
+        self.assertTrue(self.validate(transport))
+        self.assertEqual(transport.range_count, 0)
+
+    def test_ignored_ranges(self):
+        transport = _RangeIgnoringMemoryTransport({self.url: self.content})
+
+        self.assertTrue(self.validate(transport))
+        self.assertEqual(transport.range_count, 0)
+
+    def test_buffer_is_bounded(self):
+        transport = _ShuffledMemoryTransport({self.url: self.content})
+        reader = ParallelRangeReader(transport, self.url, len(self.content), 4, 100, max_buffered_ranges=3)
+        time.sleep(0.05)
+
+        self.assertLessEqual(transport.range_count, 3)
+        self.assertEqual(reader.read(), self.content)
+
+    def test_timeout_is_reported(self):
+        error_log = []
+        file_info_json = get_file_info_json("unused", self.content, source=[self.url])
+        context = ValidationContext(
+            transports=TransportRegistry({"memory": _TimingOutMemoryTransport({self.url: self.content})}),
+            range_connections=4, range_size=100
+        )
+
+        # Reported like any other url error, instead of hanging
+        FileInfo("big", DATA_FILES, file_info_json, context).validate(error_log)
+        self.assertEqual([error.error_code for error in error_log], [BAD_URL_ERROR_CODE])
+        self.assertIn("timed out", error_log[0].description)
+
+    def test_unexpected_error_fails_the_read(self):
+        reader = ParallelRangeReader(_BrokenMemoryTransport({self.url: self.content}), self.url, len(self.content), 4, 100)
+
+        self.assertRaises(TransportError, reader.read)
+
+
+class TestSpecificationWatcher(ArtifactTestCase):
+    def setUp(self):
+        super(TestSpecificationWatcher, self).setUp()
+
+        self.downloads = []
+        path = self.write_artifact("tool", "tool bytes")
+        self.specification_json = {
+            "software": {"tool": get_file_info_json(path, "tool bytes")}, "environ": {"PWD": "/tmp"},
+        }
+        self.watcher = SpecificationWatcher(self.directory, context=ValidationContext(listeners=[self.record_download]))
+
+    def record_download(self, event, **fields):
+        if event == "download_started":
+            self.downloads.append(fields["url"])
+
+    def write_specification(self, name, modification_time):
+        path = self.write_artifact(name, json.dumps(self.specification_json))
+        os.utime(path, (modification_time, modification_time))
+
+        return path
+
+    def test_incremental_validation(self):
+        path = self.write_specification("tool.umbrella", 1000)
+        events = self.watcher.check()
+
+        self.assertEqual([event["event"] for event in events], ["result"])
+        self.assertIn("software", events[0]["validated_components"])
+        self.assertEqual(self.watcher.check(), [])
+
+        self.specification_json["environ"]["PWD"] = "/home"
+        self.write_specification("tool.umbrella", 2000)
+        events = self.watcher.check()
+
+        self.assertEqual(events[0]["validated_components"], ["environ"])
+        self.assertEqual(len(self.downloads), 1)
+        self.assertIn("REQ_SECT_MISS", [error["error_code"] for error in events[0]["errors"]])
+
+        self.write_artifact("tool.umbrella", "{ not json")
+        self.assertEqual(self.watcher.check()[0]["event"], "failed")
+
+        os.remove(path)
+        self.assertEqual(self.watcher.check(), [{"event": "removed", "path": path}])
+
+    def test_temporary_errors_are_validated_again(self):
+        tool_path = os.path.join(self.directory, "tool")
+        os.rename(tool_path, tool_path + ".away")
+        self.write_specification("tool.umbrella", 1000)
+        events = self.watcher.check()
+
+        self.assertIn(BAD_URL_ERROR_CODE, [error["error_code"] for error in events[0]["errors"]])
+
+        # The specification didn't change, but its download failure may have been temporary
+        os.rename(tool_path + ".away", tool_path)
+        events = self.watcher.check()
+
+        self.assertEqual(events[0]["validated_components"], ["software"])
+        self.assertNotIn(BAD_URL_ERROR_CODE, [error["error_code"] for error in events[0]["errors"]])
+        self.assertEqual(self.watcher.check(), [])
+
+
+def get_tar(tar_format=tarfile.PAX_FORMAT):
+    tar_bytes = StringIO()
+    tar = tarfile.open(fileobj=tar_bytes, mode="w", format=tar_format)
+
+    for name, content in [("usr/bin/python2.7", "python"), ("usr/lib/" + "long-name-" * 20, "x" * 1000)]:
+        member = tarfile.TarInfo(name)
+        member.size = len(content)
+        member.mode = 0755
+        tar.addfile(member, StringIO(content))
+
+    directory = tarfile.TarInfo("./etc")
+    directory.type = tarfile.DIRTYPE
+    tar.addfile(directory)
+    tar.close()
+
+    return tar_bytes.getvalue()
+
+
+class TestTarManifest(ArtifactTestCase):
+    def test_reader(self):
+        for tar_format in [tarfile.GNU_FORMAT, tarfile.PAX_FORMAT]:  # Their two ways of storing long names
+            tar_bytes = get_tar(tar_format)
+            reader = TarManifestReader()
+
+            for offset in range(0, len(tar_bytes), 37):  # Headers split across chunks
+                reader.update(tar_bytes[offset:offset + 37])
+
+            reader.finish()
+
+            self.assertIsNone(reader.error)
+            self.assertEqual(
+                [(member.path, member.size, member.mode) for member in reader.members],
+                [("usr/bin/python2.7", 6, 0755), ("usr/lib/" + "long-name-" * 20, 1000, 0755), ("etc", 0, 0644)]
+            )
+
+        reader = TarManifestReader()
+        reader.update(get_tar()[:1024])
+        reader.finish()
+        self.assertIsNotNone(reader.error)
+
+    def test_manifest_is_stored_while_hashing(self):
+        manifest_store = ManifestStore(os.path.join(self.directory, "manifests"))
+        context = ValidationContext(manifest_store=manifest_store)
+
+        for file_format, content in [("tgz", gzip_compress(get_tar())), ("tar", get_tar())]:
+            path = self.write_artifact("image." + file_format, content)
+            file_info_json = get_file_info_json(path, content, format=file_format)
+
+            self.assertTrue(FileInfo("image", SOFTWARE, file_info_json, context).validate([]))
+            self.assertTrue(manifest_store.contains_member(file_info_json["checksum"], "/usr/bin/python2.7"))
+            self.assertFalse(manifest_store.contains_member(file_info_json["checksum"], "/usr/bin/python3"))
+
+            with manifest_store.open(file_info_json["checksum"]) as manifest:
+                self.assertEqual(len(list(manifest)), 3)
+                self.assertEqual([member.path for member in manifest.list_directory("/usr/bin")], ["usr/bin/python2.7"])
+                self.assertEqual(manifest.get_member("./etc/").type, tarfile.DIRTYPE)
+
+    def test_malformed_archive(self):
+        content = "this is not a tar archive\n" * 100
+        path = self.write_artifact("image.tar", content)
+        file_info_json = get_file_info_json(path, content, format="tar")
+        manifest_store = ManifestStore(os.path.join(self.directory, "manifests"))
+
+        reader = TarManifestReader()
+        reader.update(content)
+        reader.finish()
+        self.assertEqual(reader.error, "Invalid tar header after 0 members")
+
+        # The checksum matches, so only the manifest is left out
+        context = ValidationContext(manifest_store=manifest_store)
+        self.assertTrue(FileInfo("image", SOFTWARE, file_info_json, context).validate([]))
+        self.assertFalse(manifest_store.contains(file_info_json["checksum"]))
+
+        error_log = []
+        context = ValidationContext(manifest_store=manifest_store, check_decompression=True)
+        self.assertFalse(FileInfo("image", SOFTWARE, file_info_json, context).validate(error_log))
+        self.assertEqual([error.error_code for error in error_log], [CORRUPT_ARCHIVE_ERROR_CODE])
+
+    def test_oversized_extended_header(self):
+        pax_header = tarfile.TarInfo("././@PaxHeader")
+        pax_header.type = tarfile.XHDTYPE
+        pax_header.size = 1024 ** 3  # Only the header is sent, the reader must not wait to buffer the rest
+        content = pax_header.tobuf(tarfile.USTAR_FORMAT) + "x" * BLOCK_SIZE
+        path = self.write_artifact("image.tar", content)
+        file_info_json = get_file_info_json(path, content, format="tar")
+
+        reader = TarManifestReader()
+        reader.update(content)
+        self.assertIn("over the limit", reader.error)
+
+        error_log = []
+        context = ValidationContext(
+            manifest_store=ManifestStore(os.path.join(self.directory, "manifests")), check_decompression=True
+        )
+        self.assertFalse(FileInfo("image", SOFTWARE, file_info_json, context).validate(error_log))
+        self.assertEqual([error.error_code for error in error_log], [CORRUPT_ARCHIVE_ERROR_CODE])
+
+
+class TestPackages(unittest.TestCase):
+    def test_parse_package_list(self):
+        self.assertEqual(
+            parse_package_list("python cmake>=2.8, boost-devel == 1.41.0 zlib>= 1.2"),
+            [
+                PackageRequirement("python"), PackageRequirement("cmake", ">=", "2.8"),
+                PackageRequirement("boost-devel", "==", "1.41.0"), PackageRequirement("zlib", ">=", "1.2"),
+            ]
+        )
+        self.assertEqual(parse_package_list(" "), [])
+        self.assertRaises(ValueError, parse_package_list, "python >=")
+        self.assertRaises(ValueError, parse_package_list, "python>=>2")
+
+    def test_versions(self):
+        self.assertEqual(compare_versions("1.10", "1.9"), 1)
+        self.assertEqual(compare_versions("2.6.32-431.el6", "2.6.32-431.el6"), 0)
+        self.assertEqual(compare_versions("1.0", "1.0.1"), -1)
+        self.assertTrue(PackageRequirement("zlib", ">=", "1.2-3").is_satisfied_by("1.2", "3.el6"))
+        self.assertFalse(PackageRequirement("zlib", "<", "1.2").is_satisfied_by("1.2.3"))
+        self.assertEqual(get_conflicts(parse_package_list("a==1 a=2 b>=2 b<1 c>=1 c<=1 d>1 d<=1 e")), ["a", "b", "d"])
+
+    def test_component_errors(self):
+        for package_list, error_codes in [
+            ("python cmake>=2.8", []), ("cmake >=", [BAD_PACKAGE_LIST_ERROR_CODE]),
+            ("cmake>=3 cmake<2", [CONFLICTING_PACKAGES_ERROR_CODE]),
+        ]:
+            error_log = []
+            component = PackageManagerComponent(PACKAGE_MANAGER, {"name": "yum", "list": package_list, "config": {}})
+
+            self.assertEqual(component.validate(error_log), not error_codes)
+            self.assertEqual([error.error_code for error in error_log], error_codes)
+
+
+def get_primary_metadata(packages):
+    entries = "".join(
+        '<package type="rpm"><name>' + name + '</name><arch>x86_64</arch>'
+        '<version epoch="0" ver="' + version + '" rel="' + release + '"/>'
+        '<format><rpm:provides><rpm:entry name="' + name + '(x86-64)"/></rpm:provides></format></package>'
+        for name, version, release in packages
+    )
+
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<metadata xmlns="http://linux.duke.edu/metadata/common" xmlns:rpm="http://linux.duke.edu/metadata/rpm" '
+        'packages="' + str(len(packages)) + '">' + entries + '</metadata>'
+    )
+
+
+class TestRepositoryIndex(ArtifactTestCase):
+    def setUp(self):
+        super(TestRepositoryIndex, self).setUp()
+        self.transport = MemoryTransport({
+            "memory://mirror/x86_64/repodata/repomd.xml":
+                '<repomd xmlns="http://linux.duke.edu/metadata/repo"><data type="primary">'
+                '<location href="repodata/primary.xml.gz"/></data></repomd>',
+            "memory://mirror/x86_64/repodata/primary.xml.gz": gzip_compress(get_primary_metadata([
+                ("cmake", "2.8.12", "2.el6"), ("zlib", "1.2.3", "29.el6"),
+            ])),
+        })
+        self.config = "[base]\nname=Base\nbaseurl=memory://mirror/$basearch/\n\n[disabled]\nbaseurl=memory://gone/\nenabled=0\n"
+        self.transport.add("memory://configs/base.repo", self.config)
+        self.transports = TransportRegistry({"memory": self.transport})
+
+    def get_specification(self, context, package_list):
+        return UmbrellaSpecification({
+            "hardware": {"arch": "x86_64", "cores": "1", "memory": "1GB", "disk": "1GB"},
+            "package_manager": {
+                "name": "yum", "list": package_list,
+                "config": {
+                    "base.repo": get_file_info_json("base.repo", self.config, source=["memory://configs/base.repo"]),
+                },
+            },
+        }, context)
+
+    def test_resolution(self):
+        repository_index = RepositoryIndex(os.path.join(self.directory, "repositories.sqlite"), self.transports)
+        context = ValidationContext(transports=self.transports, repository_index=repository_index)
+        specification = self.get_specification(context, "cmake>=2.8 zlib>=1.2.5 zlib(x86-64) python")
+
+        specification.validate()
+
+        self.assertEqual(
+            [(error.error_code, error.description.split('"')[1]) for error in specification.warning_log],
+            [(MISSING_PACKAGE_ERROR_CODE, "zlib>=1.2.5"), (MISSING_PACKAGE_ERROR_CODE, "python")]
+        )
+        self.assertIn("1.2.3-29.el6", specification.warning_log[0].description)
+
+        # Another specification with the same config is resolved from the index, without downloading anything
+        request_count = self.transport.request_count
+        specification = self.get_specification(context.copy(verify_downloads=False), "cmake zlib")
+
+        self.assertEqual(specification.resolve_packages(), [])
+        self.assertEqual(self.transport.request_count, request_count)
+
+    def test_unverified_config_is_not_resolved(self):
+        repository_index = RepositoryIndex(os.path.join(self.directory, "repositories.sqlite"), self.transports)
+        context = ValidationContext(transports=self.transports, repository_index=repository_index)
+        specification = self.get_specification(context, "python")
+        specification.specification_json["package_manager"]["config"]["base.repo"]["size"] = "1"
+
+        specification.validate()
+
+        self.assertEqual(specification.warning_log, [])
+        self.assertFalse(repository_index.contains_config(hashlib.md5(self.config).hexdigest()))
+
+
+class TestVerificationReceipts(ArtifactTestCase):
+    def setUp(self):
+        super(TestVerificationReceipts, self).setUp()
+
+        self.transport = MemoryTransport({"memory://os": "os image", "memory://tool": "tool bytes"})
+        self.context = ValidationContext(transports=TransportRegistry({"memory": self.transport}))
+        self.specification = UmbrellaSpecification({
+            "hardware": {"arch": "x86_64", "cores": "1", "memory": "1GB", "disk": "1GB"},
+            "kernel": {"name": "linux", "version": ">=2.6.32"},
+            "os": get_file_info_json("os", "os image", source=["memory://os"], name="centos", version="6.6"),
+            "software": {"tool": get_file_info_json("tool", "tool bytes", source=["memory://tool"])},
+            "output": {"files": [], "dirs": []},
+        }, self.context)
+
+    def test_receipt(self):
+        self.assertRaises(ValueError, self.specification.get_receipt)
+        self.assertTrue(self.specification.validate())
+
+        # The validators of the downloads were recorded, so nothing is probed
+        request_count = self.transport.request_count
+        receipt = VerificationReceipt.from_json(self.specification.get_receipt("secret").dumps())
+        self.assertEqual(self.transport.request_count, request_count)
+        self.assertEqual(len(receipt.artifacts), 2)
+
+        self.assertTrue(self.specification.check_receipt(receipt, "secret"))
+        self.assertEqual(self.transport.request_count, request_count + 2)  # One probe per source
+
+        self.transport.add("memory://tool", "new tool bytes")
+        self.assertFalse(self.specification.check_receipt(receipt, "secret"))
+        self.assertEqual(
+            [(error.error_code, error.file_name) for error in self.specification.error_log],
+            [(STALE_RECEIPT_ERROR_CODE, "tool")]
+        )
+
+    def test_untrusted_receipt(self):
+        self.specification.validate()
+        receipt = self.specification.get_receipt("secret")
+
+        for check_arguments in [("other secret",), ("secret", ARCHIVE_LEVEL), ("secret", CHECKSUM_LEVEL, -1)]:
+            self.assertFalse(self.specification.check_receipt(receipt, *check_arguments))
+            self.assertEqual([error.error_code for error in self.specification.error_log], [BAD_RECEIPT_ERROR_CODE])
+
+        self.assertFalse(self.specification.check_receipt(self.specification.get_receipt(), "secret"))  # Not signed
+
+        self.specification.specification_json["kernel"]["version"] = ">=3.10"
+        self.assertFalse(self.specification.check_receipt(receipt, "secret"))
+
+    def test_stored_sources_are_unverified(self):
+        context = self.context.copy(artifact_store=ArtifactStore(os.path.join(self.directory, "store")))
+        specification = UmbrellaSpecification(self.specification.specification_json, context)
+        self.assertTrue(specification.validate())
+
+        # The store answers, so the changed tool isn't downloaded again
+        self.transport.add("memory://tool", "new tool bytes")
+        self.assertTrue(specification.validate())
+        receipt = specification.get_receipt()
+
+        self.assertEqual([artifact["validators"] for artifact in receipt.artifacts], [None, None])
+        self.assertFalse(specification.check_receipt(receipt))
+        self.assertEqual(
+            sorted((error.error_code, error.file_name) for error in specification.error_log),
+            [(STALE_RECEIPT_ERROR_CODE, "centos"), (STALE_RECEIPT_ERROR_CODE, "tool")]
+        )
+        self.assertTrue(specification.check_receipt(receipt, level=SAMPLED_LEVEL))
+
+
+class TestCompiledSchema(unittest.TestCase):
+    def test_required_sections(self):
+        required_sections = [
+            component_name for component_name in SPECIFICATION_ROOT_COMPONENT_NAMES
+            if Component.get_specific_component(component_name, None).is_required
+        ]
+
+        self.assertEqual(sorted(get_compiled_schema().required_sections), sorted(required_sections))
+
+    def test_errors(self):
+        specification_json = json.load(open(VALID_FILE))
+        del specification_json["os"]["size"]
+        specification_json["environ"]["PWD"] = 1
+        specification_json["data"].values()[0]["source"] = ["http://example.org/a", 2]
+        specification = UmbrellaSpecification(specification_json, ValidationContext(verify_downloads=False))
+
+        self.assertFalse(specification.validate())
+        self.assertEqual(
+            sorted((error.error_code, error.component_name, error.description) for error in specification.error_log),
+            [
+                (REQUIRED_ATTRIBUTE_MISSING_ERROR_CODE, "os", 'Attribute "size" is required'),
+                (
+                    WRONG_ATTRIBUTE_TYPE_ERROR_CODE, "data",
+                    'Attribute "source" is of type "int" but should be of type "string"'
+                ),
+                (
+                    WRONG_ATTRIBUTE_TYPE_ERROR_CODE, "environ",
+                    'Attribute "PWD" is of type "int" but should be of type "string"'
+                ),
+            ]
+        )
+
+    def test_same_errors_as_walk(self):
+        result = benchmarks.benchmark_schema_validation(200, error_density=0.5)  # Raises when the errors differ
+        self.assertGreater(result["error_count"], 0)
+
+
+class LicenseComponent(Component):
+    _type = (str, unicode)
+    is_required = True
+
+
+class TestComponentRegistry(unittest.TestCase):
+    def tearDown(self):
+        COMPONENT_CLASSES.pop("license", None)
+
+        if "license" in SPECIFICATION_ROOT_COMPONENT_NAMES:
+            SPECIFICATION_ROOT_COMPONENT_NAMES.remove("license")
+
+    def test_new_section(self):
+        register_component("license", LicenseComponent)
+        specification = UmbrellaSpecification(json.load(open(VALID_FILE)), ValidationContext(verify_downloads=False))
+
+        self.assertIsInstance(specification.get_component("license"), MissingComponent)
+        self.assertFalse(specification.validate())
+        self.assertEqual(
+            [(error.error_code, error.component_name) for error in specification.error_log],
+            [(REQUIRED_SECTION_MISSING_ERROR_CODE, "license")]
+        )
+
+        specification.specification_json["license"] = ["MIT"]
+        self.assertFalse(specification.validate())
+        self.assertEqual(specification.error_log[0].error_code, WRONG_SECTION_TYPE_ERROR_CODE)
+
+        specification.specification_json["license"] = "MIT"
+        self.assertTrue(specification.validate())
+
+    def test_unknown_section(self):
+        self.assertRaises(ValueError, Component.get_specific_component, "license", None)
+        self.assertRaises(TypeError, register_component, "license", dict)
+        self.assertNotIn("license", SPECIFICATION_ROOT_COMPONENT_NAMES)
+
+    def test_cold_start(self):
+        # Raises when importing umbrella or validating the structure loaded the network or hashing layers
+        result = benchmarks.benchmark_cold_start(10, runs=1)
+        self.assertGreater(result["import_seconds"], 0)
+
+
+class TestSpecificationCache(ArtifactTestCase):
+    def setUp(self):
+        super(TestSpecificationCache, self).setUp()
+        self.specification_cache = SpecificationCache(os.path.join(self.directory, "cache"))
+        self.context = ValidationContext(verify_downloads=False, specification_cache=self.specification_cache)
+
+    def get_specification_text(self):
+        # Every source is a local file. The data entry has the wrong checksum
+        os_path = self.write_artifact("os.tar.gz", "os bytes")
+        data_path = self.write_artifact("scenario.xml", "data bytes")
+        specification_json = json.load(open(VALID_FILE))
+        del specification_json["package_manager"], specification_json["software"]
+        specification_json["os"].update(get_file_info_json(os_path, "os bytes", format="tgz"))
+        specification_json["data"] = {"scenario.xml": get_file_info_json(data_path, "data bytes", checksum="0" * 32)}
+
+        return json.dumps(specification_json)
+
+    def test_cached_specification(self):
+        specification_text = self.get_specification_text()
+        key = self.specification_cache.get_key(specification_text)
+        specification = UmbrellaSpecification(specification_text, self.context)
+
+        self.assertTrue(specification.validate())
+        self.assertTrue(self.specification_cache.contains(key))
+
+        cached_specification = UmbrellaSpecification(StringIO(specification_text), self.context)
+        self.assertEqual(cached_specification.specification_json, json.loads(specification_text))
+
+        # Structural checks are skipped, but downloads are still verified
+        self.assertTrue(cached_specification.validate())
+
+        cached_specification.context = self.context.copy(verify_downloads=True)
+        self.assertFalse(cached_specification.validate())
+        self.assertEqual([error.error_code for error in cached_specification.error_log], [WRONG_MD5_ERROR_CODE])
+
+    def test_structure_is_not_checked_again(self):
+        specification_text = self.get_specification_text()
+        specification_json = json.loads(specification_text)
+        del specification_json["hardware"]
+        self.specification_cache.save(self.specification_cache.get_key(specification_text), specification_json)
+
+        specification = UmbrellaSpecification(specification_text, self.context)
+        self.assertNotIn("hardware", specification.specification_json)
+        self.assertTrue(specification.validate())
+
+    def test_invalid_specification_is_not_cached(self):
+        specification_json = json.loads(self.get_specification_text())
+        del specification_json["hardware"]
+        specification_text = json.dumps(specification_json)
+
+        self.assertFalse(UmbrellaSpecification(specification_text, self.context).validate())
+        self.assertFalse(self.specification_cache.contains(self.specification_cache.get_key(specification_text)))
+
+    def test_corrupt_cache_file(self):
+        specification_text = self.get_specification_text()
+        key = self.specification_cache.get_key(specification_text)
+        UmbrellaSpecification(specification_text, self.context).validate()
+
+        with open(self.specification_cache.get_path(key), "r+b") as cache_file:
+            cache_file.seek(len(CACHE_MAGIC) + 4)
+            cache_file.truncate()
+
+        self.assertIsNone(self.specification_cache.load(key))
+        self.assertFalse(self.specification_cache.contains(key))
+        self.assertTrue(UmbrellaSpecification(specification_text, self.context).validate())  # Parsed and saved again
+        self.assertTrue(self.specification_cache.contains(key))
+
+    def test_schema_change_makes_a_new_key(self):
+        specification_text = self.get_specification_text()
+        key = self.specification_cache.get_key(specification_text)
+        schema_hashes = umbrella_specification_cache._schema_hashes
+        schema_hash = schema_hashes[SCHEMA_PATH]
+
+        try:
+            schema_hashes[SCHEMA_PATH] = "0" * 64  # As if the schema file had been edited
+            self.assertNotEqual(self.specification_cache.get_key(specification_text), key)
+        finally:
+            schema_hashes[SCHEMA_PATH] = schema_hash
+
+
 if __name__ == "__main__":
     unittest.main()